@@ -114,6 +114,10 @@ Q_CLUSTER = {
     "retry": ENV.int("Q_CLUSTER_RETRY", default=120),
 }
 
+# Tasks dispatched with coldfront.core.utils.tasks.dispatch_task
+TASK_COALESCE_TIMEOUT = ENV.int("TASK_COALESCE_TIMEOUT", default=600)
+TASK_PRIORITY_CLUSTERS = ENV.dict("TASK_PRIORITY_CLUSTERS", default={})
+
 
 # ------------------------------------------------------------------------------
 # Django template and site settings
@@ -49,6 +49,13 @@ ALLOCATION_FUNCS_ON_EXPIRE = [
 # This is in days
 ALLOCATION_DEFAULT_ALLOCATION_LENGTH = ENV.int("ALLOCATION_DEFAULT_ALLOCATION_LENGTH", default=365)
 
+# ------------------------------------------------------------------------------
+# Allocation attribute that holds the account name usage records refer to
+# ------------------------------------------------------------------------------
+ALLOCATION_USAGE_ACCOUNT_ATTRIBUTE_NAME = ENV.str(
+    "ALLOCATION_USAGE_ACCOUNT_ATTRIBUTE_NAME", default="slurm_account_name"
+)
+
 # ------------------------------------------------------------------------------
 # Allow user to select account name for allocation
 # ------------------------------------------------------------------------------
@@ -83,6 +90,16 @@ ALLOCATION_ATTRIBUTE_VIEW_LIST = ENV.list(
     ],
 )
 
+# ------------------------------------------------------------------------------
+# User search
+# ------------------------------------------------------------------------------
+# Seconds to wait for additional user search sources (e.g. LDAP) to respond
+USER_SEARCH_TIMEOUT = ENV.float("USER_SEARCH_TIMEOUT", default=5)
+# Seconds to cache user search results, 0 to disable
+USER_SEARCH_CACHE_TIMEOUT = ENV.int("USER_SEARCH_CACHE_TIMEOUT", default=60)
+# Threads per process shared by all requests to query additional user search sources
+USER_SEARCH_MAX_WORKERS = ENV.int("USER_SEARCH_MAX_WORKERS", default=8)
+
 # ------------------------------------------------------------------------------
 # Enable invoice functionality
 # ------------------------------------------------------------------------------
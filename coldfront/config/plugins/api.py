@@ -3,6 +3,7 @@
 # SPDX-License-Identifier: AGPL-3.0-or-later
 
 from coldfront.config.base import INSTALLED_APPS
+from coldfront.config.env import ENV
 
 INSTALLED_APPS += ["django_filters", "rest_framework", "rest_framework.authtoken", "coldfront.plugins.api"]
 
@@ -15,4 +16,12 @@ REST_FRAMEWORK = {
     ),
     "DEFAULT_PERMISSION_CLASSES": ["rest_framework.permissions.IsAuthenticated"],
     "DEFAULT_FILTER_BACKENDS": ["django_filters.rest_framework.DjangoFilterBackend"],
+    "DEFAULT_PAGINATION_CLASS": "coldfront.plugins.api.pagination.KeysetPagination",
 }
+
+API_PAGE_SIZE = ENV.int("API_PAGE_SIZE", default=100)
+API_MAX_PAGE_SIZE = ENV.int("API_MAX_PAGE_SIZE", default=1000)
+API_PAGINATE_BY_DEFAULT = ENV.bool("API_PAGINATE_BY_DEFAULT", default=False)
+API_EXPORT_CHUNK_SIZE = ENV.int("API_EXPORT_CHUNK_SIZE", default=2000)
+API_RESPONSE_CACHE_TIMEOUT = ENV.int("API_RESPONSE_CACHE_TIMEOUT", default=0)
+API_CHANGES_FEED_LAG = ENV.int("API_CHANGES_FEED_LAG", default=300)
@@ -24,6 +24,7 @@ if ENV.bool("PLUGIN_MOKEY", default=False):
         "coldfront.plugins.mokey_oidc.auth.OIDCMokeyAuthenticationBackend",
     ]
     MOKEY_OIDC_PI_GROUP = ENV.str("MOKEY_OIDC_PI_GROUP")
+    MOKEY_OIDC_GROUP_SYNC_CACHE_TIMEOUT = ENV.int("MOKEY_OIDC_GROUP_SYNC_CACHE_TIMEOUT", default=3600)
 else:
     AUTHENTICATION_BACKENDS += [
         "mozilla_django_oidc.auth.OIDCAuthenticationBackend",
@@ -20,6 +20,9 @@ PROJECT_OPENLDAP_USE_TLS = ENV.bool("PROJECT_OPENLDAP_USE_TLS", default=False)
 PROJECT_OPENLDAP_PRIV_KEY_FILE = ENV.str("PROJECT_OPENLDAP_PRIV_KEY_FILE", default=None)
 PROJECT_OPENLDAP_CERT_FILE = ENV.str("PROJECT_OPENLDAP_CERT_FILE", default=None)
 PROJECT_OPENLDAP_CACERT_FILE = ENV.str("PROJECT_OPENLDAP_CACERT_FILE", default=None)
+PROJECT_OPENLDAP_HEALTH_CHECK_INTERVAL = ENV.float(
+    "PROJECT_OPENLDAP_HEALTH_CHECK_INTERVAL", default=60
+)  # seconds a shared connection may sit idle before it is health checked on reuse
 # OU, GID, Arhive and sync excludes
 PROJECT_OPENLDAP_OU = ENV.str("PROJECT_OPENLDAP_OU", default="")  # where projects will be stored
 PROJECT_OPENLDAP_GID_START = ENV.int(
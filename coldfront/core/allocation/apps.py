@@ -2,8 +2,13 @@
 #
 # SPDX-License-Identifier: AGPL-3.0-or-later
 
+import importlib
+
 from django.apps import AppConfig
 
 
 class AllocationConfig(AppConfig):
     name = "coldfront.core.allocation"
+
+    def ready(self):
+        importlib.import_module("coldfront.core.allocation.signals")
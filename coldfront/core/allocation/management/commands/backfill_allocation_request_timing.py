@@ -0,0 +1,30 @@
+# SPDX-FileCopyrightText: (C) ColdFront Authors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+from django.core.management.base import BaseCommand
+
+from coldfront.core.allocation.utils import (
+    backfill_allocation_change_request_timing,
+    backfill_allocation_request_timing,
+)
+
+
+class Command(BaseCommand):
+    help = "Fill in the first status, fulfilled date and time to fulfillment of allocations and allocation change requests from their history"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Recompute every row, not only rows whose stored timing is missing or differs from their history",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000, help="Rows to update per query (default 1000)")
+
+    def handle(self, *args, **options):
+        outdated_only = not options["all"]
+        count = backfill_allocation_request_timing(batch_size=options["batch_size"], outdated_only=outdated_only)
+        self.stdout.write(f"Updated request timing for {count} allocations")
+
+        count = backfill_allocation_change_request_timing(batch_size=options["batch_size"], outdated_only=outdated_only)
+        self.stdout.write(f"Updated request timing for {count} allocation change requests")
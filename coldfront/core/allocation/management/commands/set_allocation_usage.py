@@ -0,0 +1,50 @@
+# SPDX-FileCopyrightText: (C) ColdFront Authors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+import csv
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from coldfront.core.allocation.utils import set_allocation_usages
+
+
+class Command(BaseCommand):
+    help = "Set the usage of allocation attributes from a JSON or CSV file of (allocation or account, attribute, value) records"
+
+    def add_arguments(self, parser):
+        parser.add_argument("file", help="JSON list or CSV file with a header row, - for stdin")
+        parser.add_argument(
+            "--format", choices=["json", "csv"], help="File format (default based on the file extension, else json)"
+        )
+        parser.add_argument("--batch-size", type=int, default=1000, help="Rows to write per query (default 1000)")
+
+    def handle(self, *args, **options):
+        file_format = options["format"]
+        if file_format is None:
+            file_format = "csv" if options["file"].endswith(".csv") else "json"
+
+        stream = sys.stdin if options["file"] == "-" else open(options["file"], newline="")
+        try:
+            if file_format == "csv":
+                records = list(csv.DictReader(stream))
+            else:
+                records = json.load(stream)
+        except (csv.Error, ValueError) as e:
+            raise CommandError(f"Unable to parse {options['file']}: {e}")
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        if not isinstance(records, list) or not all(isinstance(record, dict) for record in records):
+            raise CommandError("Expected a list of records")
+
+        result = set_allocation_usages(records, batch_size=options["batch_size"])
+        for error in result["errors"]:
+            self.stderr.write(f"Record {error['record']}: {error['error']}")
+
+        self.stdout.write(
+            "Usage created: {created}, updated: {updated}, unchanged: {unchanged}, skipped: {skipped}".format(**result)
+        )
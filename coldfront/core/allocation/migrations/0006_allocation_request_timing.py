@@ -0,0 +1,47 @@
+# SPDX-FileCopyrightText: (C) ColdFront Authors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("allocation", "0005_auto_20211117_1413"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="allocation",
+            name="first_status",
+            field=models.ForeignKey(
+                blank=True,
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="allocation.allocationstatuschoice",
+            ),
+        ),
+        migrations.AddField(
+            model_name="allocation",
+            name="fulfilled_date",
+            field=models.DateTimeField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="allocation",
+            name="time_to_fulfillment",
+            field=models.DurationField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="allocationchangerequest",
+            name="fulfilled_date",
+            field=models.DateTimeField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="allocationchangerequest",
+            name="time_to_fulfillment",
+            field=models.DurationField(blank=True, db_index=True, editable=False, null=True),
+        ),
+    ]
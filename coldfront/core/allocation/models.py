@@ -75,6 +75,9 @@ class Allocation(TimeStampedModel):
         description (str): description of the allocation
         is_locked (bool): indicates whether or not the allocation is locked
         is_changeable (bool): indicates whether or not the allocation is changeable
+        first_status (AllocationStatusChoice): the status the allocation was created with
+        fulfilled_date (DateTime): when the allocation's status was first set to Active
+        time_to_fulfillment (Duration): time between the allocation's creation and fulfilled_date
     """
 
     class Meta:
@@ -101,7 +104,14 @@ class Allocation(TimeStampedModel):
     description = models.CharField(max_length=512, blank=True, null=True)
     is_locked = models.BooleanField(default=False)
     is_changeable = models.BooleanField(default=False)
-    history = HistoricalRecords()
+    # Request timing, denormalized from the allocation history by
+    # coldfront.core.allocation.utils.record_allocation_request_timing
+    first_status = models.ForeignKey(
+        AllocationStatusChoice, on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name="+"
+    )
+    fulfilled_date = models.DateTimeField(null=True, blank=True, editable=False, db_index=True)
+    time_to_fulfillment = models.DurationField(null=True, blank=True, editable=False, db_index=True)
+    history = HistoricalRecords(excluded_fields=["first_status", "fulfilled_date", "time_to_fulfillment"])
 
     def clean(self):
         """Validates the allocation and raises errors if the allocation is invalid."""
@@ -695,6 +705,8 @@ class AllocationChangeRequest(TimeStampedModel):
         end_date_extension (int): represents the number of days to extend the allocation's end date
         justification (str): represents input from the user justifying why they want to change the allocation
         notes (str): represents notes for users changing allocations
+        fulfilled_date (DateTime): when the change request's status was first set to Approved
+        time_to_fulfillment (Duration): time between the change request's creation and fulfilled_date
     """
 
     allocation = models.ForeignKey(
@@ -705,7 +717,11 @@ class AllocationChangeRequest(TimeStampedModel):
     end_date_extension = models.IntegerField(blank=True, null=True)
     justification = models.TextField()
     notes = models.CharField(max_length=512, blank=True, null=True)
-    history = HistoricalRecords()
+    # Request timing, denormalized from the change request history by
+    # coldfront.core.allocation.utils.record_allocation_change_request_timing
+    fulfilled_date = models.DateTimeField(null=True, blank=True, editable=False, db_index=True)
+    time_to_fulfillment = models.DurationField(null=True, blank=True, editable=False, db_index=True)
+    history = HistoricalRecords(excluded_fields=["fulfilled_date", "time_to_fulfillment"])
 
     @property
     def get_parent_resource(self):
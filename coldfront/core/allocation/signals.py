@@ -3,6 +3,21 @@
 # SPDX-License-Identifier: AGPL-3.0-or-later
 
 import django.dispatch
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from simple_history.signals import post_create_historical_record
+
+from coldfront.core.allocation.models import (
+    Allocation,
+    AllocationChangeRequest,
+    AllocationChangeStatusChoice,
+    AllocationStatusChoice,
+)
+from coldfront.core.allocation.utils import (
+    clear_status_pks,
+    record_allocation_change_request_timing,
+    record_allocation_request_timing,
+)
 
 allocation_new = django.dispatch.Signal()
 # providing_args=["allocation_pk"]
@@ -11,6 +26,13 @@ allocation_activate = django.dispatch.Signal()
 allocation_disable = django.dispatch.Signal()
 # providing_args=["allocation_pk"]
 
+allocation_activate_users = django.dispatch.Signal()
+# providing_args=["allocation_user_pks"]
+allocation_remove_users = django.dispatch.Signal()
+# providing_args=["allocation_user_pks"]
+
+# Sent once per allocation user for each allocation_activate_users and
+# allocation_remove_users batch, for receivers that do not handle batches
 allocation_activate_user = django.dispatch.Signal()
 # providing_args=["allocation_user_pk"]
 allocation_remove_user = django.dispatch.Signal()
@@ -24,3 +46,35 @@ allocation_change_created = django.dispatch.Signal()
 
 allocation_attribute_changed = django.dispatch.Signal()
 # providing_args=["attribute_pk", "allocation_pk"]
+
+
+@receiver(post_create_historical_record, sender=Allocation.history.model)
+def allocation_history_created(sender, instance, history_instance, **kwargs):
+    record_allocation_request_timing(instance, history_instance)
+
+
+@receiver(post_create_historical_record, sender=AllocationChangeRequest.history.model)
+def allocation_change_request_history_created(sender, instance, history_instance, **kwargs):
+    record_allocation_change_request_timing(instance, history_instance)
+
+
+@receiver(post_save, sender=AllocationStatusChoice)
+@receiver(post_delete, sender=AllocationStatusChoice)
+@receiver(post_save, sender=AllocationChangeStatusChoice)
+@receiver(post_delete, sender=AllocationChangeStatusChoice)
+def status_choice_changed(sender, **kwargs):
+    clear_status_pks()
+
+
+@receiver(allocation_activate_users)
+def send_allocation_activate_user(sender, allocation_user_pks, **kwargs):
+    if allocation_activate_user.has_listeners(sender):
+        for allocation_user_pk in allocation_user_pks:
+            allocation_activate_user.send(sender=sender, allocation_user_pk=allocation_user_pk)
+
+
+@receiver(allocation_remove_users)
+def send_allocation_remove_user(sender, allocation_user_pks, **kwargs):
+    if allocation_remove_user.has_listeners(sender):
+        for allocation_user_pk in allocation_user_pks:
+            allocation_remove_user.send(sender=sender, allocation_user_pk=allocation_user_pk)
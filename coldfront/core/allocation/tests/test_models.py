@@ -6,17 +6,22 @@
 
 import datetime
 import sys
+from io import StringIO
+from tempfile import NamedTemporaryFile
 from unittest.mock import patch
 
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
+from django.core.management import call_command
 from django.test import TestCase
 from django.utils import timezone
 
 from coldfront.core.allocation.models import (
     Allocation,
+    AllocationAttributeUsage,
     AllocationStatusChoice,
 )
+from coldfront.core.allocation.utils import set_allocation_usages
 from coldfront.core.project.models import Project
 from coldfront.core.test_helpers.factories import (
     AAttributeTypeFactory,
@@ -45,6 +50,141 @@ class AllocationModelTests(TestCase):
         self.assertEqual(str(self.allocation), allocation_str)
 
 
+class AllocationRequestTimingTests(TestCase):
+    """tests for the request timing stored on allocations"""
+
+    def setUp(self):
+        self.allocation = AllocationFactory(status=AllocationStatusChoiceFactory(name="New"))
+        self.active_status = AllocationStatusChoiceFactory(name="Active")
+
+    def activate(self):
+        self.allocation.status = self.active_status
+        self.allocation.save()
+        self.allocation.refresh_from_db()
+
+    def test_first_status_recorded(self):
+        self.activate()
+        self.assertEqual(self.allocation.first_status.name, "New")
+
+    def test_fulfilled_date_recorded_once(self):
+        self.assertIsNone(self.allocation.fulfilled_date)
+        self.activate()
+        fulfilled_date = self.allocation.fulfilled_date
+        self.assertEqual(fulfilled_date, self.allocation.history.filter(status__name="Active").earliest().modified)
+        self.assertEqual(self.allocation.time_to_fulfillment, fulfilled_date - self.allocation.created)
+
+        self.allocation.status = AllocationStatusChoiceFactory(name="Expired")
+        self.allocation.save()
+        self.activate()
+        self.assertEqual(self.allocation.fulfilled_date, fulfilled_date)
+
+    def test_backfill_matches_history(self):
+        self.activate()
+        expected = (
+            self.allocation.first_status_id,
+            self.allocation.fulfilled_date,
+            self.allocation.time_to_fulfillment,
+        )
+        Allocation.objects.update(first_status=None, fulfilled_date=None, time_to_fulfillment=None)
+
+        call_command("backfill_allocation_request_timing", stdout=StringIO())
+        self.allocation.refresh_from_db()
+        self.assertEqual(
+            (self.allocation.first_status_id, self.allocation.fulfilled_date, self.allocation.time_to_fulfillment),
+            expected,
+        )
+
+    def test_saved_before_backfill(self):
+        """Test that an allocation fulfilled before the columns were added
+        gets its timing from history when it is saved before the backfill,
+        and that the backfill corrects timing that differs from history"""
+        self.activate()
+        expected = (
+            self.allocation.first_status_id,
+            self.allocation.fulfilled_date,
+            self.allocation.time_to_fulfillment,
+        )
+        Allocation.objects.update(first_status=None, fulfilled_date=None, time_to_fulfillment=None)
+
+        self.allocation.refresh_from_db()
+        self.allocation.justification = "Saved after the upgrade"
+        self.allocation.save()
+        self.allocation.refresh_from_db()
+        self.assertEqual(
+            (self.allocation.first_status_id, self.allocation.fulfilled_date, self.allocation.time_to_fulfillment),
+            expected,
+        )
+
+        # timing recorded from the first save after the upgrade
+        Allocation.objects.update(
+            first_status=self.active_status, fulfilled_date=timezone.now(), time_to_fulfillment=datetime.timedelta(0)
+        )
+        call_command("backfill_allocation_request_timing", stdout=StringIO())
+        self.allocation.refresh_from_db()
+        self.assertEqual(
+            (self.allocation.first_status_id, self.allocation.fulfilled_date, self.allocation.time_to_fulfillment),
+            expected,
+        )
+
+
+class SetAllocationUsagesTests(TestCase):
+    """tests for setting allocation attribute usage in bulk"""
+
+    def setUp(self):
+        self.usage_type = AllocationAttributeTypeFactory(name="Storage Quota (TB)", has_usage=True)
+        self.account_type = AllocationAttributeTypeFactory(name="slurm_account_name")
+        self.allocations = [AllocationFactory(project=ProjectFactory(title=f"Usage project {i}")) for i in range(3)]
+        for i, allocation in enumerate(self.allocations):
+            AllocationAttributeFactory(allocation=allocation, allocation_attribute_type=self.usage_type, value=10)
+            AllocationAttributeFactory(
+                allocation=allocation, allocation_attribute_type=self.account_type, value=f"account{i}"
+            )
+        self.allocations[0].set_usage(self.usage_type.name, 1)
+
+    def usage(self, allocation):
+        return allocation.allocationattribute_set.get(
+            allocation_attribute_type=self.usage_type
+        ).allocationattributeusage
+
+    def test_set_usages(self):
+        records = [
+            {"allocation": self.allocations[0].pk, "attribute": self.usage_type.name, "value": 2},
+            {"account": "account1", "attribute": self.usage_type.name, "value": "3.5"},
+            {"allocation": str(self.allocations[2].pk), "attribute": "slurm_account_name", "value": 4},
+            {"account": "missing", "attribute": self.usage_type.name, "value": 5},
+            {"allocation": self.allocations[2].pk, "attribute": self.usage_type.name, "value": "many"},
+        ]
+        result = set_allocation_usages(records)
+
+        self.assertEqual(
+            [result[key] for key in ["created", "updated", "unchanged", "skipped"]],
+            [0, 2, 0, 1],
+        )
+        self.assertEqual([error["record"] for error in result["errors"]], [4, 3])
+        self.assertEqual(self.usage(self.allocations[0]).value, 2)
+        self.assertEqual(self.usage(self.allocations[1]).value, 3.5)
+        self.assertEqual(self.usage(self.allocations[0]).history.count(), 3)
+
+        AllocationAttributeUsage.objects.all().delete()
+        result = set_allocation_usages(records[:2] * 2)
+        self.assertEqual([result["created"], result["updated"]], [2, 0])
+        self.assertEqual(self.usage(self.allocations[1]).history.latest().history_type, "+")
+
+        result = set_allocation_usages(records[:2])
+        self.assertEqual(result["unchanged"], 2)
+
+    def test_set_allocation_usage_command(self):
+        with NamedTemporaryFile("w", suffix=".csv") as f:
+            f.write("account,attribute,value\n")
+            f.write(f"account2,{self.usage_type.name},7\n")
+            f.flush()
+            out = StringIO()
+            call_command("set_allocation_usage", f.name, stdout=out)
+
+        self.assertEqual(self.usage(self.allocations[2]).value, 7)
+        self.assertIn("updated: 1", out.getvalue())
+
+
 class AllocationModelCleanMethodTests(TestCase):
     """tests for Allocation model clean method"""
 
@@ -4,15 +4,21 @@
 
 import logging
 from http import HTTPStatus
+from unittest import mock
 
 from django.conf import settings
+from django.db import connection
 from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from coldfront.core.allocation.models import (
     AllocationChangeRequest,
     AllocationChangeStatusChoice,
+    AllocationUserNote,
 )
+from coldfront.core.allocation.signals import allocation_activate_user, allocation_activate_users
+from coldfront.core.allocation.views import AllocationDetailView
 from coldfront.core.test_helpers import utils
 from coldfront.core.test_helpers.factories import (
     AllocationAttributeFactory,
@@ -287,6 +293,122 @@ class AllocationDetailViewTest(AllocationViewBaseTest):
         utils.page_does_not_contain_for_user(self, self.allocation_user, self.url, "Add Users")
         utils.page_does_not_contain_for_user(self, self.allocation_user, self.url, "Remove Users")
 
+    def count_queries(self, user, url):
+        self.client.force_login(user, backend=BACKEND)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return len(queries)
+
+    def test_allocation_detail_query_count(self):
+        """Test that the detail and invoice pages take the same number of
+        queries however many users, attributes, change requests and notes the
+        allocation has"""
+        invoice_url = f"/allocation/{self.allocation.pk}/invoice/"
+        before = [self.count_queries(user, self.url) for user in (self.admin_user, self.pi_user)]
+        invoice_before = self.count_queries(self.admin_user, invoice_url)
+
+        usage_type = AllocationAttributeTypeFactory(name="Core Usage (Hours)", has_usage=True)
+        for i in range(5):
+            user = UserFactory(username=f"detail_query_user{i}")
+            ProjectUserFactory(project=self.project, user=user)
+            AllocationUserFactory(allocation=self.allocation, user=user)
+            AllocationAttributeFactory(allocation=self.allocation, allocation_attribute_type=usage_type, value=100)
+            AllocationChangeRequestFactory(allocation=self.allocation)
+            AllocationUserNote.objects.create(
+                allocation=self.allocation, author=user, note=f"note {i}", is_private=False
+            )
+        self.allocation.resources.add(ResourceFactory(name="holylfs08/tier1"))
+
+        self.assertEqual([self.count_queries(user, self.url) for user in (self.admin_user, self.pi_user)], before)
+        self.assertEqual(self.count_queries(self.admin_user, invoice_url), invoice_before)
+        response = self.client.get(self.url)
+        self.assertEqual(len(response.context["allocation_users"]), 6)
+        self.assertEqual(len(response.context["attributes_with_usage"]), 5)
+
+
+class AllocationDetailViewPostTest(AllocationViewBaseTest):
+    """Tests for the signals sent by AllocationDetailView.post"""
+
+    def setUp(self):
+        self.url = f"/allocation/{self.allocation.pk}/"
+        self.allocation.status = AllocationStatusChoiceFactory(name="New")
+        self.allocation.save()
+        for i in range(3):
+            user = UserFactory(username=f"detail_post_user{i}")
+            ProjectUserFactory(project=self.project, user=user)
+            AllocationUserFactory(allocation=self.allocation, user=user)
+        self.allocation_user_pks = sorted(self.allocation.allocationuser_set.values_list("pk", flat=True))
+
+    def connect(self, signal):
+        handler = mock.Mock()
+        signal.connect(handler, sender=AllocationDetailView, weak=False)
+        self.addCleanup(signal.disconnect, handler, sender=AllocationDetailView)
+        return handler
+
+    def test_activate_sends_one_batch_signal(self):
+        """Test that approving an allocation sends one allocation_activate_users
+        signal for every user, and allocation_activate_user once per user"""
+        batch_handler = self.connect(allocation_activate_users)
+        user_handler = self.connect(allocation_activate_user)
+
+        self.client.force_login(self.admin_user, backend=BACKEND)
+        response = self.client.post(self.url, {"action": "approve", "status": self.allocation.status.pk})
+        self.assertEqual(response.status_code, HTTPStatus.FOUND)
+
+        batch_handler.assert_called_once()
+        self.assertEqual(sorted(batch_handler.call_args.kwargs["allocation_user_pks"]), self.allocation_user_pks)
+        self.assertEqual(
+            sorted(call.kwargs["allocation_user_pk"] for call in user_handler.call_args_list), self.allocation_user_pks
+        )
+
+
+class AllocationRequestListViewTest(AllocationViewBaseTest):
+    """Tests for AllocationRequestListView"""
+
+    def setUp(self):
+        self.url = reverse("allocation-request-list")
+        self.client.force_login(self.admin_user, backend=BACKEND)
+
+    def request_renewal(self, allocation):
+        allocation.status = AllocationStatusChoiceFactory(name="Active")
+        allocation.save()
+        allocation.status = AllocationStatusChoiceFactory(name="Renewal Requested")
+        allocation.save()
+        requested = allocation.history.latest().history_date
+        # later saves in the same status do not move the renewal date
+        allocation.save()
+        return requested
+
+    def test_allocation_renewal_dates(self):
+        """Test that renewal dates are when the current run of Renewal
+        Requested status began"""
+        requested = self.request_renewal(self.allocation)
+        response = self.client.get(self.url)
+        self.assertEqual(response.context["allocation_renewal_dates"], {self.allocation.pk: requested})
+
+        requested = self.request_renewal(self.allocation)
+        response = self.client.get(self.url)
+        self.assertEqual(response.context["allocation_renewal_dates"], {self.allocation.pk: requested})
+
+    def test_allocation_request_list_query_count(self):
+        """Test that the page takes the same number of queries however many
+        allocations are pending"""
+        self.request_renewal(self.allocation)
+        with CaptureQueriesContext(connection) as before:
+            self.client.get(self.url)
+
+        for i in range(5):
+            allocation = AllocationFactory(project=ProjectFactory(title=f"Request list project {i}"))
+            allocation.resources.add(ResourceFactory(name=f"request-list-resource{i}"))
+            AllocationAttributeFactory(allocation=allocation)
+            self.request_renewal(allocation)
+
+        with CaptureQueriesContext(connection) as after:
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.context["allocation_list"]), 6)
+        self.assertEqual(len(after), len(before))
+
 
 class AllocationCreateViewTest(AllocationViewBaseTest):
     """Tests for the AllocationCreateView"""
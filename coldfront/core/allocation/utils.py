@@ -2,10 +2,27 @@
 #
 # SPDX-License-Identifier: AGPL-3.0-or-later
 
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Q, Subquery
+from django.utils import timezone
+from simple_history.utils import bulk_create_with_history, bulk_update_with_history
 
-from coldfront.core.allocation.models import AllocationUser, AllocationUserStatusChoice
+from coldfront.core.allocation.models import (
+    Allocation,
+    AllocationAttribute,
+    AllocationAttributeUsage,
+    AllocationChangeRequest,
+    AllocationChangeStatusChoice,
+    AllocationStatusChoice,
+    AllocationUser,
+    AllocationUserStatusChoice,
+)
 from coldfront.core.resource.models import Resource
+from coldfront.core.utils.common import import_from_settings
+
+ALLOCATION_USAGE_ACCOUNT_ATTRIBUTE_NAME = import_from_settings(
+    "ALLOCATION_USAGE_ACCOUNT_ATTRIBUTE_NAME", "slurm_account_name"
+)
 
 
 def set_allocation_user_status_to_error(allocation_user_pk):
@@ -64,5 +81,285 @@ def get_user_resources(user_obj):
     return resources
 
 
+# Status choice pks by (model, name), cleared whenever a status choice is
+# saved or deleted
+_status_pks = {}
+
+
+def get_status_pk(status_model, name):
+    """Returns the pk of the status_model choice named name, or None if there
+    is none, cached so request timing does not load the status on every save"""
+    key = (status_model, name)
+    if key not in _status_pks:
+        _status_pks[key] = status_model.objects.filter(name=name).values_list("pk", flat=True).first()
+    return _status_pks[key]
+
+
+def clear_status_pks():
+    _status_pks.clear()
+
+
+def record_request_timing(instance, historical_record, fulfilled_status_pk, record_first_status=False):
+    """Copy request timing from a new historical record of an allocation or
+    allocation change request onto the object itself. first_status
+    (allocations only) is the status of the creation record and
+    fulfilled_date and time_to_fulfillment come from the first record with
+    the fulfilled status. Objects created before the columns were added get
+    the same values as the backfill, read from their earlier history.
+    Columns are written with update() so no further history is recorded."""
+    if historical_record.history_type == "-":
+        return
+
+    model = type(instance)
+    history = model.history.filter(id=instance.pk).order_by("history_date", "history_id")
+    if record_first_status and instance.first_status_id is None:
+        if historical_record.history_type == "+":
+            first_status_id = historical_record.status_id
+        else:
+            first_status_id = history.filter(history_type="+").values_list("status_id", flat=True).first()
+
+        if first_status_id is not None:
+            model.objects.filter(pk=instance.pk, first_status__isnull=True).update(first_status_id=first_status_id)
+            instance.first_status_id = first_status_id
+
+    if (
+        instance.fulfilled_date is None
+        and fulfilled_status_pk is not None
+        and instance.status_id == fulfilled_status_pk
+    ):
+        if historical_record.history_type == "+":
+            fulfilled_date = historical_record.modified
+        else:
+            # the first change to the fulfilled status, which is earlier than
+            # this record if the object was fulfilled before the upgrade
+            fulfilled_date = history.filter(status_id=fulfilled_status_pk).values_list("modified", flat=True).first()
+
+        time_to_fulfillment = fulfilled_date - instance.created
+        model.objects.filter(pk=instance.pk, fulfilled_date__isnull=True).update(
+            fulfilled_date=fulfilled_date, time_to_fulfillment=time_to_fulfillment
+        )
+        instance.fulfilled_date = fulfilled_date
+        instance.time_to_fulfillment = time_to_fulfillment
+
+
+def record_allocation_request_timing(allocation, historical_allocation):
+    record_request_timing(
+        allocation,
+        historical_allocation,
+        get_status_pk(AllocationStatusChoice, "Active"),
+        record_first_status=True,
+    )
+
+
+def record_allocation_change_request_timing(allocation_change_request, historical_allocation_change_request):
+    record_request_timing(
+        allocation_change_request,
+        historical_allocation_change_request,
+        get_status_pk(AllocationChangeStatusChoice, "Approved"),
+    )
+
+
+def annotate_history_request_timing(queryset, fulfilled_status_name, record_first_status=False):
+    """Annotate objects in queryset with history_fulfilled_date, the modified
+    date of their first history record with fulfilled_status_name, and
+    history_first_status if record_first_status, the status of their first
+    history record"""
+    HistoricalModel = queryset.model.history.model
+    queryset = queryset.annotate(
+        history_fulfilled_date=Subquery(
+            HistoricalModel.objects.filter(id=OuterRef("pk"), status__name=fulfilled_status_name)
+            .order_by("history_date", "history_id")
+            .values("modified")[:1]
+        )
+    )
+    if record_first_status:
+        queryset = queryset.annotate(
+            history_first_status=Subquery(
+                HistoricalModel.objects.filter(id=OuterRef("pk"))
+                .order_by("history_date", "history_id")
+                .values("status_id")[:1]
+            )
+        )
+    return queryset
+
+
+def outdated_request_timing(queryset, fulfilled_status_name, record_first_status=False):
+    """Returns the objects in queryset whose stored request timing is missing
+    or differs from their history"""
+    queryset = annotate_history_request_timing(queryset, fulfilled_status_name, record_first_status)
+    outdated = (
+        Q(fulfilled_date__isnull=True)
+        | Q(history_fulfilled_date__isnull=True)
+        | ~Q(fulfilled_date=F("history_fulfilled_date"))
+    )
+    if record_first_status:
+        outdated |= Q(first_status__isnull=True) | ~Q(first_status=F("history_first_status"))
+    return queryset.filter(outdated)
+
+
+def backfill_request_timing(queryset, fulfilled_status_name, record_first_status=False, batch_size=1000):
+    """Compute request timing columns for every object in queryset from its
+    history and save them in batches with bulk_update. Returns the number of
+    objects updated."""
+    model = queryset.model
+    fields = ["fulfilled_date", "time_to_fulfillment"]
+    if record_first_status:
+        fields.append("first_status")
+    queryset = annotate_history_request_timing(queryset, fulfilled_status_name, record_first_status)
+
+    count = 0
+    batch = []
+    for obj in queryset.order_by("pk").iterator(chunk_size=batch_size):
+        obj.fulfilled_date = obj.history_fulfilled_date
+        obj.time_to_fulfillment = obj.fulfilled_date - obj.created if obj.fulfilled_date else None
+        if record_first_status:
+            obj.first_status_id = obj.history_first_status
+        batch.append(obj)
+        if len(batch) >= batch_size:
+            model.objects.bulk_update(batch, fields)
+            count += len(batch)
+            batch = []
+
+    if batch:
+        model.objects.bulk_update(batch, fields)
+        count += len(batch)
+
+    return count
+
+
+def backfill_allocation_request_timing(queryset=None, batch_size=1000, outdated_only=False):
+    if queryset is None:
+        queryset = Allocation.objects.all()
+    if outdated_only:
+        queryset = outdated_request_timing(queryset, "Active", record_first_status=True)
+    return backfill_request_timing(queryset, "Active", record_first_status=True, batch_size=batch_size)
+
+
+def backfill_allocation_change_request_timing(queryset=None, batch_size=1000, outdated_only=False):
+    if queryset is None:
+        queryset = AllocationChangeRequest.objects.all()
+    if outdated_only:
+        queryset = outdated_request_timing(queryset, "Approved")
+    return backfill_request_timing(queryset, "Approved", batch_size=batch_size)
+
+
+def annotate_renewal_requested_date(queryset):
+    """Annotate allocations in queryset with renewal_requested_date, the start
+    of their current run of "Renewal Requested" history records, computed in
+    SQL. It is None for allocations whose latest record has another status."""
+    HistoricalAllocation = Allocation.history.model
+    changed_since = HistoricalAllocation.objects.filter(
+        id=OuterRef("id"), history_date__gt=OuterRef("history_date")
+    ).exclude(status__name="Renewal Requested")
+
+    return queryset.annotate(
+        renewal_requested_date=Subquery(
+            HistoricalAllocation.objects.filter(id=OuterRef("pk"), status__name="Renewal Requested")
+            .filter(~Exists(changed_since))
+            .order_by("history_date")
+            .values("history_date")[:1]
+        )
+    )
+
+
+def set_allocation_usages(records, user=None, batch_size=1000):
+    """Set the usage of many allocation attributes at once, as
+    Allocation.set_usage does for one.
+
+    records is an iterable of dicts with an "allocation" id or an "account"
+    name, an "attribute" name and a "value". Accounts are resolved to every
+    allocation whose ALLOCATION_USAGE_ACCOUNT_ATTRIBUTE_NAME attribute has
+    that value. As with set_usage, records for attributes the allocation does
+    not have, or whose type does not have usage, are skipped. If several
+    records set the same attribute the last one wins.
+
+    Records are resolved with one query per kind of lookup and usage is
+    written, with history attributed to user, using bulk_update and
+    bulk_create. Returns a dict with the number of usages created, updated,
+    unchanged and skipped and a list of errors for invalid records.
+    """
+    errors = []
+    parsed = []
+    for i, record in enumerate(records):
+        allocation = record.get("allocation") or None
+        account = record.get("account") or None
+        try:
+            if allocation is None and account is None:
+                raise ValueError("allocation or account is required")
+            if not record.get("attribute"):
+                raise ValueError("attribute is required")
+            parsed.append((i, allocation and int(allocation), account, record["attribute"], float(record["value"])))
+        except KeyError:
+            errors.append({"record": i, "error": "value is required"})
+        except (TypeError, ValueError) as e:
+            errors.append({"record": i, "error": str(e)})
+
+    accounts = {}
+    account_names = {account for _, _, account, _, _ in parsed if account is not None}
+    if account_names:
+        for account, allocation_id in AllocationAttribute.objects.filter(
+            allocation_attribute_type__name=ALLOCATION_USAGE_ACCOUNT_ATTRIBUTE_NAME, value__in=account_names
+        ).values_list("value", "allocation_id"):
+            accounts.setdefault(account, []).append(allocation_id)
+
+    values = {}
+    for i, allocation, account, attribute, value in parsed:
+        if allocation is not None:
+            allocation_ids = [allocation]
+        elif account in accounts:
+            allocation_ids = accounts[account]
+        else:
+            errors.append({"record": i, "error": f"No allocation found for account {account}"})
+            continue
+        for allocation_id in allocation_ids:
+            values[(allocation_id, attribute)] = value
+
+    # set_usage uses the first matching attribute of each allocation
+    attributes = {}
+    for pk, allocation_id, attribute in (
+        AllocationAttribute.objects.filter(
+            allocation_id__in={allocation_id for allocation_id, _ in values},
+            allocation_attribute_type__name__in={attribute for _, attribute in values},
+            allocation_attribute_type__has_usage=True,
+        )
+        .order_by("pk")
+        .values_list("pk", "allocation_id", "allocation_attribute_type__name")
+    ):
+        attributes.setdefault((allocation_id, attribute), pk)
+
+    usages = {attribute_pk: values[key] for key, attribute_pk in attributes.items() if key in values}
+    existing = AllocationAttributeUsage.objects.in_bulk(list(usages))
+    now = timezone.now()
+    to_update = []
+    to_create = []
+    unchanged = 0
+    for attribute_pk, value in usages.items():
+        usage = existing.get(attribute_pk)
+        if usage is None:
+            to_create.append(AllocationAttributeUsage(allocation_attribute_id=attribute_pk, value=value))
+        elif usage.value != value:
+            usage.value = value
+            usage.modified = now
+            to_update.append(usage)
+        else:
+            unchanged += 1
+
+    with transaction.atomic():
+        if to_create:
+            bulk_create_with_history(to_create, AllocationAttributeUsage, batch_size=batch_size, default_user=user)
+        if to_update:
+            bulk_update_with_history(
+                to_update, AllocationAttributeUsage, ["value", "modified"], batch_size=batch_size, default_user=user
+            )
+
+    return {
+        "created": len(to_create),
+        "updated": len(to_update),
+        "unchanged": unchanged,
+        "skipped": len(values) - len(usages),
+        "errors": errors,
+    }
+
+
 def test_allocation_function(allocation_pk):
     print("test_allocation_function", allocation_pk)
@@ -13,7 +13,7 @@ from django.contrib import messages
 from django.contrib.auth import get_user_model
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
-from django.db.models import Q
+from django.db.models import Prefetch, Q
 from django.db.models.query import QuerySet
 from django.forms import formset_factory
 from django.http import HttpResponseBadRequest, HttpResponseRedirect, JsonResponse
@@ -44,6 +44,7 @@ from coldfront.core.allocation.forms import (
     AllocationUpdateForm,
 )
 from coldfront.core.allocation.models import (
+    ALLOCATION_RESOURCE_ORDERING,
     Allocation,
     AllocationAccount,
     AllocationAttribute,
@@ -59,17 +60,27 @@ from coldfront.core.allocation.models import (
 )
 from coldfront.core.allocation.signals import (
     allocation_activate,
-    allocation_activate_user,
+    allocation_activate_users,
     allocation_attribute_changed,
     allocation_change_approved,
     allocation_change_created,
     allocation_disable,
     allocation_new,
-    allocation_remove_user,
+    allocation_remove_users,
 )
-from coldfront.core.allocation.utils import generate_guauge_data_from_usage, get_user_resources
-from coldfront.core.project.models import Project, ProjectPermission, ProjectUser, ProjectUserStatusChoice
-from coldfront.core.resource.models import Resource
+from coldfront.core.allocation.utils import (
+    annotate_renewal_requested_date,
+    generate_guauge_data_from_usage,
+    get_user_resources,
+)
+from coldfront.core.project.models import (
+    Project,
+    ProjectPermission,
+    ProjectReview,
+    ProjectUser,
+    ProjectUserStatusChoice,
+)
+from coldfront.core.resource.models import Resource, ResourceAttribute
 from coldfront.core.utils.common import get_domain_url, import_from_settings
 from coldfront.core.utils.mail import (
     build_link,
@@ -103,56 +114,63 @@ EMAIL_ALLOCATION_EULA_INCLUDE_ACCEPTED_EULA = import_from_settings("EMAIL_ALLOCA
 logger = logging.getLogger(__name__)
 
 
-class AllocationDetailView(LoginRequiredMixin, UserPassesTestMixin, TemplateView):
-    model = Allocation
-    template_name = "allocation/allocation_detail.html"
-    context_object_name = "allocation"
-
-    def test_func(self):
-        """UserPassesTestMixin Tests"""
-        pk = self.kwargs.get("pk")
-        allocation_obj = get_object_or_404(Allocation, pk=pk)
-
-        if self.request.user.has_perm("allocation.can_view_all_allocations"):
-            return True
-
-        return allocation_obj.has_perm(self.request.user, AllocationPermission.USER)
-
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        pk = self.kwargs.get("pk")
-        allocation_obj = get_object_or_404(Allocation, pk=pk)
-        allocation_users = allocation_obj.allocationuser_set.exclude(
-            status__name__in=[
-                "Removed",
-            ]
-        ).order_by("user__username")
-
-        if ALLOCATION_EULA_ENABLE:
-            user_in_allocation = allocation_users.filter(user=self.request.user).exists()
-            context["user_in_allocation"] = user_in_allocation
-
-            if user_in_allocation:
-                allocation_user_status = get_object_or_404(
-                    AllocationUser, allocation=allocation_obj, user=self.request.user
-                ).status
-                if allocation_obj.status.name == "Active" and allocation_user_status.name == "PendingEula":
-                    messages.info(self.request, "This allocation is active, but you must agree to the EULA to use it!")
-
-            context["eulas"] = allocation_obj.get_eula()
-            context["res"] = allocation_obj.get_parent_resource.pk
-            context["res_obj"] = allocation_obj.get_parent_resource
-
-        # set visible usage attributes
-        alloc_attr_set = allocation_obj.get_attribute_set(self.request.user)
-        attributes_with_usage = [a for a in alloc_attr_set if hasattr(a, "allocationattributeusage")]
-        attributes = alloc_attr_set
-
-        allocation_changes = allocation_obj.allocationchangerequest_set.all().order_by("-pk")
+class AllocationDetailMixin:
+    """Loads the allocation shown by an allocation detail page together with
+    everything the page shows: project, resources and their EULAs, the
+    attributes and usages visible to the user, users, change requests and
+    notes. This takes a fixed number of queries however many of each the
+    allocation has."""
+
+    include_private_notes = False
+
+    def get_allocation(self):
+        if not hasattr(self, "_allocation"):
+            user = self.request.user
+            attributes = AllocationAttribute.objects.select_related(
+                "allocation_attribute_type", "allocationattributeusage"
+            ).order_by("allocation_attribute_type__name")
+            notes = AllocationUserNote.objects.select_related("author")
+            if not user.is_superuser:
+                attributes = attributes.filter(allocation_attribute_type__is_private=False)
+                if not self.include_private_notes:
+                    notes = notes.filter(is_private=False)
+
+            eula_attributes = ResourceAttribute.objects.filter(resource_attribute_type__name="eula").select_related(
+                "resource_attribute_type__attribute_type"
+            )
+            resources = (
+                Resource.objects.select_related("resource_type")
+                .order_by(*ALLOCATION_RESOURCE_ORDERING)
+                .prefetch_related(
+                    Prefetch("resourceattribute_set", queryset=eula_attributes, to_attr="eula_attributes")
+                )
+            )
+            allocation_users = (
+                AllocationUser.objects.exclude(status__name__in=["Removed"])
+                .select_related("user", "status")
+                .order_by("user__username")
+            )
+            queryset = Allocation.objects.select_related("project__pi", "project__status", "status").prefetch_related(
+                Prefetch("resources", queryset=resources, to_attr="resource_list"),
+                Prefetch("allocationattribute_set", queryset=attributes, to_attr="visible_attributes"),
+                Prefetch("allocationuser_set", queryset=allocation_users, to_attr="current_users"),
+                Prefetch(
+                    "allocationchangerequest_set",
+                    queryset=AllocationChangeRequest.objects.select_related("status").order_by("-pk"),
+                    to_attr="change_requests",
+                ),
+                Prefetch("allocationusernote_set", queryset=notes, to_attr="visible_notes"),
+            )
+            self._allocation = get_object_or_404(queryset, pk=self.kwargs.get("pk"))
+        return self._allocation
 
+    def get_allocation_context(self, allocation_obj):
+        attributes = allocation_obj.visible_attributes
+        attributes_with_usage = []
         guage_data = []
-        invalid_attributes = []
-        for attribute in attributes_with_usage:
+        for attribute in attributes:
+            if not hasattr(attribute, "allocationattributeusage"):
+                continue
             try:
                 guage_data.append(
                     generate_guauge_data_from_usage(
@@ -165,31 +183,74 @@ class AllocationDetailView(LoginRequiredMixin, UserPassesTestMixin, TemplateView
                 logger.error(
                     "Allocation attribute '%s' is not an int but has a usage", attribute.allocation_attribute_type.name
                 )
-                invalid_attributes.append(attribute)
+            else:
+                attributes_with_usage.append(attribute)
+
+        return {
+            "allocation": allocation_obj,
+            "resources": allocation_obj.resource_list,
+            "allocation_users": allocation_obj.current_users,
+            "guage_data": guage_data,
+            "attributes_with_usage": attributes_with_usage,
+            "attributes": attributes,
+            "allocation_changes": allocation_obj.change_requests,
+            # Can the user update the project?
+            "is_allowed_to_update_project": allocation_obj.project.has_perm(
+                self.request.user, ProjectPermission.UPDATE
+            ),
+            "notes": allocation_obj.visible_notes,
+        }
 
-        for a in invalid_attributes:
-            attributes_with_usage.remove(a)
 
-        context["allocation_users"] = allocation_users
-        context["guage_data"] = guage_data
-        context["attributes_with_usage"] = attributes_with_usage
-        context["attributes"] = attributes
-        context["allocation_changes"] = allocation_changes
+class AllocationDetailView(LoginRequiredMixin, UserPassesTestMixin, AllocationDetailMixin, TemplateView):
+    model = Allocation
+    template_name = "allocation/allocation_detail.html"
+    context_object_name = "allocation"
 
-        # Can the user update the project?
-        context["is_allowed_to_update_project"] = allocation_obj.project.has_perm(
-            self.request.user, ProjectPermission.UPDATE
-        )
+    def test_func(self):
+        """UserPassesTestMixin Tests"""
+        if self.request.user.has_perm("allocation.can_view_all_allocations"):
+            return True
+
+        return self.get_allocation().has_perm(self.request.user, AllocationPermission.USER)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        allocation_obj = self.get_allocation()
+        context.update(self.get_allocation_context(allocation_obj))
+
+        if ALLOCATION_EULA_ENABLE:
+            allocation_user = next(
+                (
+                    allocation_user
+                    for allocation_user in allocation_obj.current_users
+                    if allocation_user.user_id == self.request.user.pk
+                ),
+                None,
+            )
+            context["user_in_allocation"] = allocation_user is not None
+
+            if allocation_user is not None:
+                if allocation_obj.status.name == "Active" and allocation_user.status.name == "PendingEula":
+                    messages.info(self.request, "This allocation is active, but you must agree to the EULA to use it!")
 
-        noteset = allocation_obj.allocationusernote_set
-        notes = noteset.all() if self.request.user.is_superuser else noteset.filter(is_private=False)
+            # the EULA of the first resource, in ALLOCATION_RESOURCE_ORDERING
+            # order, that has one
+            context["eulas"] = None
+            for resource in allocation_obj.resource_list:
+                eula = next(filter(None, (attr.expanded_value() for attr in resource.eula_attributes)), None)
+                if eula:
+                    context["eulas"] = eula
+                    break
+
+            res_obj = allocation_obj.resource_list[0] if allocation_obj.resource_list else None
+            context["res"] = res_obj.pk if res_obj else None
+            context["res_obj"] = res_obj
 
-        context["notes"] = notes
         return context
 
     def get(self, request, *args, **kwargs):
-        pk = self.kwargs.get("pk")
-        allocation_obj = get_object_or_404(Allocation, pk=pk)
+        allocation_obj = self.get_allocation()
 
         initial_data = {
             "status": allocation_obj.status,
@@ -207,15 +268,11 @@ class AllocationDetailView(LoginRequiredMixin, UserPassesTestMixin, TemplateView
 
         context = self.get_context_data()
         context["form"] = form
-        context["allocation"] = allocation_obj
         return self.render_to_response(context)
 
     def post(self, request, *args, **kwargs):
         pk = self.kwargs.get("pk")
-        allocation_obj = get_object_or_404(Allocation, pk=pk)
-        allocation_users = allocation_obj.allocationuser_set.exclude(status__name__in=["Removed"]).order_by(
-            "user__username"
-        )
+        allocation_obj = self.get_allocation()
 
         if not self.request.user.is_superuser:
             messages.success(request, "You do not have permission to update the allocation")
@@ -234,7 +291,6 @@ class AllocationDetailView(LoginRequiredMixin, UserPassesTestMixin, TemplateView
         if not form.is_valid():
             context = self.get_context_data()
             context["form"] = form
-            context["allocation"] = allocation_obj
             return render(request, self.template_name, context)
 
         action = request.POST.get("action")
@@ -269,11 +325,13 @@ class AllocationDetailView(LoginRequiredMixin, UserPassesTestMixin, TemplateView
             allocation_obj.save()
 
             allocation_activate.send(sender=self.__class__, allocation_pk=allocation_obj.pk)
-            allocation_users = allocation_obj.allocationuser_set.exclude(
-                status__name__in=["Removed", "Error", "DeclinedEULA", "PendingEULA"]
+            allocation_user_pks = list(
+                allocation_obj.allocationuser_set.exclude(
+                    status__name__in=["Removed", "Error", "DeclinedEULA", "PendingEULA"]
+                ).values_list("pk", flat=True)
             )
-            for allocation_user in allocation_users:
-                allocation_activate_user.send(sender=self.__class__, allocation_user_pk=allocation_user.pk)
+            if allocation_user_pks:
+                allocation_activate_users.send(sender=self.__class__, allocation_user_pks=allocation_user_pks)
 
             send_allocation_customer_email(
                 allocation_obj,
@@ -291,9 +349,13 @@ class AllocationDetailView(LoginRequiredMixin, UserPassesTestMixin, TemplateView
 
             if allocation_obj.status.name in ["Denied", "Revoked"]:
                 allocation_disable.send(sender=self.__class__, allocation_pk=allocation_obj.pk)
-                allocation_users = allocation_obj.allocationuser_set.exclude(status__name__in=["Removed", "Error"])
-                for allocation_user in allocation_users:
-                    allocation_remove_user.send(sender=self.__class__, allocation_user_pk=allocation_user.pk)
+                allocation_user_pks = list(
+                    allocation_obj.allocationuser_set.exclude(status__name__in=["Removed", "Error"]).values_list(
+                        "pk", flat=True
+                    )
+                )
+                if allocation_user_pks:
+                    allocation_remove_users.send(sender=self.__class__, allocation_user_pks=allocation_user_pks)
             if allocation_obj.status.name == "Denied":
                 send_allocation_customer_email(
                     allocation_obj,
@@ -407,7 +469,7 @@ class AllocationEULAView(LoginRequiredMixin, UserPassesTestMixin, TemplateView):
                             include_eula=EMAIL_ALLOCATION_EULA_INCLUDE_ACCEPTED_EULA,
                         )
                 if allocation_obj.status == AllocationStatusChoice.objects.get(name="Active"):
-                    allocation_activate_user.send(sender=self.__class__, allocation_user_pk=allocation_user_obj.pk)
+                    allocation_activate_users.send(sender=self.__class__, allocation_user_pks=[allocation_user_obj.pk])
             elif action == "declined_eula":
                 allocation_user_obj.status = AllocationUserStatusChoice.objects.get(name="DeclinedEULA")
                 messages.warning(
@@ -873,6 +935,7 @@ class AllocationAddUsersView(LoginRequiredMixin, UserPassesTestMixin, TemplateVi
             if ALLOCATION_EULA_ENABLE:
                 allocation_user_pending_status_choice = AllocationUserStatusChoice.objects.get(name="PendingEULA")
 
+            activated_allocation_user_pks = []
             for form in formset:
                 user_form_data = form.cleaned_data
                 if user_form_data["selected"]:
@@ -924,7 +987,10 @@ class AllocationAddUsersView(LoginRequiredMixin, UserPassesTestMixin, TemplateVi
                             )
 
                     if allocation_user_obj.status == allocation_user_active_status_choice:
-                        allocation_activate_user.send(sender=self.__class__, allocation_user_pk=allocation_user_obj.pk)
+                        activated_allocation_user_pks.append(allocation_user_obj.pk)
+
+            if activated_allocation_user_pks:
+                allocation_activate_users.send(sender=self.__class__, allocation_user_pks=activated_allocation_user_pks)
 
             user_plural = "user" if users_added_count == 1 else "users"
             messages.success(request, f"Added {users_added_count} {user_plural} to allocation.")
@@ -1019,6 +1085,7 @@ class AllocationRemoveUsersView(LoginRequiredMixin, UserPassesTestMixin, Templat
 
         if formset.is_valid():
             allocation_user_removed_status_choice = AllocationUserStatusChoice.objects.get(name="Removed")
+            removed_allocation_user_pks = []
             for form in formset:
                 user_form_data = form.cleaned_data
                 if user_form_data["selected"]:
@@ -1031,7 +1098,10 @@ class AllocationRemoveUsersView(LoginRequiredMixin, UserPassesTestMixin, Templat
                     allocation_user_obj = allocation_obj.allocationuser_set.get(user=user_obj)
                     allocation_user_obj.status = allocation_user_removed_status_choice
                     allocation_user_obj.save()
-                    allocation_remove_user.send(sender=self.__class__, allocation_user_pk=allocation_user_obj.pk)
+                    removed_allocation_user_pks.append(allocation_user_obj.pk)
+
+            if removed_allocation_user_pks:
+                allocation_remove_users.send(sender=self.__class__, allocation_user_pks=removed_allocation_user_pks)
 
             user_plural = "user" if remove_users_count == 1 else "users"
             messages.success(request, f"Removed {remove_users_count} {user_plural} from allocation.")
@@ -1203,24 +1273,32 @@ class AllocationRequestListView(LoginRequiredMixin, UserPassesTestMixin, Templat
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        allocation_list = Allocation.objects.filter(
-            status__name__in=[
-                "New",
-                "Renewal Requested",
-                "Paid",
-                "Approved",
-            ]
+        attributes = AllocationAttribute.objects.select_related("allocation_attribute_type", "allocationattributeusage")
+        resources = Resource.objects.select_related("resource_type").order_by(*ALLOCATION_RESOURCE_ORDERING)
+        allocation_list = list(
+            annotate_renewal_requested_date(
+                Allocation.objects.filter(
+                    status__name__in=[
+                        "New",
+                        "Renewal Requested",
+                        "Paid",
+                        "Approved",
+                    ]
+                )
+            )
+            .select_related("project__pi", "project__status", "status")
+            .prefetch_related(
+                Prefetch("allocationattribute_set", queryset=attributes),
+                Prefetch("resources", queryset=resources, to_attr="resource_list"),
+                Prefetch("project__projectreview_set", queryset=ProjectReview.objects.select_related("status")),
+            )
         )
 
-        allocation_renewal_dates = {}
-        for allocation in allocation_list.filter(status__name="Renewal Requested"):
-            allocation_history = allocation.history.all().order_by("-history_date")
-            for history in allocation_history:
-                if history.status.name != "Renewal Requested":
-                    break
-                allocation_renewal_dates[allocation.pk] = history.history_date
-
-        context["allocation_renewal_dates"] = allocation_renewal_dates
+        context["allocation_renewal_dates"] = {
+            allocation.pk: allocation.renewal_requested_date
+            for allocation in allocation_list
+            if allocation.renewal_requested_date
+        }
         context["allocation_status_active"] = AllocationStatusChoice.objects.get(name="Active")
         context["allocation_list"] = allocation_list
         return context
@@ -1324,6 +1402,7 @@ class AllocationRenewView(LoginRequiredMixin, UserPassesTestMixin, TemplateView)
         allocation_obj.save()
 
         if not users_in_allocation or formset.is_valid():
+            removed_allocation_user_pks = []
             if users_in_allocation:
                 for form in formset:
                     user_form_data = form.cleaned_data
@@ -1335,7 +1414,7 @@ class AllocationRenewView(LoginRequiredMixin, UserPassesTestMixin, TemplateView)
                         allocation_user_obj.status = allocation_user_removed_status_choice
                         allocation_user_obj.save()
 
-                        allocation_remove_user.send(sender=self.__class__, allocation_user_pk=allocation_user_obj.pk)
+                        removed_allocation_user_pks.append(allocation_user_obj.pk)
 
                     elif user_status == "remove_from_project":
                         for active_allocation in allocation_obj.project.allocation_set.filter(
@@ -1354,14 +1433,15 @@ class AllocationRenewView(LoginRequiredMixin, UserPassesTestMixin, TemplateView)
                             allocation_user_obj = active_allocation.allocationuser_set.get(user=user_obj)
                             allocation_user_obj.status = allocation_user_removed_status_choice
                             allocation_user_obj.save()
-                            allocation_remove_user.send(
-                                sender=self.__class__, allocation_user_pk=allocation_user_obj.pk
-                            )
+                            removed_allocation_user_pks.append(allocation_user_obj.pk)
 
                         project_user_obj = ProjectUser.objects.get(project=allocation_obj.project, user=user_obj)
                         project_user_obj.status = project_user_remove_status_choice
                         project_user_obj.save()
 
+            if removed_allocation_user_pks:
+                allocation_remove_users.send(sender=self.__class__, allocation_user_pks=removed_allocation_user_pks)
+
             send_allocation_admin_email(
                 allocation_obj,
                 "Allocation Renewed",
@@ -1406,10 +1486,12 @@ class AllocationInvoiceListView(LoginRequiredMixin, UserPassesTestMixin, ListVie
 
 # this is the view class thats rendering allocation_invoice_detail.
 # each view class has a view template that renders
-class AllocationInvoiceDetailView(LoginRequiredMixin, UserPassesTestMixin, TemplateView):
+class AllocationInvoiceDetailView(LoginRequiredMixin, UserPassesTestMixin, AllocationDetailMixin, TemplateView):
     model = Allocation
     template_name = "allocation/allocation_invoice_detail.html"
     context_object_name = "allocation"
+    # invoice notes are shown to everyone who can manage invoices
+    include_private_notes = True
 
     def test_func(self):
         """UserPassesTestMixin Tests"""
@@ -1425,58 +1507,11 @@ class AllocationInvoiceDetailView(LoginRequiredMixin, UserPassesTestMixin, Templ
     def get_context_data(self, **kwargs):
         """Create all the variables for allocation_invoice_detail.html"""
         context = super().get_context_data(**kwargs)
-        pk = self.kwargs.get("pk")
-        allocation_obj = get_object_or_404(Allocation, pk=pk)
-        allocation_users = allocation_obj.allocationuser_set.exclude(status__name__in=["Removed"]).order_by(
-            "user__username"
-        )
-
-        alloc_attr_set = allocation_obj.get_attribute_set(self.request.user)
-
-        attributes_with_usage = [a for a in alloc_attr_set if hasattr(a, "allocationattributeusage")]
-        attributes = [a for a in alloc_attr_set]
-
-        guage_data = []
-        invalid_attributes = []
-        for attribute in attributes_with_usage:
-            try:
-                guage_data.append(
-                    generate_guauge_data_from_usage(
-                        attribute.allocation_attribute_type.name,
-                        float(attribute.value),
-                        float(attribute.allocationattributeusage.value),
-                    )
-                )
-            except ValueError:
-                logger.error(
-                    "Allocation attribute '%s' is not an int but has a usage", attribute.allocation_attribute_type.name
-                )
-                invalid_attributes.append(attribute)
-
-        for a in invalid_attributes:
-            attributes_with_usage.remove(a)
-
-        context["guage_data"] = guage_data
-        context["attributes_with_usage"] = attributes_with_usage
-        context["attributes"] = attributes
-
-        # Can the user update the project?
-        context["is_allowed_to_update_project"] = allocation_obj.project.has_perm(
-            self.request.user, ProjectPermission.UPDATE
-        )
-        context["allocation_users"] = allocation_users
-
-        if self.request.user.is_superuser:
-            notes = allocation_obj.allocationusernote_set.all()
-        else:
-            notes = allocation_obj.allocationusernote_set.filter(is_private=False)
-
-        context["notes"] = notes
+        context.update(self.get_allocation_context(self.get_allocation()))
         return context
 
     def get(self, request, *args, **kwargs):
-        pk = self.kwargs.get("pk")
-        allocation_obj = get_object_or_404(Allocation, pk=pk)
+        allocation_obj = self.get_allocation()
 
         initial_data = {
             "status": allocation_obj.status,
@@ -1486,7 +1521,6 @@ class AllocationInvoiceDetailView(LoginRequiredMixin, UserPassesTestMixin, Templ
 
         context = self.get_context_data()
         context["form"] = form
-        context["allocation"] = allocation_obj
 
         return render(request, self.template_name, context)
 
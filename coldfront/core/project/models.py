@@ -129,10 +129,8 @@ We do not have information about your research. Please provide a detailed descri
             ProjectReview: the last project review that was created for this project
         """
 
-        if self.projectreview_set.exists():
-            return self.projectreview_set.order_by("-created")[0]
-        else:
-            return None
+        # uses prefetched project reviews when there are any
+        return max(self.projectreview_set.all(), key=lambda review: review.created, default=None)
 
     @property
     def latest_grant(self):
@@ -179,11 +177,9 @@ We do not have information about your research. Please provide a detailed descri
         if self.requires_review is False:
             return False
 
-        if self.projectreview_set.exists():
-            last_review = self.projectreview_set.order_by("-created")[0]
+        last_review = self.last_project_review
+        if last_review:
             last_review_over_365_days = (now - last_review.created).days > 365
-        else:
-            last_review = None
 
         days_since_creation = (now - self.created).days
 
@@ -6,9 +6,10 @@ import logging
 
 from django.test import TestCase
 
-from coldfront.core.project.models import ProjectUserStatusChoice
+from coldfront.core.project.models import ProjectUser, ProjectUserStatusChoice
 from coldfront.core.test_helpers import utils
 from coldfront.core.test_helpers.factories import (
+    AllocationUserStatusChoiceFactory,
     PAttributeTypeFactory,
     ProjectAttributeFactory,
     ProjectAttributeTypeFactory,
@@ -16,6 +17,7 @@ from coldfront.core.test_helpers.factories import (
     ProjectStatusChoiceFactory,
     ProjectUserFactory,
     ProjectUserRoleChoiceFactory,
+    ProjectUserStatusChoiceFactory,
     UserFactory,
 )
 
@@ -372,6 +374,44 @@ class ProjectAddUsersSearchView(ProjectViewTestBase):
         self.project_access_tstbase(self.url)
 
 
+class ProjectAddUsersViewTest(ProjectViewTestBase):
+    """Tests for ProjectAddUsersView"""
+
+    def setUp(self):
+        """set up users and project for testing"""
+        self.url = f"/project/{self.project.pk}/add-users/"
+        ProjectUserStatusChoiceFactory(name="Active")
+        AllocationUserStatusChoiceFactory(name="Active")
+        self.new_users = [UserFactory(username=f"newuser{i}") for i in range(3)]
+
+    def test_projectaddusersview_adds_multiple_users(self):
+        """test adding several users found by a multi-username search"""
+        role = self.project_user.role
+        data = {
+            "q": " ".join(user.username for user in self.new_users),
+            "search_by": "username_only",
+            "userform-TOTAL_FORMS": len(self.new_users),
+            "userform-INITIAL_FORMS": len(self.new_users),
+            "allocationform-TOTAL_FORMS": 0,
+            "allocationform-INITIAL_FORMS": 0,
+        }
+        for i in range(len(self.new_users)):
+            data[f"userform-{i}-role"] = role.pk
+            data[f"userform-{i}-selected"] = "on"
+
+        self.client.force_login(self.admin_user, backend=self.backend)
+        response = self.client.post(self.url, data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            set(
+                ProjectUser.objects.filter(project=self.project, status__name="Active").values_list(
+                    "user__username", flat=True
+                )
+            ),
+            {self.project_user.user.username, self.project.pi.username} | {user.username for user in self.new_users},
+        )
+
+
 class ProjectUserDetailViewTest(ProjectViewTestBase):
     """Tests for ProjectUserDetailView"""
 
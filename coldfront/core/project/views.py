@@ -30,7 +30,7 @@ from coldfront.core.allocation.models import (
     AllocationUser,
     AllocationUserStatusChoice,
 )
-from coldfront.core.allocation.signals import allocation_activate_user, allocation_remove_user
+from coldfront.core.allocation.signals import allocation_activate_users, allocation_remove_users
 from coldfront.core.allocation.utils import generate_guauge_data_from_usage
 from coldfront.core.grant.models import Grant
 from coldfront.core.project.forms import (
@@ -716,15 +716,19 @@ class ProjectAddUsersSearchResultsView(LoginRequiredMixin, UserPassesTestMixin,
 
         project_obj = get_object_or_404(Project, pk=pk)
 
-        users_to_exclude = [ele.user.username for ele in project_obj.projectuser_set.filter(status__name="Active")]
+        users_to_exclude = list(
+            project_obj.projectuser_set.filter(status__name="Active").values_list("user__username", flat=True)
+        )
 
         cobmined_user_search_obj = CombinedUserSearch(user_search_string, search_by, users_to_exclude)
 
         context = cobmined_user_search_obj.search()
 
         matches = context.get("matches")
-        for match in matches:
-            match.update({"role": ProjectUserRoleChoice.objects.get(name="User")})
+        if matches:
+            user_role_choice = ProjectUserRoleChoice.objects.get(name="User")
+            for match in matches:
+                match.update({"role": user_role_choice})
 
         if matches:
             formset = formset_factory(ProjectAddUserForm, max_num=len(matches))
@@ -734,9 +738,10 @@ class ProjectAddUsersSearchResultsView(LoginRequiredMixin, UserPassesTestMixin,
             context["search_by"] = search_by
 
         if len(user_search_string.split()) > 1:
+            usernames_to_exclude = set(users_to_exclude)
             users_already_in_project = []
             for ele in user_search_string.split():
-                if ele in users_to_exclude:
+                if ele in usernames_to_exclude:
                     users_already_in_project.append(ele)
             context["users_already_in_project"] = users_already_in_project
 
@@ -808,15 +813,19 @@ class ProjectAddUsersView(LoginRequiredMixin, UserPassesTestMixin, View):
 
         project_obj = get_object_or_404(Project, pk=pk)
 
-        users_to_exclude = [ele.user.username for ele in project_obj.projectuser_set.filter(status__name="Active")]
+        users_to_exclude = list(
+            project_obj.projectuser_set.filter(status__name="Active").values_list("user__username", flat=True)
+        )
 
         cobmined_user_search_obj = CombinedUserSearch(user_search_string, search_by, users_to_exclude)
 
         context = cobmined_user_search_obj.search()
 
         matches = context.get("matches")
-        for match in matches:
-            match.update({"role": ProjectUserRoleChoice.objects.get(name="User")})
+        if matches:
+            user_role_choice = ProjectUserRoleChoice.objects.get(name="User")
+            for match in matches:
+                match.update({"role": user_role_choice})
 
         formset = formset_factory(ProjectAddUserForm, max_num=len(matches))
         formset = formset(request.POST, initial=matches, prefix="userform")
@@ -839,66 +848,98 @@ class ProjectAddUsersView(LoginRequiredMixin, UserPassesTestMixin, View):
             if ALLOCATION_EULA_ENABLE:
                 allocation_user_pending_status_choice = AllocationUserStatusChoice.objects.get(name="PendingEULA")
 
-            allocations_selected_objs = Allocation.objects.filter(
-                pk__in=[
-                    allocation_form.cleaned_data.get("pk")
-                    for allocation_form in allocation_formset
-                    if allocation_form.cleaned_data.get("selected")
-                ]
+            allocations_selected_objs = list(
+                Allocation.objects.filter(
+                    pk__in=[
+                        allocation_form.cleaned_data.get("pk")
+                        for allocation_form in allocation_formset
+                        if allocation_form.cleaned_data.get("selected")
+                    ]
+                )
             )
-            for form in formset:
-                user_form_data = form.cleaned_data
-                if user_form_data["selected"]:
-                    added_users_count += 1
+            selected_user_form_data = [form.cleaned_data for form in formset if form.cleaned_data["selected"]]
+            selected_usernames = [user_form_data.get("username") for user_form_data in selected_user_form_data]
+
+            # Fetch everything the loop below needs up front rather than once per user
+            users_by_username = {
+                user_obj.username: user_obj for user_obj in User.objects.filter(username__in=selected_usernames)
+            }
+            project_users_by_user = {
+                project_user_obj.user_id: project_user_obj
+                for project_user_obj in project_obj.projectuser_set.filter(user__username__in=selected_usernames)
+            }
+            allocation_users_by_key = {
+                (allocation_user_obj.allocation_id, allocation_user_obj.user_id): allocation_user_obj
+                for allocation_user_obj in AllocationUser.objects.filter(
+                    allocation__in=allocations_selected_objs, user__username__in=selected_usernames
+                ).select_related("status")
+            }
+            allocation_has_eula = {allocation.pk: allocation.get_eula() for allocation in allocations_selected_objs}
+
+            activated_allocation_user_pks = []
+            for user_form_data in selected_user_form_data:
+                added_users_count += 1
 
+                username = user_form_data.get("username")
+                user_fields = {
+                    "first_name": user_form_data.get("first_name"),
+                    "last_name": user_form_data.get("last_name"),
+                    "email": user_form_data.get("email"),
+                }
+                user_obj = users_by_username.get(username)
+                if user_obj is None:
                     # Will create local copy of user if not already present in local database
-                    user_obj, _ = User.objects.get_or_create(username=user_form_data.get("username"))
-                    user_obj.first_name = user_form_data.get("first_name")
-                    user_obj.last_name = user_form_data.get("last_name")
-                    user_obj.email = user_form_data.get("email")
+                    user_obj = User.objects.create(username=username, **user_fields)
+                    users_by_username[username] = user_obj
+                elif any(getattr(user_obj, field) != value for field, value in user_fields.items()):
+                    for field, value in user_fields.items():
+                        setattr(user_obj, field, value)
                     user_obj.save()
 
-                    role_choice = user_form_data.get("role")
-                    # Is the user already in the project?
-                    if project_obj.projectuser_set.filter(user=user_obj).exists():
-                        project_user_obj = project_obj.projectuser_set.get(user=user_obj)
-                        project_user_obj.role = role_choice
-                        project_user_obj.status = project_user_active_status_choice
-                        project_user_obj.save()
+                role_choice = user_form_data.get("role")
+                # Is the user already in the project?
+                project_user_obj = project_users_by_user.get(user_obj.pk)
+                if project_user_obj is not None:
+                    project_user_obj.role = role_choice
+                    project_user_obj.status = project_user_active_status_choice
+                    project_user_obj.save()
+                else:
+                    project_user_obj = ProjectUser.objects.create(
+                        user=user_obj,
+                        project=project_obj,
+                        role=role_choice,
+                        status=project_user_active_status_choice,
+                    )
+                    project_users_by_user[user_obj.pk] = project_user_obj
+
+                # project signals
+                project_activate_user.send(sender=self.__class__, project_user_pk=project_user_obj.pk)
+
+                for allocation in allocations_selected_objs:
+                    has_eula = allocation_has_eula[allocation.pk]
+                    user_status_choice = allocation_user_active_status_choice
+                    allocation_user_obj = allocation_users_by_key.get((allocation.pk, user_obj.pk))
+                    if allocation_user_obj is not None:
+                        if (
+                            ALLOCATION_EULA_ENABLE
+                            and has_eula
+                            and (allocation_user_obj.status != allocation_user_active_status_choice)
+                        ):
+                            user_status_choice = allocation_user_pending_status_choice
+                        allocation_user_obj.status = user_status_choice
+                        allocation_user_obj.save()
                     else:
-                        project_user_obj = ProjectUser.objects.create(
-                            user=user_obj,
-                            project=project_obj,
-                            role=role_choice,
-                            status=project_user_active_status_choice,
+                        if ALLOCATION_EULA_ENABLE and has_eula:
+                            user_status_choice = allocation_user_pending_status_choice
+                        allocation_user_obj = AllocationUser.objects.create(
+                            allocation=allocation, user=user_obj, status=user_status_choice
                         )
+                        allocation_users_by_key[(allocation.pk, user_obj.pk)] = allocation_user_obj
+                    if user_status_choice == allocation_user_active_status_choice:
+                        activated_allocation_user_pks.append(allocation_user_obj.pk)
 
-                    # project signals
-                    project_activate_user.send(sender=self.__class__, project_user_pk=project_user_obj.pk)
-
-                    for allocation in allocations_selected_objs:
-                        has_eula = allocation.get_eula()
-                        user_status_choice = allocation_user_active_status_choice
-                        if allocation.allocationuser_set.filter(user=user_obj).exists():
-                            allocation_user_obj = allocation.allocationuser_set.get(user=user_obj)
-                            if (
-                                ALLOCATION_EULA_ENABLE
-                                and has_eula
-                                and (allocation_user_obj.status != allocation_user_active_status_choice)
-                            ):
-                                user_status_choice = allocation_user_pending_status_choice
-                            allocation_user_obj.status = user_status_choice
-                            allocation_user_obj.save()
-                        else:
-                            if ALLOCATION_EULA_ENABLE and has_eula:
-                                user_status_choice = allocation_user_pending_status_choice
-                            allocation_user_obj = AllocationUser.objects.create(
-                                allocation=allocation, user=user_obj, status=user_status_choice
-                            )
-                        if user_status_choice == allocation_user_active_status_choice:
-                            allocation_activate_user.send(
-                                sender=self.__class__, allocation_user_pk=allocation_user_obj.pk
-                            )
+            if activated_allocation_user_pks:
+                allocation_activate_users.send(sender=self.__class__, allocation_user_pks=activated_allocation_user_pks)
 
             messages.success(request, "Added {} users to project.".format(added_users_count))
         else:
@@ -986,6 +1027,7 @@ class ProjectRemoveUsersView(LoginRequiredMixin, UserPassesTestMixin, TemplateVi
         if formset.is_valid():
             project_user_removed_status_choice = ProjectUserStatusChoice.objects.get(name="Removed")
             allocation_user_removed_status_choice = AllocationUserStatusChoice.objects.get(name="Removed")
+            removed_allocation_user_pks = []
             for form in formset:
                 user_form_data = form.cleaned_data
                 if user_form_data["selected"]:
@@ -1017,9 +1059,10 @@ class ProjectRemoveUsersView(LoginRequiredMixin, UserPassesTestMixin, TemplateVi
                             allocation_user_obj.status = allocation_user_removed_status_choice
                             allocation_user_obj.save()
 
-                            allocation_remove_user.send(
-                                sender=self.__class__, allocation_user_pk=allocation_user_obj.pk
-                            )
+                            removed_allocation_user_pks.append(allocation_user_obj.pk)
+
+            if removed_allocation_user_pks:
+                allocation_remove_users.send(sender=self.__class__, allocation_user_pks=removed_allocation_user_pks)
 
             if remove_users_count == 1:
                 messages.success(request, "Removed {} user from project.".format(remove_users_count))
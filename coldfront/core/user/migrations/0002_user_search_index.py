@@ -0,0 +1,88 @@
+# SPDX-FileCopyrightText: (C) ColdFront Authors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+import logging
+
+from django.db import DatabaseError, migrations, transaction
+
+logger = logging.getLogger(__name__)
+
+USER_SEARCH_INDEX_TABLE = "user_usersearchindex"
+USER_SEARCH_FIELDS = ["username", "first_name", "last_name", "email"]
+
+SQLITE_FORWARD = [
+    f"""CREATE VIRTUAL TABLE {USER_SEARCH_INDEX_TABLE} USING fts5(
+        {", ".join(USER_SEARCH_FIELDS)}, content='auth_user', content_rowid='id', tokenize='trigram'
+    )""",
+    f"""CREATE TRIGGER {USER_SEARCH_INDEX_TABLE}_ai AFTER INSERT ON auth_user BEGIN
+        INSERT INTO {USER_SEARCH_INDEX_TABLE}(rowid, {", ".join(USER_SEARCH_FIELDS)})
+        VALUES (new.id, {", ".join("new." + f for f in USER_SEARCH_FIELDS)});
+    END""",
+    f"""CREATE TRIGGER {USER_SEARCH_INDEX_TABLE}_ad AFTER DELETE ON auth_user BEGIN
+        INSERT INTO {USER_SEARCH_INDEX_TABLE}({USER_SEARCH_INDEX_TABLE}, rowid, {", ".join(USER_SEARCH_FIELDS)})
+        VALUES ('delete', old.id, {", ".join("old." + f for f in USER_SEARCH_FIELDS)});
+    END""",
+    f"""CREATE TRIGGER {USER_SEARCH_INDEX_TABLE}_au AFTER UPDATE ON auth_user BEGIN
+        INSERT INTO {USER_SEARCH_INDEX_TABLE}({USER_SEARCH_INDEX_TABLE}, rowid, {", ".join(USER_SEARCH_FIELDS)})
+        VALUES ('delete', old.id, {", ".join("old." + f for f in USER_SEARCH_FIELDS)});
+        INSERT INTO {USER_SEARCH_INDEX_TABLE}(rowid, {", ".join(USER_SEARCH_FIELDS)})
+        VALUES (new.id, {", ".join("new." + f for f in USER_SEARCH_FIELDS)});
+    END""",
+    f"INSERT INTO {USER_SEARCH_INDEX_TABLE}({USER_SEARCH_INDEX_TABLE}) VALUES ('rebuild')",
+]
+
+SQLITE_REVERSE = [
+    f"DROP TRIGGER IF EXISTS {USER_SEARCH_INDEX_TABLE}_ai",
+    f"DROP TRIGGER IF EXISTS {USER_SEARCH_INDEX_TABLE}_ad",
+    f"DROP TRIGGER IF EXISTS {USER_SEARCH_INDEX_TABLE}_au",
+    f"DROP TABLE IF EXISTS {USER_SEARCH_INDEX_TABLE}",
+]
+
+# Matches the UPPER(...) LIKE UPPER(...) that Django generates for icontains
+POSTGRESQL_FORWARD = ["CREATE EXTENSION IF NOT EXISTS pg_trgm"] + [
+    f'CREATE INDEX IF NOT EXISTS auth_user_{field}_upper_trgm ON auth_user USING gin (UPPER("{field}"::text) gin_trgm_ops)'
+    for field in USER_SEARCH_FIELDS
+]
+
+POSTGRESQL_REVERSE = [f"DROP INDEX IF EXISTS auth_user_{field}_upper_trgm" for field in USER_SEARCH_FIELDS]
+
+
+def run_statements(schema_editor, statements):
+    """Run statements in a savepoint. The index is an optimization, so if the
+    database does not support it (no FTS5 trigram tokenizer, no permission to
+    create pg_trgm) the migration logs a warning and user search falls back to
+    unindexed queries."""
+    try:
+        with transaction.atomic(using=schema_editor.connection.alias):
+            for statement in statements:
+                schema_editor.execute(statement)
+    except DatabaseError as e:
+        logger.warning("Unable to create user search index, falling back to unindexed search: %s", e)
+
+
+def create_user_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        run_statements(schema_editor, SQLITE_FORWARD)
+    elif vendor == "postgresql":
+        run_statements(schema_editor, POSTGRESQL_FORWARD)
+
+
+def drop_user_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        run_statements(schema_editor, SQLITE_REVERSE)
+    elif vendor == "postgresql":
+        run_statements(schema_editor, POSTGRESQL_REVERSE)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("auth", "0012_alter_user_first_name_max_length"),
+        ("user", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_user_search_index, drop_user_search_index),
+    ]
@@ -2,10 +2,38 @@
 #
 # SPDX-License-Identifier: AGPL-3.0-or-later
 
-from django.test import TestCase
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 
 from coldfront.core.test_helpers.factories import UserFactory
 from coldfront.core.user.models import UserProfile
+from coldfront.core.user.utils import CombinedUserSearch, LocalUserSearch, UserSearch
+
+
+class RemoteUserSearch(UserSearch):
+    search_source = "remote"
+    calls = 0
+    threads = set()
+
+    def search_a_user(self, user_search_string=None, search_by="all_fields"):
+        RemoteUserSearch.calls += 1
+        RemoteUserSearch.threads.add(threading.current_thread().name)
+        return [
+            {"username": "localuser", "first_name": "", "last_name": "", "email": "", "source": self.search_source},
+            {"username": "remoteuser", "first_name": "", "last_name": "", "email": "", "source": self.search_source},
+        ]
+
+
+class SlowUserSearch(UserSearch):
+    search_source = "slow"
+
+    def search_a_user(self, user_search_string=None, search_by="all_fields"):
+        time.sleep(1)
+        return [{"username": "slowuser", "first_name": "", "last_name": "", "email": "", "source": self.search_source}]
 
 
 class TestUserProfile(TestCase):
@@ -49,3 +77,99 @@ class TestUserProfile(TestCase):
         with self.assertRaises(UserProfile.DoesNotExist):
             UserProfile.objects.get(pk=profile_obj.pk)
         self.assertEqual(0, len(UserProfile.objects.all()))
+
+
+class TestLocalUserSearch(TestCase):
+    def setUp(self):
+        RemoteUserSearch.calls = 0
+        # fixed names and emails so substring searches only match usernames
+        for username in ["alice", "bob", "carol"]:
+            UserFactory(username=username, first_name="", last_name="", email=f"{username}@example.org")
+        UserFactory(username="dave", first_name="", last_name="", email="dave@example.org", is_active=False)
+
+    def test_search_usernames_single_query(self):
+        with self.assertNumQueries(1):
+            matches = LocalUserSearch("carol alice dave zed", "username_only").search()
+        self.assertEqual([m["username"] for m in matches], ["alice", "carol"])
+
+    def test_search_substring_ranked(self):
+        UserFactory(username="malice", first_name="Alice")
+        matches = LocalUserSearch("alic", "all_fields").search()
+        self.assertEqual([m["username"] for m in matches], ["alice", "malice"])
+
+    def test_search_short_string(self):
+        matches = LocalUserSearch("ca", "all_fields").search()
+        self.assertEqual([m["username"] for m in matches], ["carol"])
+
+    def test_search_index_follows_updates(self):
+        user = User.objects.get(username="bob")
+        user.last_name = "Robertson"
+        user.save()
+        self.assertEqual([m["username"] for m in LocalUserSearch("roberts", "all_fields").search()], ["bob"])
+
+        user.delete()
+        self.assertEqual(LocalUserSearch("roberts", "all_fields").search(), [])
+
+    def test_search_usernames_default_per_username(self):
+        matches = RemoteUserSearch("", "username_only").search_usernames(["a", "b"])
+        self.assertEqual(len(matches), 4)
+        self.assertEqual(RemoteUserSearch.calls, 2)
+
+
+@override_settings(
+    ADDITIONAL_USER_SEARCH_CLASSES=["coldfront.core.user.tests.tests.RemoteUserSearch"],
+    USER_SEARCH_CACHE_TIMEOUT=60,
+)
+class TestCombinedUserSearch(TestCase):
+    def setUp(self):
+        cache.clear()
+        RemoteUserSearch.calls = 0
+        UserFactory(username="localuser")
+
+    def test_settings_classes_not_mutated(self):
+        from django.conf import settings
+
+        for _ in range(3):
+            CombinedUserSearch("user", "all_fields")
+        self.assertEqual(settings.ADDITIONAL_USER_SEARCH_CLASSES, ["coldfront.core.user.tests.tests.RemoteUserSearch"])
+
+    def test_search_dedupes_in_source_order(self):
+        matches = CombinedUserSearch("user", "all_fields").search()["matches"]
+        self.assertEqual(
+            [(m["username"], m["source"]) for m in matches], [("localuser", "local"), ("remoteuser", "remote")]
+        )
+
+    def test_search_excludes_usernames(self):
+        matches = CombinedUserSearch("user", "all_fields", ["remoteuser"]).search()["matches"]
+        self.assertEqual([m["username"] for m in matches], ["localuser"])
+
+    @override_settings(USER_SEARCH_CACHE_TIMEOUT=0)
+    def test_search_threads_reused(self):
+        RemoteUserSearch.threads = set()
+        for _ in range(20):
+            CombinedUserSearch("user", "all_fields").search()
+        self.assertEqual(RemoteUserSearch.calls, 20)
+        self.assertLessEqual(len(RemoteUserSearch.threads), 8)
+        self.assertTrue(all(name.startswith("user-search") for name in RemoteUserSearch.threads))
+
+    def test_search_results_cached(self):
+        CombinedUserSearch("user", "all_fields").search()
+        CombinedUserSearch("user", "all_fields", ["localuser"]).search()
+        self.assertEqual(RemoteUserSearch.calls, 1)
+
+    @override_settings(
+        ADDITIONAL_USER_SEARCH_CLASSES=[
+            "coldfront.core.user.tests.tests.SlowUserSearch",
+            "coldfront.core.user.tests.tests.RemoteUserSearch",
+        ],
+        USER_SEARCH_TIMEOUT=0.1,
+    )
+    def test_slow_source_skipped(self):
+        start = time.monotonic()
+        matches = CombinedUserSearch("user", "all_fields").search()["matches"]
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual([m["username"] for m in matches], ["localuser", "remoteuser"])
+
+        # partial results are not cached
+        CombinedUserSearch("user", "all_fields").search()
+        self.assertEqual(RemoteUserSearch.calls, 2)
@@ -3,16 +3,88 @@
 # SPDX-License-Identifier: AGPL-3.0-or-later
 
 import abc
+import hashlib
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
 from django.contrib.auth.models import User
-from django.db.models import Q
+from django.core.cache import cache
+from django.db import DatabaseError, connection, connections
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.db.models.expressions import RawSQL
 from django.utils.module_loading import import_string
 
 from coldfront.core.utils.common import import_from_settings
 
 logger = logging.getLogger(__name__)
 
+LOCAL_USER_SEARCH_CLASS = "coldfront.core.user.utils.LocalUserSearch"
+
+# SQLite FTS5 trigram index over auth_user, created by user migration 0002.
+# PostgreSQL uses pg_trgm indexes on auth_user directly so needs no table.
+USER_SEARCH_INDEX_TABLE = "user_usersearchindex"
+USER_SEARCH_INDEX_MIN_LENGTH = 3
+
+_user_search_index_available = {}
+
+
+def user_search_index_available():
+    """Returns True if the SQLite full text user search index exists"""
+    if connection.vendor != "sqlite":
+        return False
+
+    if connection.alias not in _user_search_index_available:
+        try:
+            _user_search_index_available[connection.alias] = USER_SEARCH_INDEX_TABLE in (
+                connection.introspection.table_names()
+            )
+        except DatabaseError:
+            return False
+    return _user_search_index_available[connection.alias]
+
+
+def user_search_filter(user_search_string):
+    """Returns a Q object matching users whose username, first name, last name
+    or email contain user_search_string. On SQLite this uses the FTS5 trigram
+    index when available, trigrams need at least 3 characters so shorter search
+    strings fall back to icontains as do other databases. On PostgreSQL the
+    icontains lookups are served by the pg_trgm indexes."""
+    if len(user_search_string) >= USER_SEARCH_INDEX_MIN_LENGTH and user_search_index_available():
+        match = '"{}"'.format(user_search_string.replace('"', '""'))
+        return Q(
+            pk__in=RawSQL(
+                f"SELECT rowid FROM {USER_SEARCH_INDEX_TABLE} WHERE {USER_SEARCH_INDEX_TABLE} MATCH %s", [match]
+            )
+        )
+
+    return (
+        Q(username__icontains=user_search_string)
+        | Q(first_name__icontains=user_search_string)
+        | Q(last_name__icontains=user_search_string)
+        | Q(email__icontains=user_search_string)
+    )
+
+
+def user_search_rank(user_search_string):
+    """Returns an expression ranking exact username matches first, then
+    username prefix matches, then prefix matches on the other fields, then
+    substring matches"""
+    return Case(
+        When(username__iexact=user_search_string, then=Value(0)),
+        When(username__istartswith=user_search_string, then=Value(1)),
+        When(
+            Q(first_name__istartswith=user_search_string)
+            | Q(last_name__istartswith=user_search_string)
+            | Q(email__istartswith=user_search_string),
+            then=Value(2),
+        ),
+        default=Value(3),
+        output_field=IntegerField(),
+    )
+
 
 class UserSearch(abc.ABC):
     def __init__(self, user_search_string, search_by):
@@ -23,16 +95,20 @@ class UserSearch(abc.ABC):
     def search_a_user(self, user_search_string=None, search_by="all_fields"):
         pass
 
+    def search_usernames(self, usernames):
+        """Look up a list of exact usernames. Subclasses should override this
+        with a single bulk query, the default looks up each username in turn"""
+        matches = []
+        for username in usernames:
+            match = self.search_a_user(username, "username_only")
+            if match:
+                matches.extend(match)
+        return matches
+
     def search(self):
         if len(self.user_search_string.split()) > 1:
-            search_by = "username_only"
-            matches = []
-
-            user_search_string = sorted(list(set(self.user_search_string.split())))
-            for username in user_search_string:
-                match = self.search_a_user(username, search_by)
-                if match:
-                    matches.extend(match)
+            usernames = sorted(set(self.user_search_string.split()))
+            matches = self.search_usernames(usernames)
         else:
             matches = self.search_a_user(self.user_search_string, self.search_by)
 
@@ -46,14 +122,9 @@ class LocalUserSearch(UserSearch):
         size_limit = 50
         if user_search_string and search_by == "all_fields":
             entries = (
-                User.objects.filter(
-                    Q(username__icontains=user_search_string)
-                    | Q(first_name__icontains=user_search_string)
-                    | Q(last_name__icontains=user_search_string)
-                    | Q(email__icontains=user_search_string)
-                )
-                .filter(Q(is_active=True))
-                .distinct()[:size_limit]
+                User.objects.filter(user_search_filter(user_search_string), is_active=True)
+                .annotate(search_rank=user_search_rank(user_search_string))
+                .order_by("search_rank", "username")[:size_limit]
             )
 
         elif user_search_string and search_by == "username_only":
@@ -61,52 +132,133 @@ class LocalUserSearch(UserSearch):
         else:
             entries = User.objects.all()[:size_limit]
 
-        users = []
-        for idx, user in enumerate(entries, 1):
-            if user:
-                user_dict = {
-                    "last_name": user.last_name,
-                    "first_name": user.first_name,
-                    "username": user.username,
-                    "email": user.email,
-                    "source": self.search_source,
-                }
-                users.append(user_dict)
+        users = [self.user_to_dict(user) for user in entries if user]
 
         logger.info("Local user search for %s found %s results", user_search_string, len(users))
         return users
 
+    def search_usernames(self, usernames):
+        entries = User.objects.filter(username__in=usernames, is_active=True).order_by("username")
+        users = [self.user_to_dict(user) for user in entries]
+
+        logger.info("Local user search for %s usernames found %s results", len(usernames), len(users))
+        return users
+
+    def user_to_dict(self, user):
+        return {
+            "last_name": user.last_name,
+            "first_name": user.first_name,
+            "username": user.username,
+            "email": user.email,
+            "source": self.search_source,
+        }
+
+
+# Additional user search sources are queried by one long-lived pool of threads
+# shared by all requests, so sources that keep a connection per thread (e.g.
+# LDAP) reuse it instead of binding a new one for every search
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_user_search_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=import_from_settings("USER_SEARCH_MAX_WORKERS", 8), thread_name_prefix="user-search"
+            )
+        return _executor
+
+
+def _run_user_search(search_class, user_search_string, search_by):
+    """Run a user search class in a worker thread, closing any database
+    connections the thread opened"""
+    try:
+        cls = import_string(search_class)
+        return cls(user_search_string, search_by).search()
+    finally:
+        connections.close_all()
+
 
 class CombinedUserSearch:
     def __init__(self, user_search_string, search_by, usernames_names_to_exclude=[]):
-        self.USER_SEARCH_CLASSES = import_from_settings("ADDITIONAL_USER_SEARCH_CLASSES", [])
-        self.USER_SEARCH_CLASSES.insert(0, "coldfront.core.user.utils.LocalUserSearch")
+        self.USER_SEARCH_CLASSES = [LOCAL_USER_SEARCH_CLASS] + list(
+            import_from_settings("ADDITIONAL_USER_SEARCH_CLASSES", [])
+        )
+        self.USER_SEARCH_TIMEOUT = import_from_settings("USER_SEARCH_TIMEOUT", 5)
+        self.USER_SEARCH_CACHE_TIMEOUT = import_from_settings("USER_SEARCH_CACHE_TIMEOUT", 60)
         self.user_search_string = user_search_string
         self.search_by = search_by
         self.usernames_names_to_exclude = usernames_names_to_exclude
 
+    def get_cache_key(self):
+        key = "|".join([self.search_by or "", self.user_search_string] + self.USER_SEARCH_CLASSES)
+        return "user_search:" + hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def search_all_sources(self):
+        """Query every search class and return a list of results per class, in
+        class order. The local database is searched in the calling thread while
+        additional sources are queried concurrently, each with a timeout. The
+        second value returned is False if any source failed or timed out."""
+        results = {}
+        complete = True
+        remote_classes = [c for c in self.USER_SEARCH_CLASSES if c != LOCAL_USER_SEARCH_CLASS]
+
+        futures = {}
+        if remote_classes:
+            executor = get_user_search_executor()
+            for search_class in remote_classes:
+                futures[search_class] = executor.submit(
+                    _run_user_search, search_class, self.user_search_string, self.search_by
+                )
+
+        try:
+            if LOCAL_USER_SEARCH_CLASS in self.USER_SEARCH_CLASSES:
+                results[LOCAL_USER_SEARCH_CLASS] = LocalUserSearch(self.user_search_string, self.search_by).search()
+
+            deadline = time.monotonic() + self.USER_SEARCH_TIMEOUT
+            for search_class, future in futures.items():
+                try:
+                    results[search_class] = future.result(timeout=max(0, deadline - time.monotonic()))
+                except FutureTimeoutError:
+                    logger.warning("User search %s timed out after %s seconds", search_class, self.USER_SEARCH_TIMEOUT)
+                    complete = False
+                except Exception as e:
+                    logger.error("User search %s failed: %s", search_class, e)
+                    complete = False
+        finally:
+            # do not wait on sources that timed out, drop them if they have not started
+            for future in futures.values():
+                future.cancel()
+
+        return [results.get(search_class, []) for search_class in self.USER_SEARCH_CLASSES], complete
+
     def search(self):
         matches = []
         usernames_not_found = []
-        usernames_found = []
+        usernames_found = set()
+        usernames_to_exclude = set(self.usernames_names_to_exclude)
 
-        for search_class in self.USER_SEARCH_CLASSES:
-            cls = import_string(search_class)
-            search_class_obj = cls(self.user_search_string, self.search_by)
-            users = search_class_obj.search()
+        cache_key = self.get_cache_key()
+        results = cache.get(cache_key) if self.USER_SEARCH_CACHE_TIMEOUT else None
+        if results is None:
+            results, complete = self.search_all_sources()
+            # don't cache partial results
+            if complete and self.USER_SEARCH_CACHE_TIMEOUT:
+                cache.set(cache_key, results, self.USER_SEARCH_CACHE_TIMEOUT)
 
+        for users in results:
             for user in users:
                 username = user.get("username")
-                if username not in usernames_found and username not in self.usernames_names_to_exclude:
-                    usernames_found.append(username)
+                if username not in usernames_found and username not in usernames_to_exclude:
+                    usernames_found.add(username)
                     matches.append(user)
 
         if len(self.user_search_string.split()) > 1:
             number_of_usernames_searched = len(self.user_search_string.split())
             number_of_usernames_found = len(usernames_found)
-            usernames_not_found = list(
-                set(self.user_search_string.split()) - set(usernames_found) - set(self.usernames_names_to_exclude)
-            )
+            usernames_not_found = list(set(self.user_search_string.split()) - usernames_found - usernames_to_exclude)
         else:
             number_of_usernames_searched = None
             number_of_usernames_found = None
@@ -0,0 +1,87 @@
+# SPDX-FileCopyrightText: (C) ColdFront Authors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+import logging
+
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils.module_loading import import_string
+from django_q.tasks import async_task
+
+from coldfront.core.utils.common import import_from_settings
+
+logger = logging.getLogger(__name__)
+
+TASK_COALESCE_TIMEOUT = import_from_settings("TASK_COALESCE_TIMEOUT", 600)
+TASK_PRIORITY_CLUSTERS = import_from_settings("TASK_PRIORITY_CLUSTERS", {})
+
+
+def _pending_key(func, pk):
+    return "task_pending:{}:{}".format(func, pk)
+
+
+def coalescing_enabled():
+    """Returns whether the default cache is shared by ColdFront processes.
+    LocMemCache is local to each process, so the web process would never see
+    the worker clear its pending keys, and DummyCache stores nothing."""
+    return not isinstance(caches["default"], (LocMemCache, DummyCache))
+
+
+def dispatch_task(func, pks, priority="normal"):
+    """Enqueue django-q task func for the object with primary key pks, or for
+    a batch of objects if pks is a list. The task is called with the pk, or
+    list of pks, and loads the objects itself so it acts on their state when
+    it runs rather than a pickled copy.
+
+    Objects that already have func pending are left out: the pending task has
+    not loaded them yet, so it will see the change that triggered this call.
+    If every object is pending nothing is enqueued and None is returned.
+    Pending tasks are tracked in the cache for up to TASK_COALESCE_TIMEOUT
+    seconds. Tasks are only coalesced when the cache is shared by all
+    ColdFront processes, with a per-process cache every call is enqueued.
+
+    priority selects the django-q cluster the task is sent to from
+    TASK_PRIORITY_CLUSTERS, e.g. {"high": "coldfront-high"}, so urgent tasks
+    are not stuck behind a backlog. Priorities that are not listed use the
+    default cluster.
+    """
+    batch = isinstance(pks, (list, tuple, set))
+    pending = list(pks) if batch else [pks]
+    coalesce = coalescing_enabled()
+    if coalesce:
+        pending = [pk for pk in pending if cache.add(_pending_key(func, pk), True, TASK_COALESCE_TIMEOUT)]
+    if not pending:
+        logger.debug("Task %s already pending for %s", func, pks)
+        return None
+
+    q_options = {}
+    if priority in TASK_PRIORITY_CLUSTERS:
+        q_options["cluster"] = TASK_PRIORITY_CLUSTERS[priority]
+
+    try:
+        return async_task(
+            "coldfront.core.utils.tasks.run_task", func, pending if batch else pending[0], q_options=q_options
+        )
+    except Exception:
+        if coalesce:
+            cache.delete_many([_pending_key(func, pk) for pk in pending])
+        raise
+
+
+def load_task_object(model, pk):
+    """Returns the instance of model with primary key pk. Tasks enqueued before
+    they were dispatched with primary keys were passed the instance itself."""
+    if isinstance(pk, model):
+        return pk
+    return model.objects.get(pk=pk)
+
+
+def run_task(func, pks):
+    """Runs a task enqueued by dispatch_task. The objects are marked as no
+    longer pending first, so changes made while the task runs enqueue it
+    again."""
+    if coalescing_enabled():
+        cache.delete_many([_pending_key(func, pk) for pk in (pks if isinstance(pks, list) else [pks])])
+    return import_string(func)(pks)
@@ -2,4 +2,81 @@
 #
 # SPDX-License-Identifier: AGPL-3.0-or-later
 
-# Create your tests here.
+import os
+import tempfile
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.test import TestCase, override_settings
+
+from coldfront.core.utils.tasks import dispatch_task, run_task
+
+TASK = "coldfront.core.utils.tests.tests.record_task"
+calls = []
+
+
+def record_task(pks):
+    calls.append(pks)
+
+
+# a cache backend shared by processes, unlike the default LocMemCache
+SHARED_CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.path.join(tempfile.gettempdir(), "coldfront-test-task-cache"),
+    }
+}
+
+
+@override_settings(CACHES=SHARED_CACHES)
+class DispatchTaskTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        calls.clear()
+
+    @patch("coldfront.core.utils.tasks.async_task")
+    def test_pending_objects_are_coalesced(self, async_task):
+        dispatch_task(TASK, [1, 2])
+        self.assertIsNone(dispatch_task(TASK, 2))
+        dispatch_task(TASK, [2, 3], priority="high")
+
+        self.assertEqual(
+            [call.args[1:] for call in async_task.call_args_list],
+            [(TASK, [1, 2]), (TASK, [3])],
+        )
+
+    @patch("coldfront.core.utils.tasks.async_task")
+    def test_run_task_clears_pending(self, async_task):
+        dispatch_task(TASK, 1)
+        run_task(TASK, 1)
+        self.assertEqual(calls, [1])
+
+        dispatch_task(TASK, 1)
+        self.assertEqual(async_task.call_count, 2)
+
+
+class DispatchTaskLocalCacheTests(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    @patch("coldfront.core.utils.tasks.async_task")
+    def test_separate_caches_do_not_coalesce(self, async_task):
+        """Test that with a per-process cache the web process does not drop
+        tasks pending in its own cache that the worker has already run"""
+        web_cache = LocMemCache("web", {})
+        worker_cache = LocMemCache("worker", {})
+
+        with patch("coldfront.core.utils.tasks.cache", web_cache):
+            dispatch_task(TASK, 1)
+        with patch("coldfront.core.utils.tasks.cache", worker_cache):
+            run_task(TASK, 1)
+        with patch("coldfront.core.utils.tasks.cache", web_cache):
+            dispatch_task(TASK, 1)
+            dispatch_task(TASK, [1, 2])
+
+        self.assertEqual(calls, [1])
+        self.assertEqual(
+            [call.args[1:] for call in async_task.call_args_list],
+            [(TASK, 1), (TASK, 1), (TASK, [1, 2])],
+        )
@@ -0,0 +1,95 @@
+# SPDX-FileCopyrightText: (C) ColdFront Authors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+import hashlib
+
+from django.core.cache import cache
+from django.db.models import Count, Max
+from django.utils.cache import quote_etag
+from django.utils.http import http_date, parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+from coldfront.core.utils.common import import_from_settings
+
+API_RESPONSE_CACHE_TIMEOUT = import_from_settings("API_RESPONSE_CACHE_TIMEOUT", 0)
+
+
+class ConditionalGetMixin:
+    """Adds an ETag to list and retrieve responses of a read-only viewset and
+    answers a matching If-None-Match with 304 Not Modified before anything is
+    serialized.
+
+    The ETag is a hash of the request path, the response format and the
+    latest modified timestamp and row count of every queryset returned by
+    get_etag_querysets. Any save, create or delete in those querysets changes
+    it. get_etag_querysets is passed a values("pk") subquery of the response's
+    queryset, viewsets whose responses include related data override it to
+    add the related rows. Rows of models without a modified timestamp, e.g.
+    users, are added as values_list querysets of the columns the response
+    shows and the values themselves are hashed.
+
+    When API_RESPONSE_CACHE_TIMEOUT is set, serialized responses are also
+    cached per user, keyed by ETag, so they expire as soon as the underlying
+    data changes.
+    """
+
+    etag_modified_field = "modified"
+
+    def get_etag_querysets(self, pks):
+        return [self.get_queryset().model.objects.filter(pk__in=pks)]
+
+    def get_etag(self, queryset):
+        parts = [self.request.get_full_path(), self.request.accepted_renderer.format]
+        last_modified = None
+        # aggregate over the primary keys only so annotations, prefetches and
+        # ordering on the response queryset are not evaluated
+        for etag_queryset in self.get_etag_querysets(queryset.order_by().values("pk")):
+            if etag_queryset.query.values_select:
+                parts.append(list(etag_queryset.order_by("pk")))
+                continue
+
+            aggregate = etag_queryset.aggregate(last_modified=Max(self.etag_modified_field), count=Count("pk"))
+            parts += [aggregate["last_modified"], aggregate["count"]]
+            if aggregate["last_modified"] and (last_modified is None or aggregate["last_modified"] > last_modified):
+                last_modified = aggregate["last_modified"]
+
+        etag = quote_etag(hashlib.sha256(repr(parts).encode("utf-8")).hexdigest())
+        return etag, last_modified
+
+    def conditional_response(self, queryset, get_response):
+        etag, last_modified = self.get_etag(queryset)
+        headers = {"ETag": etag}
+        if last_modified:
+            headers["Last-Modified"] = http_date(last_modified.timestamp())
+
+        if etag in parse_etags(self.request.headers.get("If-None-Match", "")):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        cache_key = None
+        if API_RESPONSE_CACHE_TIMEOUT:
+            cache_key = "api_response:{}:{}".format(self.request.user.pk, etag)
+            data = cache.get(cache_key)
+            if data is not None:
+                return Response(data, headers=headers)
+
+        response = get_response()
+        if cache_key and response.status_code == status.HTTP_200_OK:
+            cache.set(cache_key, response.data, API_RESPONSE_CACHE_TIMEOUT)
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        return self.conditional_response(
+            queryset, lambda: super(ConditionalGetMixin, self).list(request, *args, **kwargs)
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        queryset = self.filter_queryset(self.get_queryset()).filter(**{self.lookup_field: kwargs[lookup_url_kwarg]})
+        return self.conditional_response(
+            queryset, lambda: super(ConditionalGetMixin, self).retrieve(request, *args, **kwargs)
+        )
@@ -0,0 +1,125 @@
+# SPDX-FileCopyrightText: (C) ColdFront Authors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+import base64
+import heapq
+import json
+from datetime import timedelta
+
+from django.db.models import Min
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from coldfront.core.allocation.models import Allocation, AllocationAttribute, AllocationUser
+from coldfront.core.project.models import Project
+from coldfront.core.utils.common import import_from_settings
+
+API_CHANGES_FEED_LAG = import_from_settings("API_CHANGES_FEED_LAG", 300)
+
+# Models whose history is published in the changes feed, by the name used
+# for them in events and cursors.
+CHANGE_FEED_MODELS = {
+    "allocation": Allocation,
+    "allocationattribute": AllocationAttribute,
+    "allocationuser": AllocationUser,
+    "project": Project,
+}
+
+CHANGE_ACTIONS = {"+": "create", "~": "update", "-": "delete"}
+
+
+def encode_cursor(position):
+    """Encode a position, the last history_id returned by model name, as an
+    opaque cursor string"""
+    data = json.dumps(position, sort_keys=True)
+    return base64.urlsafe_b64encode(data.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        position = {model_name: int(history_id) for model_name, history_id in position.items()}
+    except (AttributeError, TypeError, ValueError, UnicodeError):
+        raise ValidationError({"since": "Invalid cursor."})
+
+    if not set(position) <= set(CHANGE_FEED_MODELS):
+        raise ValidationError({"since": "Invalid cursor."})
+
+    return position
+
+
+def history_after(model_name, history_id, settled):
+    """Returns the historical records of model_name with a history_id greater
+    than history_id (all of them if it is None), in history_id order, up to
+    the first one recorded after settled"""
+    history_model = CHANGE_FEED_MODELS[model_name].history.model
+    data_fields = [f.attname for f in history_model._meta.fields if not f.name.startswith("history_")]
+    queryset = history_model.objects.all()
+
+    if history_id is not None:
+        queryset = queryset.filter(history_id__gt=history_id)
+
+    # history_date is set before the id is assigned, so stop at the first
+    # unsettled record rather than skipping it and moving the cursor past it
+    unsettled = queryset.filter(history_date__gt=settled).aggregate(history_id=Min("history_id"))["history_id"]
+    if unsettled is not None:
+        queryset = queryset.filter(history_id__lt=unsettled)
+
+    return queryset.order_by("history_id").values(
+        "history_id", "history_date", "history_type", "history_user__username", *data_fields
+    )
+
+
+def history_event(model_name, row):
+    history_id = row.pop("history_id")
+    history_date = row.pop("history_date")
+    return {
+        "model": model_name,
+        "id": row["id"],
+        "action": CHANGE_ACTIONS[row.pop("history_type")],
+        "date": history_date,
+        "user": row.pop("history_user__username"),
+        "history_id": history_id,
+        "data": row,
+    }
+
+
+def get_changes(cursor, limit):
+    """Returns up to limit change events after cursor (from the beginning if
+    cursor is None) and the cursor of the last event returned, or the given
+    cursor if there are none, and whether more events are available.
+
+    The cursor holds the last history_id returned from each history table.
+    Ids are assigned when a record is inserted, not when its transaction
+    commits, so a long transaction can commit an id lower than ones already
+    returned. Only records older than API_CHANGES_FEED_LAG seconds are
+    returned, by which time any transaction that commits within the lag has
+    committed, and a table is read no further than its first newer record.
+    Each history table is read with one indexed range query of at most
+    limit + 1 rows in history_id order and the results are merged by
+    history_date, so events are returned oldest first except for records
+    committed late.
+    """
+    position = decode_cursor(cursor) if cursor else {}
+    settled = timezone.now() - timedelta(seconds=API_CHANGES_FEED_LAG)
+
+    def keyed(model_name):
+        for row in history_after(model_name, position.get(model_name), settled)[: limit + 1]:
+            yield (row["history_date"], model_name, row["history_id"]), row
+
+    merged = heapq.merge(*(keyed(model_name) for model_name in CHANGE_FEED_MODELS), key=lambda item: item[0])
+
+    events = []
+    has_more = False
+    for (_, model_name, history_id), row in merged:
+        if len(events) == limit:
+            has_more = True
+            break
+        events.append(history_event(model_name, row))
+        position[model_name] = history_id
+
+    if events:
+        cursor = encode_cursor(position)
+
+    return events, cursor, has_more
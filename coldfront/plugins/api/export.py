@@ -0,0 +1,87 @@
+# SPDX-FileCopyrightText: (C) ColdFront Authors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from rest_framework.decorators import action
+from rest_framework.renderers import BaseRenderer
+
+from coldfront.core.utils.common import Echo, import_from_settings
+
+API_EXPORT_CHUNK_SIZE = import_from_settings("API_EXPORT_CHUNK_SIZE", 2000)
+
+
+class NDJSONRenderer(BaseRenderer):
+    """Selects ?format=ndjson for export actions. Exports stream their own
+    response so this only renders error responses, as a single JSON line."""
+
+    media_type = "application/x-ndjson"
+    format = "ndjson"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return (json.dumps(data, cls=DjangoJSONEncoder) + "\n").encode(self.charset)
+
+
+class CSVRenderer(NDJSONRenderer):
+    """Selects ?format=csv for export actions. Error responses are rendered
+    as JSON."""
+
+    media_type = "text/csv"
+    format = "csv"
+
+
+def csv_value(value):
+    """Flatten a serialized value into a CSV cell. Nested lists of objects,
+    e.g. allocation users, become "a:b;c:d"."""
+    if value is None:
+        return ""
+    if isinstance(value, list):
+        return ";".join(
+            ":".join(str(v) for v in item.values()) if isinstance(item, dict) else str(item) for item in value
+        )
+    return value
+
+
+class ExportMixin:
+    """Adds an export action to a viewset that streams every object in the
+    filtered queryset as NDJSON (the default) or CSV. Objects are fetched with
+    iterator() in chunks of API_EXPORT_CHUNK_SIZE, prefetches included, and
+    serialized one at a time so memory use does not grow with the number of
+    objects. Pagination is not applied."""
+
+    @action(detail=False, methods=["get"], renderer_classes=[NDJSONRenderer, CSVRenderer])
+    def export(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        rows = queryset.iterator(chunk_size=API_EXPORT_CHUNK_SIZE)
+        context = self.get_serializer_context()
+        serializer_class = self.get_serializer_class()
+
+        if request.accepted_renderer.format == "csv":
+            writer = csv.writer(Echo())
+            fields = list(serializer_class(context=context).fields)
+
+            def stream():
+                yield writer.writerow(fields)
+                for obj in rows:
+                    data = serializer_class(obj, context=context).data
+                    yield writer.writerow([csv_value(data[field]) for field in fields])
+
+            content_type = "text/csv"
+            extension = "csv"
+        else:
+
+            def stream():
+                for obj in rows:
+                    yield json.dumps(serializer_class(obj, context=context).data, cls=DjangoJSONEncoder) + "\n"
+
+            content_type = "application/x-ndjson"
+            extension = "ndjson"
+
+        response = StreamingHttpResponse(stream(), content_type=content_type)
+        response["Content-Disposition"] = 'attachment; filename="{}.{}"'.format(self.basename, extension)
+        return response
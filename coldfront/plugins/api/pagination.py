@@ -0,0 +1,36 @@
+# SPDX-FileCopyrightText: (C) ColdFront Authors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+from rest_framework.pagination import CursorPagination
+
+from coldfront.core.utils.common import import_from_settings
+
+API_PAGE_SIZE = import_from_settings("API_PAGE_SIZE", 100)
+API_MAX_PAGE_SIZE = import_from_settings("API_MAX_PAGE_SIZE", 1000)
+API_PAGINATE_BY_DEFAULT = import_from_settings("API_PAGINATE_BY_DEFAULT", False)
+
+
+class KeysetPagination(CursorPagination):
+    """Cursor pagination on the primary key. Each page is fetched with an
+    indexed pk > last seen pk query so memory use is bounded by the page size
+    and an export can be resumed from the last next link it received.
+
+    Pagination is opt-in: unless API_PAGINATE_BY_DEFAULT is set, requests
+    without a page_size or cursor query parameter return every result in a
+    single unpaginated list as before.
+    """
+
+    ordering = "pk"
+    page_size = API_PAGE_SIZE
+    page_size_query_param = "page_size"
+    max_page_size = API_MAX_PAGE_SIZE
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not (
+            API_PAGINATE_BY_DEFAULT
+            or self.cursor_query_param in request.query_params
+            or self.page_size_query_param in request.query_params
+        ):
+            return None
+        return super().paginate_queryset(queryset, request, view)
@@ -10,7 +10,54 @@ from coldfront.core.project.models import Project, ProjectAttribute, ProjectUser
 from coldfront.core.resource.models import Resource
 
 
-class UserSerializer(serializers.ModelSerializer):
+def query_param_list(request, name):
+    """Returns the values of comma separated query parameter name"""
+    return [value.strip() for value in request.query_params.get(name, "").split(",") if value.strip()]
+
+
+def query_param_enabled(request, name):
+    """Whether related data name was requested with ?name=true or
+    ?expand=name"""
+    return request.query_params.get(name) in ["True", "true"] or name in query_param_list(request, "expand")
+
+
+def field_requested(request, name):
+    """Whether field name of the top level objects is in the response, i.e.
+    there is no ?fields= or it lists name"""
+    fields = query_param_list(request, "fields")
+    return not fields or name in fields
+
+
+def get_resources_as_string(allocation):
+    """Allocation.get_resources_as_string, using the allocation's resources if
+    they were prefetched (in ALLOCATION_RESOURCE_ORDERING order) rather than
+    querying them again"""
+    if "resources" in getattr(allocation, "_prefetched_objects_cache", {}):
+        return ", ".join([resource.name for resource in allocation.resources.all()])
+    return allocation.get_resources_as_string
+
+
+class SparseFieldsMixin:
+    """Serializes only the fields listed in the request's ?fields= query
+    parameter, when serializing the response's top level objects. Nested
+    serializers always serialize every field."""
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get("request", None)
+        top_level = self.root is self or (
+            isinstance(self.root, serializers.ListSerializer) and self.parent is self.root
+        )
+        if request is None or not top_level:
+            return fields
+
+        requested = query_param_list(request, "fields")
+        if requested:
+            fields = {name: field for name, field in fields.items() if name in requested}
+        return fields
+
+
+class UserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = get_user_model()
         fields = (
@@ -25,7 +72,7 @@ class UserSerializer(serializers.ModelSerializer):
         )
 
 
-class ResourceSerializer(serializers.ModelSerializer):
+class ResourceSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     resource_type = serializers.SlugRelatedField(slug_field="name", read_only=True)
 
     class Meta:
@@ -33,8 +80,8 @@ class ResourceSerializer(serializers.ModelSerializer):
         fields = ("id", "resource_type", "name", "description", "is_allocatable")
 
 
-class AllocationSerializer(serializers.ModelSerializer):
-    resource = serializers.ReadOnlyField(source="get_resources_as_string")
+class AllocationSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    resource = serializers.SerializerMethodField()
     project = serializers.SlugRelatedField(slug_field="title", read_only=True)
     status = serializers.SlugRelatedField(slug_field="name", read_only=True)
     allocation_users = serializers.SerializerMethodField()
@@ -51,15 +98,18 @@ class AllocationSerializer(serializers.ModelSerializer):
             "allocation_attributes",
         )
 
+    def get_resource(self, obj):
+        return get_resources_as_string(obj)
+
     def get_allocation_users(self, obj):
         request = self.context.get("request", None)
-        if request and request.query_params.get("allocation_users") in ["true", "True"]:
+        if request and query_param_enabled(request, "allocation_users"):
             return AllocationUserSerializer(obj.allocationuser_set, many=True, read_only=True).data
         return None
 
     def get_allocation_attributes(self, obj):
         request = self.context.get("request", None)
-        if request and request.query_params.get("allocation_attributes") in ["true", "True"]:
+        if request and query_param_enabled(request, "allocation_attributes"):
             return AllocationAttributeSerializer(obj.allocationattribute_set, many=True, read_only=True).data
         return None
 
@@ -81,9 +131,9 @@ class AllocationAttributeSerializer(serializers.ModelSerializer):
         fields = ("allocation_attribute_type", "value")
 
 
-class AllocationRequestSerializer(serializers.ModelSerializer):
+class AllocationRequestSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     project = serializers.SlugRelatedField(slug_field="title", read_only=True)
-    resource = serializers.ReadOnlyField(source="get_resources_as_string", read_only=True)
+    resource = serializers.SerializerMethodField(read_only=True)
     status = serializers.SlugRelatedField(slug_field="name", read_only=True)
     fulfilled_date = serializers.DateTimeField(read_only=True)
     created_by = serializers.SerializerMethodField(read_only=True)
@@ -104,7 +154,12 @@ class AllocationRequestSerializer(serializers.ModelSerializer):
             "time_to_fulfillment",
         )
 
+    def get_resource(self, obj):
+        return get_resources_as_string(obj)
+
     def get_created_by(self, obj):
+        if hasattr(obj, "created_by_username"):
+            return obj.created_by_username
         historical_record = obj.history.earliest()
         creator = historical_record.history_user if historical_record else None
         if not creator:
@@ -112,6 +167,8 @@ class AllocationRequestSerializer(serializers.ModelSerializer):
         return historical_record.history_user.username
 
     def get_fulfilled_by(self, obj):
+        if hasattr(obj, "fulfilled_by_username"):
+            return obj.fulfilled_by_username
         historical_records = obj.history.filter(status__name="Active")
         if historical_records:
             user = historical_records.earliest().history_user
@@ -120,7 +177,7 @@ class AllocationRequestSerializer(serializers.ModelSerializer):
         return None
 
 
-class AllocationChangeRequestSerializer(serializers.ModelSerializer):
+class AllocationChangeRequestSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     allocation = AllocationSerializer(read_only=True)
     status = serializers.SlugRelatedField(slug_field="name", read_only=True)
     created_by = serializers.SerializerMethodField(read_only=True)
@@ -143,6 +200,8 @@ class AllocationChangeRequestSerializer(serializers.ModelSerializer):
         )
 
     def get_created_by(self, obj):
+        if hasattr(obj, "created_by_username"):
+            return obj.created_by_username
         historical_record = obj.history.earliest()
         creator = historical_record.history_user if historical_record else None
         if not creator:
@@ -150,6 +209,8 @@ class AllocationChangeRequestSerializer(serializers.ModelSerializer):
         return historical_record.history_user.username
 
     def get_fulfilled_by(self, obj):
+        if hasattr(obj, "fulfilled_by_username"):
+            return obj.fulfilled_by_username
         if not obj.status.name == "Approved":
             return None
         historical_record = obj.history.latest()
@@ -160,13 +221,16 @@ class AllocationChangeRequestSerializer(serializers.ModelSerializer):
 
 
 class ProjAllocationSerializer(serializers.ModelSerializer):
-    resource = serializers.ReadOnlyField(source="get_resources_as_string")
+    resource = serializers.SerializerMethodField()
     status = serializers.SlugRelatedField(slug_field="name", read_only=True)
 
     class Meta:
         model = Allocation
         fields = ("id", "resource", "status")
 
+    def get_resource(self, obj):
+        return get_resources_as_string(obj)
+
 
 class ProjectUserSerializer(serializers.ModelSerializer):
     user = serializers.SlugRelatedField(slug_field="username", read_only=True)
@@ -186,7 +250,7 @@ class ProjectAttributeSerializer(serializers.ModelSerializer):
         fields = ("proj_attr_type", "value")
 
 
-class ProjectSerializer(serializers.ModelSerializer):
+class ProjectSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     pi = serializers.SlugRelatedField(slug_field="username", read_only=True)
     status = serializers.SlugRelatedField(slug_field="name", read_only=True)
     project_users = serializers.SerializerMethodField()
@@ -199,18 +263,18 @@ class ProjectSerializer(serializers.ModelSerializer):
 
     def get_project_users(self, obj):
         request = self.context.get("request", None)
-        if request and request.query_params.get("project_users") in ["true", "True"]:
+        if request and query_param_enabled(request, "project_users"):
             return ProjectUserSerializer(obj.projectuser_set, many=True, read_only=True).data
         return None
 
     def get_allocations(self, obj):
         request = self.context.get("request", None)
-        if request and request.query_params.get("allocations") in ["true", "True"]:
+        if request and query_param_enabled(request, "allocations"):
             return ProjAllocationSerializer(obj.allocation_set, many=True, read_only=True).data
         return None
 
     def get_project_attributes(self, obj):
         request = self.context.get("request", None)
-        if request and request.query_params.get("project_attributes") in ["true", "True"]:
+        if request and query_param_enabled(request, "project_attributes"):
             return ProjectAttributeSerializer(obj.projectattribute_set, many=True, read_only=True).data
         return None
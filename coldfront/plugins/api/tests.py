@@ -2,17 +2,28 @@
 #
 # SPDX-License-Identifier: AGPL-3.0-or-later
 
+import csv
+import json
 import unittest
+from datetime import timedelta
+from unittest import mock
 
+from django.db import connection
+from django.db.models import F
+from django.test.utils import CaptureQueriesContext
 from rest_framework import status
 from rest_framework.test import APITestCase
 
 from coldfront.config.env import ENV
-from coldfront.core.allocation.models import Allocation
+from coldfront.core.allocation.models import Allocation, AllocationAttribute, AllocationAttributeUsage, AllocationUser
 from coldfront.core.project.models import Project
 from coldfront.core.test_helpers.factories import (
     AllocationAttributeFactory,
+    AllocationAttributeTypeFactory,
+    AllocationChangeRequestFactory,
+    AllocationChangeStatusChoiceFactory,
     AllocationFactory,
+    AllocationStatusChoiceFactory,
     AllocationUserFactory,
     PAttributeTypeFactory,
     ProjectAttributeFactory,
@@ -23,6 +34,7 @@ from coldfront.core.test_helpers.factories import (
     ResourceFactory,
     UserFactory,
 )
+from coldfront.plugins.api.pagination import KeysetPagination
 
 
 @unittest.skipUnless(ENV.bool("PLUGIN_API", default=False), "Only run API tests if enabled")
@@ -33,19 +45,30 @@ class ColdfrontAPI(APITestCase):
     def setUpTestData(self):
         """Test Data setup for ColdFront REST API tests."""
         self.admin_user = UserFactory(is_staff=True, is_superuser=True)
-        pat = ProjectAttributeTypeFactory(attribute_type=PAttributeTypeFactory(name="Text"))
+        self.pat = ProjectAttributeTypeFactory(attribute_type=PAttributeTypeFactory(name="Text"))
 
         for i in range(10):
-            project = ProjectFactory(status=ProjectStatusChoiceFactory(name="Active"))
-            ProjectUserFactory(project=project, user=self.admin_user)
-            ProjectAttributeFactory(project=project, proj_attr_type=pat)
-
-            allocation = AllocationFactory(project=project)
-            allocation.resources.add(ResourceFactory(name="test"))
-            AllocationUserFactory(allocation=allocation, user=self.admin_user)
-            AllocationAttributeFactory(allocation=allocation)
+            project = self.create_project(self.pat)
             self.pi_user = project.pi
 
+    @classmethod
+    def create_project(cls, pat):
+        """Create a project with a user, attribute and allocation"""
+        # ProjectFactory gets or creates by title, use unique titles so each
+        # call creates a new project
+        project = ProjectFactory(
+            title=f"API project {Project.objects.count()}", status=ProjectStatusChoiceFactory(name="Active")
+        )
+        ProjectUserFactory(project=project, user=cls.admin_user)
+        ProjectAttributeFactory(project=project, proj_attr_type=pat)
+
+        allocation = AllocationFactory(project=project)
+        allocation.resources.add(ResourceFactory(name="test"))
+        AllocationUserFactory(allocation=allocation, user=cls.admin_user)
+        AllocationAttributeFactory(allocation=allocation)
+        AllocationChangeRequestFactory(allocation=allocation)
+        return project
+
     def test_requires_login(self):
         """Test that the API requires authentication"""
         response = self.client.get("/api/")
@@ -98,6 +121,315 @@ class ColdfrontAPI(APITestCase):
             self.assertEqual(len(alloc["allocation_users"]), 1)
             self.assertEqual(len(alloc["allocation_attributes"]), 1)
 
+    def test_allocation_api_pagination(self):
+        """Test that passing page_size returns pages that can be followed with
+        the next link to return every allocation exactly once"""
+        self.client.force_login(self.admin_user)
+        url = "/api/allocations/?page_size=3"
+        allocation_ids = []
+        while url:
+            response = self.client.get(url, format="json")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            data = response.json()
+            self.assertLessEqual(len(data["results"]), 3)
+            allocation_ids.extend(alloc["id"] for alloc in data["results"])
+            url = data["next"]
+
+        self.assertEqual(allocation_ids, list(Allocation.objects.order_by("pk").values_list("pk", flat=True)))
+
+    def test_allocation_api_max_page_size(self):
+        """Test that page_size is capped at API_MAX_PAGE_SIZE"""
+        self.client.force_login(self.admin_user)
+        with mock.patch.object(KeysetPagination, "max_page_size", 4):
+            response = self.client.get("/api/allocations/?page_size=100", format="json")
+        self.assertEqual(len(response.json()["results"]), 4)
+
+    def test_api_query_count_constant(self):
+        """Test that the number of queries for each endpoint, with every
+        related data query parameter enabled, does not grow with the number of
+        results"""
+        urls = [
+            "/api/allocations/?allocation_users=true&allocation_attributes=true",
+            "/api/allocations/?allocation_users=true&allocation_attributes=true&page_size=100",
+            "/api/allocation-requests/",
+            "/api/allocation-change-requests/?allocation_users=true&allocation_attributes=true",
+            "/api/projects/?project_users=true&allocations=true&project_attributes=true",
+            "/api/resources/",
+            "/api/users/",
+        ]
+        self.client.force_login(self.admin_user)
+        query_counts = [self.count_queries(url) for url in urls]
+
+        for i in range(5):
+            self.create_project(self.pat)
+
+        self.assertEqual([self.count_queries(url) for url in urls], query_counts)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(context)
+
+    def test_allocation_export(self):
+        """Test that the export endpoint streams every allocation as NDJSON or
+        CSV with the requested related data"""
+        self.client.force_login(self.admin_user)
+        response = self.client.get("/api/allocations/export/?allocation_users=true")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(len(rows), Allocation.objects.count())
+        for row in rows:
+            self.assertEqual(len(row["allocation_users"]), 1)
+            self.assertIsNone(row["allocation_attributes"])
+
+        response = self.client.get("/api/allocations/export/?format=csv&allocation_attributes=true")
+        self.assertEqual(response["Content-Type"], "text/csv")
+        rows = list(csv.DictReader(b"".join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(len(rows), Allocation.objects.count())
+        self.assertEqual(rows[0]["allocation_users"], "")
+        self.assertTrue(rows[0]["allocation_attributes"].endswith(":2048"))
+
+        self.client.force_login(self.pi_user)
+        response = self.client.get("/api/allocations/export/")
+        self.assertEqual(len(b"".join(response.streaming_content).decode().splitlines()), 1)
+
+    def test_allocation_conditional_get(self):
+        """Test that a request with the current ETag returns 304 Not Modified
+        and that saving related data included in the response changes it"""
+        url = "/api/allocations/?allocation_users=true"
+        self.client.force_login(self.admin_user)
+        response = self.client.get(url, format="json")
+        etag = response["ETag"]
+        self.assertIn("Last-Modified", response)
+
+        response = self.client.get(url, format="json", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertFalse(response.content)
+
+        AllocationUser.objects.first().save()
+        response = self.client.get(url, format="json", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+
+        allocation = Allocation.objects.first()
+        response = self.client.get(f"/api/allocations/{allocation.pk}/", format="json")
+        etag = response["ETag"]
+        self.assertEqual(response.data["id"], allocation.pk)
+        allocation.save()
+        response = self.client.get(f"/api/allocations/{allocation.pk}/", format="json", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_conditional_get_related_rows(self):
+        """Test that renaming a project or its PI changes the ETag of the
+        responses that include them"""
+        self.client.force_login(self.admin_user)
+        allocation = Allocation.objects.first()
+        response = self.client.get("/api/allocations/", format="json")
+        etag = response["ETag"]
+
+        project = allocation.project
+        project.title = "Renamed project"
+        project.save()
+        response = self.client.get("/api/allocations/", format="json", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertIn("Renamed project", [a["project"] for a in response.data])
+
+        response = self.client.get("/api/projects/", format="json")
+        etag = response["ETag"]
+        pi = project.pi
+        pi.username = "renamedpi"
+        pi.save()
+        response = self.client.get("/api/projects/", format="json", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+
+    @mock.patch("coldfront.plugins.api.caching.API_RESPONSE_CACHE_TIMEOUT", 60)
+    def test_project_response_cache(self):
+        """Test that cached responses are reused until the data changes"""
+        url = "/api/projects/?project_users=true"
+        self.client.force_login(self.admin_user)
+        uncached_count = self.count_queries(url)
+        self.assertLess(self.count_queries(url), uncached_count)
+
+        project = Project.objects.first()
+        project.title = "Changed title"
+        project.save()
+        self.assertEqual(self.count_queries(url), uncached_count)
+        response = self.client.get(url, format="json")
+        self.assertIn("Changed title", [p["title"] for p in response.data])
+
+    @mock.patch("coldfront.plugins.api.changes.API_CHANGES_FEED_LAG", 0)
+    def test_changes_feed(self):
+        """Test that the changes feed returns every history event in pages
+        and resumes from a cursor"""
+        self.client.force_login(self.pi_user)
+        response = self.client.get("/api/changes/", format="json")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.force_login(self.admin_user)
+        total = sum(model.history.count() for model in [Allocation, AllocationAttribute, AllocationUser, Project])
+        events = []
+        url = "/api/changes/?page_size=7"
+        while url:
+            response = self.client.get(url, format="json")
+            events += response.data["results"]
+            url = response.data["next"]
+        self.assertEqual(len(events), total)
+        self.assertEqual(len({(e["model"], e["history_id"]) for e in events}), total)
+        self.assertEqual([e["date"] for e in events], sorted(e["date"] for e in events))
+
+        cursor = response.data["cursor"]
+        response = self.client.get("/api/changes/", {"since": cursor}, format="json")
+        self.assertEqual(response.data["results"], [])
+        self.assertEqual(response.data["cursor"], cursor)
+
+        allocation_user = AllocationUser.objects.first()
+        allocation_user_pk = allocation_user.pk
+        allocation_user.delete()
+        response = self.client.get("/api/changes/", {"since": cursor}, format="json")
+        self.assertEqual(len(response.data["results"]), 1)
+        event = response.data["results"][0]
+        self.assertEqual(
+            [event["model"], event["id"], event["action"]], ["allocationuser", allocation_user_pk, "delete"]
+        )
+        self.assertEqual(event["data"]["allocation_id"], allocation_user.allocation_id)
+
+        response = self.client.get("/api/changes/", {"since": "invalid"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @mock.patch("coldfront.plugins.api.changes.API_CHANGES_FEED_LAG", 60)
+    def test_changes_feed_late_commit(self):
+        """Test that a history record with a lower id that commits after a
+        record with a higher id was recorded is not skipped"""
+        self.client.force_login(self.admin_user)
+        history_models = [model.history.model for model in [Allocation, AllocationAttribute, AllocationUser, Project]]
+
+        def settle():
+            for history_model in history_models:
+                history_model.objects.update(history_date=F("history_date") - timedelta(hours=1))
+
+        settle()
+        url = "/api/changes/"
+        while url:
+            response = self.client.get(url, format="json")
+            url = response.data["next"]
+        cursor = response.data["cursor"]
+
+        # the first record's transaction has not committed when the second
+        # is recorded and returned
+        first, second = Allocation.objects.order_by("pk")[:2]
+        first.save()
+        uncommitted = first.history.order_by("-history_id").values()[0]
+        first.history.filter(history_id=uncommitted["history_id"]).delete()
+        second.save()
+        second_id = second.history.latest("history_id").history_id
+        self.assertGreater(second_id, uncommitted["history_id"])
+
+        response = self.client.get("/api/changes/", {"since": cursor}, format="json")
+        self.assertEqual(response.data["results"], [])
+        self.assertEqual(response.data["cursor"], cursor)
+
+        first.history.model.objects.create(**uncommitted)
+        settle()
+        response = self.client.get("/api/changes/", {"since": cursor}, format="json")
+        self.assertEqual([e["history_id"] for e in response.data["results"]], [uncommitted["history_id"], second_id])
+
+    def test_allocation_usage(self):
+        """Test that staff can set allocation usage in bulk as JSON or CSV"""
+        usage_type = AllocationAttributeTypeFactory(name="Core Usage (Hours)", has_usage=True)
+        allocations = list(Allocation.objects.order_by("pk")[:2])
+        for allocation in allocations:
+            AllocationAttributeFactory(allocation=allocation, allocation_attribute_type=usage_type)
+        records = [
+            {"allocation": allocation.pk, "attribute": usage_type.name, "value": 10} for allocation in allocations
+        ]
+
+        self.client.force_login(self.pi_user)
+        response = self.client.post("/api/allocation-usage/", records, format="json")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.force_login(self.admin_user)
+        response = self.client.post("/api/allocation-usage/", records, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([response.data["updated"], response.data["errors"]], [2, []])
+
+        response = self.client.post(
+            "/api/allocation-usage/",
+            f"allocation,attribute,value\n{allocations[1].pk},{usage_type.name},12.5\n",
+            content_type="text/csv",
+        )
+        self.assertEqual(response.data["updated"], 1)
+        self.assertEqual(
+            AllocationAttributeUsage.objects.get(allocation_attribute__allocation=allocations[1]).value, 12.5
+        )
+
+        response = self.client.post("/api/allocation-usage/", {"attribute": "x"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_sparse_fields(self):
+        """Test that ?fields= limits the fields serialized and ?expand= selects
+        related data, for every endpoint"""
+        AllocationFactory(status=AllocationStatusChoiceFactory(name="New"))
+        self.client.force_login(self.admin_user)
+        urls = {
+            "/api/allocations/?fields=id,status,allocation_users&expand=allocation_users": [
+                "id",
+                "status",
+                "allocation_users",
+            ],
+            "/api/allocation-requests/?fields=id,fulfilled_by": ["id", "fulfilled_by"],
+            "/api/allocation-change-requests/?fields=allocation,fulfilled_by&expand=allocation_attributes": [
+                "allocation",
+                "fulfilled_by",
+            ],
+            "/api/projects/?fields=title,pi,allocations&expand=allocations,project_users": [
+                "title",
+                "pi",
+                "allocations",
+            ],
+            "/api/resources/?fields=name": ["name"],
+            "/api/users/?fields=username,unknown": ["username"],
+        }
+        for url, fields in urls.items():
+            response = self.client.get(url, format="json")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(list(response.data[0]), fields, url)
+
+        urls = list(urls)
+        response = self.client.get(urls[0], format="json")
+        self.assertEqual(len(response.data[0]["allocation_users"]), 1)
+        response = self.client.get(urls[2], format="json")
+        allocation = response.data[0]["allocation"]
+        self.assertEqual(len(allocation["allocation_attributes"]), 1)
+        self.assertIsNone(allocation["allocation_users"])
+        self.assertEqual(allocation["resource"], "test")
+
+        full_count = self.count_queries("/api/projects/?allocations=true")
+        self.assertLess(self.count_queries("/api/projects/?allocations=true&fields=id,title"), full_count)
+        url = "/api/allocation-change-requests/?fields=allocation,fulfilled_by"
+        query_count = self.count_queries(url)
+        for i in range(5):
+            self.create_project(self.pat)
+        self.assertEqual(self.count_queries(url), query_count)
+
+    def test_change_request_fulfilled_by(self):
+        """Test that fulfilled_by is the user who approved a change request,
+        also when only some fields are requested"""
+        change_request = AllocationChangeRequestFactory(allocation=Allocation.objects.first())
+        change_request.status = AllocationChangeStatusChoiceFactory(name="Approved")
+        change_request._history_user = self.admin_user
+        change_request.save()
+
+        self.client.force_login(self.admin_user)
+        for url in ["/api/allocation-change-requests/", "/api/allocation-change-requests/?fields=id,fulfilled_by"]:
+            response = self.client.get(url, format="json")
+            fulfilled_by = {row["id"]: row["fulfilled_by"] for row in response.data}
+            self.assertEqual(fulfilled_by.pop(change_request.pk), self.admin_user.username, url)
+            self.assertEqual(set(fulfilled_by.values()), {None}, url)
+
     def test_project_api_permissions(self):
         """Confirm permissions for project API:
         admin user should be able to access everything
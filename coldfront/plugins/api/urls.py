@@ -9,6 +9,7 @@ from coldfront.plugins.api import views
 
 router = routers.DefaultRouter()
 router.register(r"allocations", views.AllocationViewSet, basename="allocations")
+router.register(r"allocation-usage", views.AllocationUsageViewSet, basename="allocation-usage")
 router.register(r"allocation-requests", views.AllocationRequestViewSet, basename="allocation-requests")
 router.register(
     r"allocation-change-requests", views.AllocationChangeRequestViewSet, basename="allocation-change-requests"
@@ -16,6 +17,7 @@ router.register(
 router.register(r"projects", views.ProjectViewSet, basename="projects")
 router.register(r"resources", views.ResourceViewSet, basename="resources")
 router.register(r"users", views.UserViewSet, basename="users")
+router.register(r"changes", views.ChangesViewSet, basename="changes")
 
 urlpatterns = [
     path("", include(router.urls)),
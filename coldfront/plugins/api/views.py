@@ -6,24 +6,141 @@ import logging
 from datetime import timedelta
 
 from django.contrib.auth import get_user_model
-from django.db.models import ExpressionWrapper, F, OuterRef, Q, Subquery, fields
-from django.db.models.functions import Cast
+from django.db.models import Case, OuterRef, Prefetch, Q, Subquery, When
 from django_filters import rest_framework as filters
-from rest_framework import viewsets
+from rest_framework import status, viewsets
 from rest_framework.authtoken.models import Token
 from rest_framework.decorators import api_view, permission_classes
+from rest_framework.parsers import JSONParser
 from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 from simple_history.utils import get_history_model_for_model
 
-from coldfront.core.allocation.models import Allocation, AllocationChangeRequest
-from coldfront.core.project.models import Project
-from coldfront.core.resource.models import Resource
+from coldfront.core.allocation.models import (
+    ALLOCATION_RESOURCE_ORDERING,
+    Allocation,
+    AllocationAttribute,
+    AllocationAttributeType,
+    AllocationChangeRequest,
+    AllocationChangeStatusChoice,
+    AllocationStatusChoice,
+    AllocationUser,
+    AllocationUserStatusChoice,
+)
+from coldfront.core.allocation.utils import set_allocation_usages
+from coldfront.core.project.models import (
+    Project,
+    ProjectAttribute,
+    ProjectAttributeType,
+    ProjectStatusChoice,
+    ProjectUser,
+    ProjectUserRoleChoice,
+    ProjectUserStatusChoice,
+)
+from coldfront.core.resource.models import Resource, ResourceType
 from coldfront.plugins.api import serializers
+from coldfront.plugins.api.caching import ConditionalGetMixin
+from coldfront.plugins.api.changes import get_changes
+from coldfront.plugins.api.export import ExportMixin
+from coldfront.plugins.api.pagination import KeysetPagination
+from coldfront.plugins.api.parsers import CSVParser
+from coldfront.plugins.api.serializers import field_requested, query_param_enabled, query_param_list
 
 logger = logging.getLogger(__name__)
 
 
+def allocation_prefetches(request, prefix=""):
+    """Returns the prefetches AllocationSerializer needs for the query
+    parameters in request. prefix is the lookup path from the queryset's model
+    to Allocation, e.g. "allocation__" for allocation change requests. Fields
+    of top level allocations left out with ?fields= are not prefetched."""
+
+    def requested(name):
+        return bool(prefix) or field_requested(request, name)
+
+    prefetches = []
+
+    if requested("resource"):
+        # ordered as Allocation.get_resources_as_string orders them
+        prefetches.append(
+            Prefetch(prefix + "resources", queryset=Resource.objects.order_by(*ALLOCATION_RESOURCE_ORDERING))
+        )
+
+    if requested("allocation_users") and query_param_enabled(request, "allocation_users"):
+        prefetches.append(
+            Prefetch(prefix + "allocationuser_set", queryset=AllocationUser.objects.select_related("user", "status"))
+        )
+
+    if requested("allocation_attributes") and query_param_enabled(request, "allocation_attributes"):
+        prefetches.append(
+            Prefetch(
+                prefix + "allocationattribute_set",
+                queryset=AllocationAttribute.objects.select_related("allocation_attribute_type"),
+            )
+        )
+
+    return prefetches
+
+
+def allocation_etag_querysets(request, allocation_pks):
+    """Returns querysets of the rows AllocationSerializer reads for the
+    allocations in allocation_pks"""
+    querysets = [
+        Allocation.objects.filter(pk__in=allocation_pks),
+        Project.objects.filter(pk__in=Allocation.objects.filter(pk__in=allocation_pks).values("project")),
+        AllocationStatusChoice.objects.all(),
+        Resource.objects.filter(allocation__in=allocation_pks),
+    ]
+
+    if query_param_enabled(request, "allocation_users"):
+        querysets += [
+            AllocationUser.objects.filter(allocation__in=allocation_pks),
+            AllocationUserStatusChoice.objects.all(),
+            usernames_etag_queryset(AllocationUser.objects.filter(allocation__in=allocation_pks).values("user")),
+        ]
+
+    if query_param_enabled(request, "allocation_attributes"):
+        querysets += [
+            AllocationAttribute.objects.filter(allocation__in=allocation_pks),
+            AllocationAttributeType.objects.all(),
+        ]
+
+    return querysets
+
+
+def usernames_etag_queryset(user_pks):
+    """Returns the usernames of the users in user_pks for an ETag, users have
+    no modified timestamp"""
+    return get_user_model().objects.filter(pk__in=user_pks).values_list("pk", "username")
+
+
+def sparse_queryset(queryset, request, related_fields):
+    """Returns queryset joining and loading only the columns needed for the
+    fields requested with ?fields=. related_fields maps serializer fields of
+    related objects to the lookup they are read from, e.g. {"status":
+    "status__name"}. Other requested fields are read from columns of the same
+    name."""
+    fields = query_param_list(request, "fields")
+    if not fields:
+        return queryset.select_related(*[lookup.split("__")[0] for lookup in related_fields.values()])
+
+    model_fields = {field.name for field in queryset.model._meta.concrete_fields}
+    only = ["pk"] + [name for name in fields if name in model_fields and name not in related_fields]
+    related = [related_fields[name] for name in fields if name in related_fields]
+    return queryset.select_related(*[lookup.split("__")[0] for lookup in related]).only(*only, *related)
+
+
+def history_username(history_model, order_by, **filters):
+    """Returns a subquery for the username of the user who made the first
+    historical record of the outer row in order_by order matching filters"""
+    return Subquery(
+        history_model.objects.filter(id=OuterRef("pk"), **filters)
+        .order_by(*order_by)
+        .values("history_user__username")[:1]
+    )
+
+
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
 def regenerate_token(request):
@@ -45,25 +162,38 @@ def regenerate_token(request):
     return Response({"token": token.key})
 
 
-class ResourceViewSet(viewsets.ReadOnlyModelViewSet):
+class ResourceViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     serializer_class = serializers.ResourceSerializer
-    queryset = Resource.objects.all()
+
+    def get_queryset(self):
+        return sparse_queryset(Resource.objects.all(), self.request, {"resource_type": "resource_type__name"})
+
+    def get_etag_querysets(self, pks):
+        return [Resource.objects.filter(pk__in=pks), ResourceType.objects.all()]
 
 
-class AllocationViewSet(viewsets.ReadOnlyModelViewSet):
+class AllocationViewSet(ConditionalGetMixin, ExportMixin, viewsets.ReadOnlyModelViewSet):
     """
     Query parameters:
     - allocation_users (default false)
         Show related user data.
     - allocation_attributes (default false)
         Show related attribute data.
+    - fields
+        Comma separated list of the fields to return, default all.
+    - expand
+        Comma separated list of related data to show, e.g. allocation_users.
+
+    export/ streams every allocation as NDJSON, or as CSV with ?format=csv.
     """
 
     serializer_class = serializers.AllocationSerializer
     # permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
 
     def get_queryset(self):
-        allocations = Allocation.objects.prefetch_related("project", "project__pi", "status")
+        allocations = sparse_queryset(
+            Allocation.objects.all(), self.request, {"project": "project__title", "status": "status__name"}
+        )
 
         if not (self.request.user.is_superuser or self.request.user.has_perm("allocation.can_view_all_allocations")):
             allocations = allocations.filter(
@@ -79,13 +209,37 @@ class AllocationViewSet(viewsets.ReadOnlyModelViewSet):
 
         allocations = allocations.order_by("project")
 
-        if self.request.query_params.get("allocation_users") in ["True", "true"]:
-            allocations = allocations.prefetch_related("allocationuser_set")
+        return allocations.prefetch_related(*allocation_prefetches(self.request))
 
-        if self.request.query_params.get("allocation_attributes") in ["True", "true"]:
-            allocations = allocations.prefetch_related("allocationattribute_set")
+    def get_etag_querysets(self, pks):
+        return allocation_etag_querysets(self.request, pks)
 
-        return allocations
+
+class AllocationUsageViewSet(viewsets.ViewSet):
+    """Staff and superuser-only endpoint for usage collectors to set the usage
+    of many allocation attributes in one request.
+    POST a JSON list, or CSV with a header row, of records with:
+    - allocation (id) or account (value of the account allocation attribute)
+    - attribute (allocation attribute type name)
+    - value
+    """
+
+    parser_classes = [JSONParser, CSVParser]
+    permission_classes = [IsAuthenticated, IsAdminUser]
+
+    def create(self, request):
+        if not isinstance(request.data, list) or not all(isinstance(record, dict) for record in request.data):
+            return Response({"detail": "Expected a list of records."}, status=status.HTTP_400_BAD_REQUEST)
+
+        result = set_allocation_usages(request.data, user=request.user)
+        logger.info(
+            "Allocation usage set by %s: %s created, %s updated, %s errors",
+            request.user.username,
+            result["created"],
+            result["updated"],
+            len(result["errors"]),
+        )
+        return Response(result)
 
 
 class AllocationRequestFilter(filters.FilterSet):
@@ -122,7 +276,7 @@ class AllocationRequestFilter(filters.FilterSet):
         return queryset
 
 
-class AllocationRequestViewSet(viewsets.ReadOnlyModelViewSet):
+class AllocationRequestViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     """Report view on allocations requested through Coldfront.
     Data:
     - id: allocation id
@@ -153,34 +307,35 @@ class AllocationRequestViewSet(viewsets.ReadOnlyModelViewSet):
     def get_queryset(self):
         HistoricalAllocation = get_history_model_for_model(Allocation)
 
-        # Subquery to get the earliest historical record for each allocation
-        earliest_history = (
-            HistoricalAllocation.objects.filter(id=OuterRef("pk")).order_by("history_date").values("status__name")[:1]
+        # first_status, fulfilled_date and time_to_fulfillment are stored on
+        # the allocation as its history is recorded
+        allocations = sparse_queryset(
+            Allocation.objects.filter(first_status__name="New").order_by("created"),
+            self.request,
+            {"project": "project__title", "status": "status__name"},
         )
 
-        fulfilled_date = (
-            HistoricalAllocation.objects.filter(id=OuterRef("pk"), status__name="Active")
-            .order_by("history_date")
-            .values("modified")[:1]
-        )
-
-        # Annotate allocations with the status_id of their earliest historical record
-        allocations = (
-            Allocation.objects.annotate(earliest_status_name=Subquery(earliest_history))
-            .filter(earliest_status_name="New")
-            .order_by("created")
-        )
-
-        allocations = allocations.annotate(fulfilled_date=Subquery(fulfilled_date))
+        if field_requested(self.request, "resource"):
+            allocations = allocations.prefetch_related(
+                Prefetch("resources", queryset=Resource.objects.order_by(*ALLOCATION_RESOURCE_ORDERING))
+            )
 
-        allocations = allocations.annotate(
-            time_to_fulfillment=ExpressionWrapper(
-                (Cast(Subquery(fulfilled_date), fields.DateTimeField()) - F("created")),
-                output_field=fields.DurationField(),
+        # read by the serializer instead of querying history per allocation
+        if field_requested(self.request, "created_by"):
+            allocations = allocations.annotate(
+                created_by_username=history_username(HistoricalAllocation, ["history_date", "history_id"])
+            )
+        if field_requested(self.request, "fulfilled_by"):
+            allocations = allocations.annotate(
+                fulfilled_by_username=history_username(
+                    HistoricalAllocation, ["history_date", "history_id"], status__name="Active"
+                )
             )
-        )
         return allocations
 
+    def get_etag_querysets(self, pks):
+        return allocation_etag_querysets(self.request, pks)
+
 
 class AllocationChangeRequestFilter(filters.FilterSet):
     """Filters for AllocationChangeRequestViewSet.
@@ -216,7 +371,7 @@ class AllocationChangeRequestFilter(filters.FilterSet):
         return queryset
 
 
-class AllocationChangeRequestViewSet(viewsets.ReadOnlyModelViewSet):
+class AllocationChangeRequestViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     """
     Data:
     - allocation: allocation object details
@@ -241,10 +396,17 @@ class AllocationChangeRequestViewSet(viewsets.ReadOnlyModelViewSet):
     filterset_class = AllocationChangeRequestFilter
 
     def get_queryset(self):
-        requests = AllocationChangeRequest.objects.prefetch_related(
-            "allocation", "allocation__project", "allocation__project__pi"
+        requests = sparse_queryset(
+            AllocationChangeRequest.objects.all(),
+            self.request,
+            {"status": "status__name"},
         )
 
+        if field_requested(self.request, "allocation"):
+            requests = requests.select_related(
+                "allocation", "allocation__project", "allocation__status"
+            ).prefetch_related(*allocation_prefetches(self.request, prefix="allocation__"))
+
         if not (self.request.user.is_superuser or self.request.user.is_staff):
             requests = requests.filter(
                 Q(allocation__project__status__name__in=["New", "Active"])
@@ -259,26 +421,37 @@ class AllocationChangeRequestViewSet(viewsets.ReadOnlyModelViewSet):
 
         HistoricalAllocationChangeRequest = get_history_model_for_model(AllocationChangeRequest)
 
-        fulfilled_date = (
-            HistoricalAllocationChangeRequest.objects.filter(id=OuterRef("pk"), status__name="Approved")
-            .order_by("history_date")
-            .values("modified")[:1]
-        )
-
-        requests = requests.annotate(fulfilled_date=Subquery(fulfilled_date))
-
-        requests = requests.annotate(
-            time_to_fulfillment=ExpressionWrapper(
-                (Cast(Subquery(fulfilled_date), fields.DateTimeField()) - F("created")),
-                output_field=fields.DurationField(),
+        # fulfilled_date and time_to_fulfillment are stored on the change
+        # request as its history is recorded, read the users from history
+        if field_requested(self.request, "created_by"):
+            requests = requests.annotate(
+                created_by_username=history_username(HistoricalAllocationChangeRequest, ["history_date", "history_id"])
+            )
+        # fulfilled_by is only set for approved requests
+        if field_requested(self.request, "fulfilled_by"):
+            requests = requests.annotate(
+                fulfilled_by_username=Case(
+                    When(
+                        status__name="Approved",
+                        then=history_username(HistoricalAllocationChangeRequest, ["-history_date", "-history_id"]),
+                    ),
+                    default=None,
+                )
             )
-        )
         requests = requests.order_by("created")
 
         return requests
 
+    def get_etag_querysets(self, pks):
+        return [
+            AllocationChangeRequest.objects.filter(pk__in=pks),
+            AllocationChangeStatusChoice.objects.all(),
+        ] + allocation_etag_querysets(
+            self.request, AllocationChangeRequest.objects.filter(pk__in=pks).values("allocation")
+        )
+
 
-class ProjectViewSet(viewsets.ReadOnlyModelViewSet):
+class ProjectViewSet(ConditionalGetMixin, ExportMixin, viewsets.ReadOnlyModelViewSet):
     """
     Query parameters:
     - allocations (default false)
@@ -287,12 +460,20 @@ class ProjectViewSet(viewsets.ReadOnlyModelViewSet):
         Show related user data.
     - project_attributes (default false)
         Show related attribute data.
+    - fields
+        Comma separated list of the fields to return, default all.
+    - expand
+        Comma separated list of related data to show, e.g. project_users.
+
+    export/ streams every project as NDJSON, or as CSV with ?format=csv.
     """
 
     serializer_class = serializers.ProjectSerializer
 
     def get_queryset(self):
-        projects = Project.objects.prefetch_related("status")
+        projects = sparse_queryset(
+            Project.objects.all(), self.request, {"pi": "pi__username", "status": "status__name"}
+        )
 
         if not (
             self.request.user.is_superuser
@@ -311,17 +492,58 @@ class ProjectViewSet(viewsets.ReadOnlyModelViewSet):
                 .order_by("pi")
             )
 
-        if self.request.query_params.get("project_users") in ["True", "true"]:
-            projects = projects.prefetch_related("projectuser_set")
+        if field_requested(self.request, "project_users") and query_param_enabled(self.request, "project_users"):
+            projects = projects.prefetch_related(
+                Prefetch("projectuser_set", queryset=ProjectUser.objects.select_related("user", "role", "status"))
+            )
 
-        if self.request.query_params.get("allocations") in ["True", "true"]:
-            projects = projects.prefetch_related("allocation_set")
+        if field_requested(self.request, "allocations") and query_param_enabled(self.request, "allocations"):
+            projects = projects.prefetch_related(
+                Prefetch(
+                    "allocation_set",
+                    queryset=Allocation.objects.select_related("status").prefetch_related(
+                        Prefetch("resources", queryset=Resource.objects.order_by(*ALLOCATION_RESOURCE_ORDERING))
+                    ),
+                )
+            )
 
-        if self.request.query_params.get("project_attributes") in ["True", "true"]:
-            projects = projects.prefetch_related("projectattribute_set")
+        if field_requested(self.request, "project_attributes") and query_param_enabled(
+            self.request, "project_attributes"
+        ):
+            projects = projects.prefetch_related(
+                Prefetch("projectattribute_set", queryset=ProjectAttribute.objects.select_related("proj_attr_type"))
+            )
 
         return projects.order_by("pi")
 
+    def get_etag_querysets(self, pks):
+        querysets = [
+            Project.objects.filter(pk__in=pks),
+            ProjectStatusChoice.objects.all(),
+            usernames_etag_queryset(Project.objects.filter(pk__in=pks).values("pi")),
+        ]
+
+        if query_param_enabled(self.request, "project_users"):
+            querysets += [
+                ProjectUser.objects.filter(project__in=pks),
+                ProjectUserRoleChoice.objects.all(),
+                ProjectUserStatusChoice.objects.all(),
+                usernames_etag_queryset(ProjectUser.objects.filter(project__in=pks).values("user")),
+            ]
+
+        if query_param_enabled(self.request, "allocations"):
+            allocation_pks = Allocation.objects.filter(project__in=pks).values("pk")
+            querysets += [
+                Allocation.objects.filter(pk__in=allocation_pks),
+                AllocationStatusChoice.objects.all(),
+                Resource.objects.filter(allocation__in=allocation_pks),
+            ]
+
+        if query_param_enabled(self.request, "project_attributes"):
+            querysets += [ProjectAttribute.objects.filter(project__in=pks), ProjectAttributeType.objects.all()]
+
+        return querysets
+
 
 class UserFilter(filters.FilterSet):
     is_staff = filters.BooleanFilter()
@@ -351,3 +573,28 @@ class UserViewSet(viewsets.ReadOnlyModelViewSet):
     def get_queryset(self):
         queryset = get_user_model().objects.all()
         return queryset
+
+
+class ChangesViewSet(viewsets.ViewSet):
+    """Staff and superuser-only feed of create, update and delete events
+    recorded in the history of allocations, allocation users, allocation
+    attributes and projects, oldest first. Events are returned once they are
+    API_CHANGES_FEED_LAG seconds old.
+    Query parameters:
+    - since (cursor returned by the previous request, omit to start from the
+      first recorded change)
+    - page_size
+    """
+
+    permission_classes = [IsAuthenticated, IsAdminUser]
+
+    def list(self, request):
+        paginator = KeysetPagination()
+        page_size = paginator.get_page_size(request)
+        events, cursor, has_more = get_changes(request.query_params.get("since"), page_size)
+
+        next_url = None
+        if has_more:
+            next_url = replace_query_param(request.build_absolute_uri(), "since", cursor)
+
+        return Response({"cursor": cursor, "next": next_url, "results": events})
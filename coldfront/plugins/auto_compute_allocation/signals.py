@@ -7,10 +7,10 @@
 import logging
 
 from django.dispatch import receiver
-from django_q.tasks import async_task
 
 from coldfront.core.project.signals import project_new
 from coldfront.core.project.views import ProjectCreateView
+from coldfront.core.utils.tasks import dispatch_task
 
 logger = logging.getLogger(__name__)
 
@@ -19,7 +19,7 @@ logger = logging.getLogger(__name__)
 def project_new_auto_compute_allocation(sender, **kwargs):
     project_obj = kwargs.get("project_obj")
     # Add a compute allocation
-    async_task(
+    dispatch_task(
         "coldfront.plugins.auto_compute_allocation.tasks.add_auto_compute_allocation",
-        project_obj,
+        project_obj.pk,
     )
@@ -7,7 +7,9 @@
 import logging
 
 from coldfront.core.allocation.models import AllocationAttributeType
+from coldfront.core.project.models import Project
 from coldfront.core.utils.common import import_from_settings
+from coldfront.core.utils.tasks import load_task_object
 from coldfront.plugins.auto_compute_allocation.slurm_account_name import generate_slurm_account_name
 from coldfront.plugins.auto_compute_allocation.utils import (
     allocation_auto_compute,
@@ -34,8 +36,9 @@ AUTO_COMPUTE_ALLOCATION_SLURM_ATTR_TUPLE_TRAINING = import_from_settings(
 
 
 # automatically create a compute allocation, called by project_new signal
-def add_auto_compute_allocation(project_obj):
+def add_auto_compute_allocation(project_pk):
     """Method to add a compute allocation automatically upon project creation - uses signals for project creation"""
+    project_obj = load_task_object(Project, project_pk)
 
     # if project_code not enabled or None or empty, print appropriate message and stop
     if not hasattr(project_obj, "project_code"):
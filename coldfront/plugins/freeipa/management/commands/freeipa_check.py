@@ -9,11 +9,14 @@ import sys
 import dbus
 from django.contrib.auth.models import User
 from django.core.management.base import BaseCommand
+from django.utils import timezone
 from ipalib import api
+from ldap3.core.exceptions import LDAPException
+from simple_history.utils import bulk_update_with_history
 
 from coldfront.core.allocation.models import AllocationUser, AllocationUserStatusChoice
 from coldfront.core.project.models import ProjectUser, ProjectUserStatusChoice
-from coldfront.plugins.freeipa.search import LDAPUserSearch
+from coldfront.plugins.freeipa.search import IncompleteSearchError, LDAPUserSearch
 from coldfront.plugins.freeipa.utils import (
     CLIENT_KTNAME,
     FREEIPA_NOOP,
@@ -96,14 +99,18 @@ class Command(BaseCommand):
 
         self.writerow(row)
 
-    def disable_user_in_coldfront(self, user, freeipa_status):
-        row = [
-            "Disable",
-            user.username,
-            "",
-            "/".join([freeipa_status, "Active" if user.is_active else "Inactive"]),
-        ]
-        self.writerow(row)
+    def disable_users_in_coldfront(self, disabled_users):
+        """Disable users in ColdFront given a list of (user, freeipa_status)
+        tuples. All allocation and project memberships are removed with bulk
+        updates rather than a save per membership."""
+        for user, freeipa_status in disabled_users:
+            row = [
+                "Disable",
+                user.username,
+                "",
+                "/".join([freeipa_status, "Active" if user.is_active else "Inactive"]),
+            ]
+            self.writerow(row)
 
         if not self.sync:
             return
@@ -111,25 +118,97 @@ class Command(BaseCommand):
         if self.noop:
             return
 
-        # Disable user from any active allocations
+        if len(disabled_users) == 0:
+            return
+
+        user_pks = [user.pk for user, _ in disabled_users]
+        now = timezone.now()
+
+        # Disable users from any active allocations
         inactive_status = AllocationUserStatusChoice.objects.get(name="Removed")
-        user_allocations = AllocationUser.objects.filter(user=user)
+        user_allocations = list(
+            AllocationUser.objects.filter(
+                user__pk__in=user_pks,
+                status__name="Active",
+                allocation__status__name="Active",
+            ).select_related("user")
+        )
         for ua in user_allocations:
-            if ua.status.name == "Active" and ua.allocation.status.name == "Active":
-                logger.info("Removing user from allocation user=%s allocation=%s", user.username, ua.allocation)
-                ua.status = inactive_status
-                ua.save()
+            logger.info("Removing user from allocation user=%s allocation=%s", ua.user.username, ua.allocation_id)
+            ua.status = inactive_status
+            ua.modified = now
+        bulk_update_with_history(user_allocations, AllocationUser, ["status", "modified"])
 
-        # Disable user from any active projects
+        # Disable users from any active projects
         inactive_status = ProjectUserStatusChoice.objects.get(name="Removed")
-        user_projects = ProjectUser.objects.filter(user=user)
+        user_projects = list(
+            ProjectUser.objects.filter(
+                user__pk__in=user_pks,
+                status__name="Active",
+                project__status__name="Active",
+            ).select_related("user", "project")
+        )
         for pa in user_projects:
-            if pa.status.name == "Active" and pa.project.status.name == "Active":
-                logger.info("Removing user from project user=%s project=%s", user.username, pa.project)
-                pa.status = inactive_status
-                pa.save()
+            logger.info("Removing user from project user=%s project=%s", pa.user.username, pa.project)
+            pa.status = inactive_status
+            pa.modified = now
+        bulk_update_with_history(user_projects, ProjectUser, ["status", "modified"])
+
+        try:
+            User.objects.filter(pk__in=user_pks).update(is_active=False)
+        except Exception as e:
+            logger.error("Failed to update user status: %s", e)
+        else:
+            for user, _ in disabled_users:
+                user.is_active = False
+
+    def user_exists_in_freeipa(self, username):
+        """Returns True if infopipe finds the user, False if it reports no such
+        user and None if the lookup failed"""
+        try:
+            self.ifp.GetUserGroups(username)
+        except dbus.exceptions.DBusException as e:
+            if "No such user" in str(e) or "NotFound" in str(e):
+                return False
+            logger.error("dbus error failed to find user %s in FreeIPA: %s", username, e)
+            return None
+        return True
+
+    def disable_users(self, users):
+        """Find users that are locked or missing in FreeIPA using a single
+        LDAP search and disable them in ColdFront. Users missing from that
+        search are looked up again by username, and then with infopipe, before
+        they are disabled as NotFound."""
+        users = [user for user in users if not self.filter_user or self.filter_user == user.username]
+        try:
+            lock_status = self.ipa_ldap.search_account_lock_status()
+            if len(lock_status) == 0:
+                logger.error("No users found in FreeIPA. Refusing to disable all users in ColdFront")
+                return
+
+            missing = [user.username for user in users if user.username not in lock_status]
+            if missing:
+                lock_status.update(self.ipa_ldap.search_account_lock_status(missing))
+        except (IncompleteSearchError, LDAPException) as e:
+            logger.error("FreeIPA account lock search failed. Refusing to disable users in ColdFront: %s", e)
+            return
 
-        self.sync_user_status(user, active=False)
+        disabled_users = []
+        for user in users:
+            if user.username not in lock_status:
+                exists = self.user_exists_in_freeipa(user.username)
+                if exists is False:
+                    # User is not found in FreeIPA so disable in coldfront
+                    logger.info("User is not found in FreeIPA so disable in ColdFront: %s", user.username)
+                    disabled_users.append((user, "NotFound"))
+                elif exists:
+                    logger.warning("User %s was not found by LDAP search but exists in FreeIPA", user.username)
+            elif lock_status[user.username]:
+                # User is disabled in FreeIPA so disable in coldfront
+                logger.info("User is disabled in FreeIPA so disable in ColdFront: %s", user.username)
+                disabled_users.append((user, "Disabled"))
+
+        self.disable_users_in_coldfront(disabled_users)
 
     def sync_user_status(self, user, active=False):
         if not self.sync:
@@ -301,20 +380,4 @@ class Command(BaseCommand):
             self.process_user(user)
 
         if self.disable:
-            for user in users:
-                if self.filter_user and self.filter_user != user.username:
-                    continue
-
-                try:
-                    result = self.ifp.GetUserAttr(user.username, ["nsaccountlock"])
-                    if "nsAccountLock" in result and str(result["nsAccountLock"][0]) == "TRUE":
-                        # User is disabled in FreeIPA so disable in coldfront
-                        logger.info("User is disabled in FreeIPA so disable in ColdFront: %s", user.username)
-                        self.disable_user_in_coldfront(user, "Disabled")
-                except dbus.exceptions.DBusException as e:
-                    if "No such user" in str(e) or "NotFound" in str(e):
-                        # User is not found in FreeIPA so disable in coldfront
-                        logger.info("User is not found in FreeIPA so disable in ColdFront: %s", user.username)
-                        self.disable_user_in_coldfront(user, "NotFound")
-                    else:
-                        logger.error("dbus error failed while checking user %s in FreeIPA: %s", user.username, e)
+            self.disable_users(users)
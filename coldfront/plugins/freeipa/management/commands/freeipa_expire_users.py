@@ -6,6 +6,9 @@ import datetime
 import logging
 import os
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import dbus
 from django.core.management.base import BaseCommand
@@ -18,6 +21,11 @@ from coldfront.plugins.freeipa.utils import CLIENT_KTNAME, FREEIPA_NOOP
 
 logger = logging.getLogger(__name__)
 
+USER_ACTIVE = "Active"
+USER_DISABLED = "Disabled"
+USER_NOT_FOUND = "NotFound"
+USER_ERROR = "Error"
+
 
 class Command(BaseCommand):
     help = "Report users to expire in FreeIPA"
@@ -26,6 +34,20 @@ class Command(BaseCommand):
         parser.add_argument("-s", "--sync", help="Sync changes to/from FreeIPA", action="store_true")
         parser.add_argument("-x", "--header", help="Include header in output", action="store_true")
         parser.add_argument("-n", "--noop", help="Print commands only. Do not run any commands.", action="store_true")
+        parser.add_argument(
+            "-w",
+            "--workers",
+            help="Number of concurrent FreeIPA lookups (default: 1)",
+            type=int,
+            default=1,
+        )
+        parser.add_argument(
+            "-c",
+            "--chunk-size",
+            help="Number of users checked per worker task (default: 100)",
+            type=int,
+            default=100,
+        )
 
     def writerow(self, row):
         try:
@@ -68,27 +90,19 @@ class Command(BaseCommand):
         if options["header"]:
             self.writerow(header)
 
-        bus = dbus.SystemBus()
-        infopipe_obj = bus.get_object("org.freedesktop.sssd.infopipe", "/org/freedesktop/sssd/infopipe")
-        ifp = dbus.Interface(infopipe_obj, dbus_interface="org.freedesktop.sssd.infopipe")
-
         expired_365_days_ago = datetime.datetime.today() - datetime.timedelta(days=365)
         expired_365_days_ago = expired_365_days_ago.date()
 
         # Find all active users on active allocations
-        active_users = sorted(
-            list(
-                set(
-                    AllocationUser.objects.filter(status__name="Active")
-                    .exclude(allocation__status__name__in=["Expired"])
-                    .values_list("user__username", flat=True)
-                )
-            )
+        active_users = set(
+            AllocationUser.objects.filter(status__name="Active")
+            .exclude(allocation__status__name__in=["Expired"])
+            .values_list("user__username", flat=True)
         )
 
         # Filter out users to expire, either not active or have been removed
         expired_allocation_users = {}
-        for allocationuser in AllocationUser.objects.all():
+        for allocationuser in AllocationUser.objects.select_related("user", "status", "allocation__status"):
             if allocationuser.user.username in active_users:
                 continue
 
@@ -119,46 +133,123 @@ class Command(BaseCommand):
                         "allocation_id": allocation.id,
                     }
 
-        # Print users whose latest allocation expiration date GTE 365 days and active in FreeIPA
-        for key in expired_allocation_users.keys():
-            if expired_allocation_users[key]["expire_date"] > expired_365_days_ago:
+        # Users whose latest allocation expiration date GTE 365 days
+        candidates = [
+            key
+            for key in expired_allocation_users.keys()
+            if expired_allocation_users[key]["expire_date"] <= expired_365_days_ago
+        ]
+
+        workers = max(1, options["workers"])
+        chunk_size = max(1, options["chunk_size"])
+        results = self.check_users(candidates, workers, chunk_size)
+
+        # Print users active in FreeIPA, merged in the same order as a serial run
+        for key in candidates:
+            status, elapsed = results[key]
+            logger.debug("FreeIPA lookup for user %s took %.3fs: %s", key, elapsed, status)
+            if status != USER_ACTIVE:
                 continue
 
-            try:
-                result = ifp.GetUserAttr(key, ["nsaccountlock"])
-                if "nsAccountLock" in result and str(result["nsAccountLock"][0]).lower() == "true":
-                    # User is already disabled in FreeIPA so do nothing
-                    logger.info("User already disabled in FreeIPA: %s", key)
-                    pass
-                else:
-                    # User is active in FreeIPA but not on any active allocations
-                    self.writerow(
-                        [
-                            key,
-                            expired_allocation_users[key]["expire_date"].strftime("%Y-%m-%d"),
-                            build_link(
-                                reverse(
-                                    "allocation-detail", kwargs={"pk": expired_allocation_users[key]["allocation_id"]}
-                                )
-                            ),
-                        ]
-                    )
-
-                    if self.sync and not self.noop:
-                        # Disable in ColdFront
-                        expired_allocation_users[key]["user"].is_active = False
-                        expired_allocation_users[key]["user"].save()
-
-                        # Disable in FreeIPA
-                        res = api.Command.user_disable(key)
-                        if not res:
-                            raise ValueError("Missing FreeIPA response")
-                        if "result" not in res or not res["result"]:
-                            raise ValueError(f"Failed to disable user: {res}")
-            except dbus.exceptions.DBusException as e:
-                if "No such user" in str(e) or "NotFound" in str(e):
-                    logger.info("User %s not found in FreeIPA", key)
-                else:
-                    logger.error("dbus error failed to find user %s in FreeIPA: %s", key, e)
-            except Exception as e:
-                logger.error("Failed to disable user %s: %s", key, e)
+            # User is active in FreeIPA but not on any active allocations
+            self.writerow(
+                [
+                    key,
+                    expired_allocation_users[key]["expire_date"].strftime("%Y-%m-%d"),
+                    build_link(
+                        reverse("allocation-detail", kwargs={"pk": expired_allocation_users[key]["allocation_id"]})
+                    ),
+                ]
+            )
+
+            if self.sync and not self.noop:
+                try:
+                    # Disable in ColdFront
+                    expired_allocation_users[key]["user"].is_active = False
+                    expired_allocation_users[key]["user"].save()
+
+                    # Disable in FreeIPA
+                    res = api.Command.user_disable(key)
+                    if not res:
+                        raise ValueError("Missing FreeIPA response")
+                    if "result" not in res or not res["result"]:
+                        raise ValueError(f"Failed to disable user: {res}")
+                except Exception as e:
+                    logger.error("Failed to disable user %s: %s", key, e)
+
+        slowest = sorted(results.items(), key=lambda item: item[1][1], reverse=True)[:10]
+        for key, (status, elapsed) in slowest:
+            logger.info("Slow FreeIPA lookup: user=%s status=%s time=%.3fs", key, status, elapsed)
+
+    def get_infopipe(self):
+        """Returns an sssd infopipe interface for the current thread. Each
+        worker thread holds its own private bus connection, closed by
+        check_users once the workers finish."""
+        ifp = getattr(self.local, "ifp", None)
+        if ifp is None:
+            bus = dbus.SystemBus(private=True)
+            with self.buses_lock:
+                self.buses.append(bus)
+            infopipe_obj = bus.get_object("org.freedesktop.sssd.infopipe", "/org/freedesktop/sssd/infopipe")
+            ifp = dbus.Interface(infopipe_obj, dbus_interface="org.freedesktop.sssd.infopipe")
+            self.local.ifp = ifp
+        return ifp
+
+    def check_user(self, key):
+        """Returns the FreeIPA account status of a user"""
+        try:
+            result = self.get_infopipe().GetUserAttr(key, ["nsaccountlock"])
+            if "nsAccountLock" in result and str(result["nsAccountLock"][0]).lower() == "true":
+                # User is already disabled in FreeIPA so do nothing
+                logger.info("User already disabled in FreeIPA: %s", key)
+                return USER_DISABLED
+            return USER_ACTIVE
+        except dbus.exceptions.DBusException as e:
+            if "No such user" in str(e) or "NotFound" in str(e):
+                logger.info("User %s not found in FreeIPA", key)
+                return USER_NOT_FOUND
+            logger.error("dbus error failed to find user %s in FreeIPA: %s", key, e)
+        except Exception as e:
+            logger.error("Failed to check user %s in FreeIPA: %s", key, e)
+
+        return USER_ERROR
+
+    def check_chunk(self, chunk):
+        """Checks a chunk of users returning a dict of username to (status, elapsed seconds)"""
+        results = {}
+        for key in chunk:
+            start = time.monotonic()
+            status = self.check_user(key)
+            results[key] = (status, time.monotonic() - start)
+        return results
+
+    def check_users(self, candidates, workers, chunk_size):
+        """Checks all candidate users in FreeIPA, splitting them into chunks
+        processed by a bounded pool of workers"""
+        self.local = threading.local()
+        self.buses = []
+        self.buses_lock = threading.Lock()
+        chunks = [candidates[i : i + chunk_size] for i in range(0, len(candidates), chunk_size)]
+        logger.info("Checking %s users in FreeIPA with %s workers", len(candidates), workers)
+
+        results = {}
+        try:
+            if workers == 1:
+                for chunk in chunks:
+                    results.update(self.check_chunk(chunk))
+                    logger.info("Checked %s/%s users", len(results), len(candidates))
+                return results
+
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(self.check_chunk, chunk) for chunk in chunks]
+                for future in as_completed(futures):
+                    results.update(future.result())
+                    logger.info("Checked %s/%s users", len(results), len(candidates))
+
+            return results
+        finally:
+            for bus in self.buses:
+                try:
+                    bus.close()
+                except Exception as e:
+                    logger.warning("Failed to close dbus connection: %s", e)
@@ -16,6 +16,10 @@ from coldfront.core.utils.common import import_from_settings
 logger = logging.getLogger(__name__)
 
 
+class IncompleteSearchError(Exception):
+    """LDAP search did not return every matching entry"""
+
+
 class LDAPUserSearch(UserSearch):
     search_source = "LDAP"
 
@@ -70,6 +74,26 @@ class LDAPUserSearch(UserSearch):
         else:
             filter = "(objectclass=person)"
 
+        users = self.run_search(filter, size_limit)
+        logger.info("LDAP user search for %s found %s results", user_search_string, len(users))
+        return users
+
+    def search_usernames(self, usernames, chunk_size=100):
+        """Look up many usernames with one OR filter per chunk of usernames"""
+        os.environ["KRB5_CLIENT_KTNAME"] = self.FREEIPA_KTNAME
+
+        users = []
+        for i in range(0, len(usernames), chunk_size):
+            chunk = usernames[i : i + chunk_size]
+            uid_filter = "".join(ldap.filter.filter_format("(uid=%s)", [username]) for username in chunk)
+            filter = "(&(|{})(|(nsaccountlock=FALSE)(!(nsaccountlock=*))))".format(uid_filter)
+            users.extend(self.run_search(filter, len(chunk)))
+
+        users.sort(key=lambda user: user["username"])
+        logger.info("LDAP user search for %s usernames found %s results", len(usernames), len(users))
+        return users
+
+    def run_search(self, filter, size_limit):
         searchParameters = {
             "search_base": self.FREEIPA_USER_SEARCH_BASE,
             "search_filter": filter,
@@ -77,10 +101,68 @@ class LDAPUserSearch(UserSearch):
             "size_limit": size_limit,
         }
         self.conn.search(**searchParameters)
-        users = []
-        for idx, entry in enumerate(self.conn.entries, 1):
-            user_dict = self.parse_ldap_entry(entry)
-            users.append(user_dict)
+        return [self.parse_ldap_entry(entry) for entry in self.conn.entries]
+
+    def check_search_complete(self):
+        """Raise IncompleteSearchError unless the last search returned every
+        matching entry, e.g. it hit a size, time or admin limit or returned a
+        partial result or referral"""
+        result = self.conn.result or {}
+        if result.get("result", 0) != 0:
+            raise IncompleteSearchError(
+                "LDAP search did not complete: {} {}".format(result.get("description"), result.get("message", ""))
+            )
 
-        logger.info("LDAP user search for %s found %s results", user_search_string, len(users))
-        return users
+    def parse_lock_status(self, entries, lock_status):
+        for entry in entries:
+            if entry.get("type") != "searchResEntry":
+                continue
+
+            attributes = entry.get("attributes", {})
+            uid = attributes.get("uid")
+            if isinstance(uid, list):
+                uid = uid[0] if uid else None
+            if not uid:
+                continue
+
+            locked = attributes.get("nsAccountLock")
+            if isinstance(locked, list):
+                locked = locked[0] if locked else None
+
+            lock_status[str(uid)] = str(locked).upper() == "TRUE"
+
+    def search_account_lock_status(self, usernames=None, page_size=1000, chunk_size=100):
+        """Returns a dict mapping usernames to True if the account is locked
+        (nsAccountLock=TRUE). Users missing from the dict were not found in
+        FreeIPA. Without usernames every person is looked up in a single paged
+        search, with usernames one OR filter is searched per chunk of
+        usernames. Raises IncompleteSearchError if any search did not return
+        every matching entry."""
+        os.environ["KRB5_CLIENT_KTNAME"] = self.FREEIPA_KTNAME
+
+        lock_status = {}
+        if usernames is None:
+            entries = self.conn.extend.standard.paged_search(
+                search_base=self.FREEIPA_USER_SEARCH_BASE,
+                search_filter="(objectclass=person)",
+                attributes=["uid", "nsAccountLock"],
+                paged_size=page_size,
+                generator=True,
+            )
+            self.parse_lock_status(entries, lock_status)
+            self.check_search_complete()
+        else:
+            for i in range(0, len(usernames), chunk_size):
+                chunk = usernames[i : i + chunk_size]
+                uid_filter = "".join(ldap.filter.filter_format("(uid=%s)", [username]) for username in chunk)
+                self.conn.search(
+                    search_base=self.FREEIPA_USER_SEARCH_BASE,
+                    search_filter="(|{})".format(uid_filter),
+                    attributes=["uid", "nsAccountLock"],
+                    size_limit=len(chunk),
+                )
+                self.check_search_complete()
+                self.parse_lock_status(self.conn.response or [], lock_status)
+
+        logger.info("LDAP account lock search found %s users", len(lock_status))
+        return lock_status
@@ -3,23 +3,23 @@
 # SPDX-License-Identifier: AGPL-3.0-or-later
 
 from django.dispatch import receiver
-from django_q.tasks import async_task
 
-from coldfront.core.allocation.signals import allocation_activate_user, allocation_remove_user
+from coldfront.core.allocation.signals import allocation_activate_users, allocation_remove_users
 from coldfront.core.allocation.views import AllocationAddUsersView, AllocationRemoveUsersView, AllocationRenewView
 from coldfront.core.project.views import ProjectAddUsersView, ProjectRemoveUsersView
+from coldfront.core.utils.tasks import dispatch_task
 
 
-@receiver(allocation_activate_user, sender=ProjectAddUsersView)
-@receiver(allocation_activate_user, sender=AllocationAddUsersView)
-def activate_user(sender, **kwargs):
-    allocation_user_pk = kwargs.get("allocation_user_pk")
-    async_task("coldfront.plugins.freeipa.tasks.add_user_group", allocation_user_pk)
+@receiver(allocation_activate_users, sender=ProjectAddUsersView)
+@receiver(allocation_activate_users, sender=AllocationAddUsersView)
+def activate_users(sender, **kwargs):
+    allocation_user_pks = kwargs.get("allocation_user_pks")
+    dispatch_task("coldfront.plugins.freeipa.tasks.add_users_group", allocation_user_pks, priority="high")
 
 
-@receiver(allocation_remove_user, sender=ProjectRemoveUsersView)
-@receiver(allocation_remove_user, sender=AllocationRemoveUsersView)
-@receiver(allocation_remove_user, sender=AllocationRenewView)
-def remove_user(sender, **kwargs):
-    allocation_user_pk = kwargs.get("allocation_user_pk")
-    async_task("coldfront.plugins.freeipa.tasks.remove_user_group", allocation_user_pk)
+@receiver(allocation_remove_users, sender=ProjectRemoveUsersView)
+@receiver(allocation_remove_users, sender=AllocationRemoveUsersView)
+@receiver(allocation_remove_users, sender=AllocationRenewView)
+def remove_users(sender, **kwargs):
+    allocation_user_pks = kwargs.get("allocation_user_pks")
+    dispatch_task("coldfront.plugins.freeipa.tasks.remove_users_group", allocation_user_pks, priority="high")
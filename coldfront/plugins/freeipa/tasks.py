@@ -4,123 +4,223 @@
 
 import logging
 import os
+from contextlib import contextmanager
 
+from django.db.models import F
 from ipalib import api
 
-from coldfront.core.allocation.models import Allocation, AllocationUser
+from coldfront.core.allocation.models import AllocationAttribute, AllocationUser
 from coldfront.core.allocation.utils import set_allocation_user_status_to_error
 from coldfront.plugins.freeipa.utils import (
+    ALREADY_MEMBER_MESSAGE,
     CLIENT_KTNAME,
     FREEIPA_NOOP,
+    NOT_MEMBER_MESSAGE,
     UNIX_GROUP_ATTRIBUTE_NAME,
-    AlreadyMemberError,
-    NotMemberError,
-    check_ipa_group_error,
+    get_ipa_member_errors,
 )
 
 logger = logging.getLogger(__name__)
 
+# Memoized lookups shared for the length of a bulk operation. None when no bulk
+# operation is in progress.
+_bulk_cache = None
+
+
+@contextmanager
+def bulk_cache():
+    """Context manager that memoizes the allocation groups and the groups still
+    required by each user for the length of a bulk add or removal operation"""
+    global _bulk_cache
+    if _bulk_cache is not None:
+        # Already inside a bulk operation
+        yield
+        return
+
+    _bulk_cache = {"allocation_groups": {}, "required_groups": {}}
+    try:
+        yield
+    finally:
+        _bulk_cache = None
+
+
+def get_allocation_groups(allocation):
+    """Returns the list of FreeIPA groups for an allocation"""
+    if _bulk_cache is None:
+        return allocation.get_attribute_list(UNIX_GROUP_ATTRIBUTE_NAME)
+
+    cache = _bulk_cache["allocation_groups"]
+    if allocation.pk not in cache:
+        cache[allocation.pk] = allocation.get_attribute_list(UNIX_GROUP_ATTRIBUTE_NAME)
+
+    return list(cache[allocation.pk])
+
+
+def get_required_groups(user_pks):
+    """Returns a dict mapping each user pk to a dict of FreeIPA group name ->
+    set of active allocation pks that require the user to be in that group.
+    Computed with a single query for all users and memoized when called inside
+    bulk_cache()."""
+    user_pks = set(user_pks)
+    cache = _bulk_cache["required_groups"] if _bulk_cache is not None else {}
+    missing = user_pks - cache.keys()
+
+    if missing:
+        for user_pk in missing:
+            cache[user_pk] = {}
+
+        attributes = (
+            AllocationAttribute.objects.filter(
+                allocation_attribute_type__name=UNIX_GROUP_ATTRIBUTE_NAME,
+                allocation__status__name="Active",
+                allocation__allocationuser__user__pk__in=missing,
+                allocation__allocationuser__status__name="Active",
+            )
+            .annotate(required_by_user_pk=F("allocation__allocationuser__user__pk"))
+            .select_related("allocation_attribute_type__attribute_type")
+        )
+        for a in attributes:
+            group = a.expanded_value()
+            cache[a.required_by_user_pk].setdefault(group, set()).add(a.allocation_id)
+
+    return {user_pk: cache[user_pk] for user_pk in user_pks}
+
 
 def add_user_group(allocation_user_pk):
-    allocation_user = AllocationUser.objects.get(pk=allocation_user_pk)
+    add_users_group([allocation_user_pk])
+
+
+def add_users_group(allocation_user_pks):
+    """Add a batch of allocation users to their FreeIPA groups with one
+    group_add_member call per group. The groups of each allocation are looked
+    up once for the whole batch."""
+    allocation_users = AllocationUser.objects.filter(pk__in=allocation_user_pks).select_related(
+        "user", "status", "allocation__status"
+    )
+
+    with bulk_cache():
+        members = group_members(allocation_users, get_add_groups)
+
+    update_group_members(api.Command.group_add_member, members, ("adding", "Added", "to"), ALREADY_MEMBER_MESSAGE)
+
+
+def get_add_groups(allocation_user):
+    """Returns the FreeIPA groups to add an allocation user to"""
     if allocation_user.allocation.status.name != "Active":
         logger.warning("Allocation is not active. Will not add groups")
-        return
+        return []
 
     if allocation_user.status.name != "Active":
         logger.warning("Allocation user status is not 'Active'. Will not add groups.")
-        return
+        return []
 
-    groups = allocation_user.allocation.get_attribute_list(UNIX_GROUP_ATTRIBUTE_NAME)
+    groups = get_allocation_groups(allocation_user.allocation)
     if len(groups) == 0:
         logger.info("Allocation does not have any groups. Nothing to add")
-        return
 
-    os.environ["KRB5_CLIENT_KTNAME"] = CLIENT_KTNAME
-    for g in groups:
-        if FREEIPA_NOOP:
-            logger.warning(
-                "NOOP - FreeIPA adding user %s to group %s for allocation %s",
-                allocation_user.user.username,
-                g,
-                allocation_user.allocation,
-            )
-            continue
-
-        try:
-            res = api.Command.group_add_member(g, user=[allocation_user.user.username])
-            check_ipa_group_error(res)
-        except AlreadyMemberError:
-            logger.warning("User %s is already a member of group %s", allocation_user.user.username, g)
-        except Exception as e:
-            logger.error("Failed adding user %s to group %s: %s", allocation_user.user.username, g, e)
-            set_allocation_user_status_to_error(allocation_user_pk)
-        else:
-            logger.info("Added user %s to group %s successfully", allocation_user.user.username, g)
+    return groups
 
 
 def remove_user_group(allocation_user_pk):
-    allocation_user = AllocationUser.objects.get(pk=allocation_user_pk)
+    remove_users_group([allocation_user_pk])
+
+
+def remove_users_group(allocation_user_pks):
+    """Remove a batch of allocation users from their FreeIPA groups with one
+    group_remove_member call per group. The groups still required by each
+    user are computed once for the whole batch."""
+    allocation_users = list(
+        AllocationUser.objects.filter(pk__in=allocation_user_pks).select_related("user", "status", "allocation__status")
+    )
+
+    with bulk_cache():
+        get_required_groups([allocation_user.user_id for allocation_user in allocation_users])
+        members = group_members(allocation_users, get_remove_groups)
+
+    update_group_members(api.Command.group_remove_member, members, ("removing", "Removed", "from"), NOT_MEMBER_MESSAGE)
+
+
+def get_remove_groups(allocation_user):
+    """Returns the FreeIPA groups to remove an allocation user from"""
     if allocation_user.allocation.status.name not in [
         "Active",
         "Pending",
     ]:
         logger.warning("Allocation is not active or pending. Will not remove groups.")
-        return
+        return []
 
     if allocation_user.status.name != "Removed":
         logger.warning("Allocation user status is not 'Removed'. Will not remove groups.")
-        return
+        return []
 
-    groups = allocation_user.allocation.get_attribute_list(UNIX_GROUP_ATTRIBUTE_NAME)
+    groups = get_allocation_groups(allocation_user.allocation)
     if len(groups) == 0:
         logger.info("Allocation does not have any groups. Nothing to remove")
-        return
+        return []
 
     # Check other active allocations the user is active on for FreeIPA groups
     # and ensure we don't remove them.
-    user_allocations = (
-        Allocation.objects.filter(
-            allocationuser__user=allocation_user.user,
-            allocationuser__status__name="Active",
-            status__name="Active",
-            allocationattribute__allocation_attribute_type__name=UNIX_GROUP_ATTRIBUTE_NAME,
-        )
-        .exclude(pk=allocation_user.allocation.pk)
-        .distinct()
-    )
-
+    required_groups = get_required_groups([allocation_user.user_id])[allocation_user.user_id]
     exclude = []
-    for a in user_allocations:
-        for g in a.get_attribute_list(UNIX_GROUP_ATTRIBUTE_NAME):
-            if g in groups:
-                exclude.append(g)
+    for g in groups:
+        if g not in exclude and required_groups.get(g, set()) - {allocation_user.allocation_id}:
+            exclude.append(g)
 
-    for g in exclude:
-        groups.remove(g)
+    groups = [g for g in groups if g not in exclude]
 
     if len(groups) == 0:
         logger.info("No groups to remove. User may belong to these groups in other active allocations: %s", exclude)
+
+    return groups
+
+
+def group_members(allocation_users, get_groups):
+    """Returns a dict mapping each FreeIPA group returned by get_groups for the
+    allocation users to a dict of username -> list of the allocation users
+    with that username"""
+    members = {}
+    for allocation_user in allocation_users:
+        for g in get_groups(allocation_user):
+            members.setdefault(g, {}).setdefault(allocation_user.user.username, []).append(allocation_user)
+
+    return members
+
+
+def update_group_members(command, members, wording, ignored_message):
+    """Call command once per group with all of its usernames. The allocation
+    users that could not be added or removed are set to the Error status,
+    failures with ignored_message, e.g. already a member, are only logged.
+    wording is the (present participle, past tense, preposition) of the
+    command for log messages."""
+    if not members:
         return
 
+    action, done, preposition = wording
+
     os.environ["KRB5_CLIENT_KTNAME"] = CLIENT_KTNAME
-    for g in groups:
+    failed = set()
+    for g, users in members.items():
+        usernames = sorted(users)
         if FREEIPA_NOOP:
-            logger.warning(
-                "NOOP - FreeIPA removing user %s from group %s for allocation %s",
-                allocation_user.user.username,
-                g,
-                allocation_user.allocation,
-            )
+            logger.warning("NOOP - FreeIPA %s users %s %s group %s", action, usernames, preposition, g)
             continue
 
         try:
-            res = api.Command.group_remove_member(g, user=[allocation_user.user.username])
-            check_ipa_group_error(res)
-        except NotMemberError:
-            logger.warning("User %s is not a member of group %s", allocation_user.user.username, g)
+            errors = get_ipa_member_errors(command(g, user=usernames))
         except Exception as e:
-            logger.error("Failed removing user %s from group %s: %s", allocation_user.user.username, g, e)
-            set_allocation_user_status_to_error(allocation_user_pk)
-        else:
-            logger.info("Removed user %s from group %s successfully", allocation_user.user.username, g)
+            logger.error("Failed %s users %s %s group %s: %s", action, usernames, preposition, g, e)
+            failed.update(allocation_user.pk for username in usernames for allocation_user in users[username])
+            continue
+
+        for username in usernames:
+            err_msg = errors.get(username)
+            if err_msg is None:
+                logger.info("%s user %s %s group %s successfully", done, username, preposition, g)
+            elif err_msg == ignored_message:
+                logger.warning("Skipped %s user %s %s group %s: %s", action, username, preposition, g, err_msg)
+            else:
+                logger.error("Failed %s user %s %s group %s: %s", action, username, preposition, g, err_msg)
+                failed.update(allocation_user.pk for allocation_user in users[username])
+
+    for allocation_user_pk in failed:
+        set_allocation_user_status_to_error(allocation_user_pk)
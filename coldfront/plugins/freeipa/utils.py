@@ -16,6 +16,9 @@ FREEIPA_NOOP = import_from_settings("FREEIPA_NOOP", False)
 
 logger = logging.getLogger(__name__)
 
+ALREADY_MEMBER_MESSAGE = "This entry is already a member"
+NOT_MEMBER_MESSAGE = "This entry is not a member"
+
 
 class ApiError(Exception):
     pass
@@ -51,11 +54,21 @@ def check_ipa_group_error(res):
     err_msg = res["failed"]["member"]["user"][0][1]
 
     # Check if user is already a member
-    if err_msg == "This entry is already a member":
+    if err_msg == ALREADY_MEMBER_MESSAGE:
         raise AlreadyMemberError(err_msg)
 
     # Check if user is not a member
-    if err_msg == "This entry is not a member":
+    if err_msg == NOT_MEMBER_MESSAGE:
         raise NotMemberError(err_msg)
 
     raise ApiError(err_msg)
+
+
+def get_ipa_member_errors(res):
+    """Returns a dict mapping each user that FreeIPA failed to add to or remove
+    from the group to the error message, for a group_add_member or
+    group_remove_member response"""
+    if not res:
+        raise ValueError("Missing FreeIPA response")
+
+    return {username: err_msg for username, err_msg in res["failed"]["member"]["user"]}
@@ -20,3 +20,9 @@ class MissingQuotaError(IquotaError):
     """User request error"""
 
     pass
+
+
+class IquotaApiError(IquotaError):
+    """iquota API request failed"""
+
+    pass
@@ -0,0 +1,15 @@
+# SPDX-FileCopyrightText: (C) ColdFront Authors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+import logging
+
+from coldfront.plugins.iquota.utils import Iquota
+
+logger = logging.getLogger(__name__)
+
+
+def refresh_quotas(username, groups):
+    """Fetch a user's quotas from the iquota API and store them in the cache"""
+    Iquota(username, groups).get_quotas(refresh=True)
+    logger.info("Refreshed iquota quotas for %s", username)
@@ -2,14 +2,36 @@
 #
 # SPDX-License-Identifier: AGPL-3.0-or-later
 
+import logging
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import humanize
 import kerberos
 import requests
+from django.core.cache import cache
 
 from coldfront.core.utils.common import import_from_settings
-from coldfront.plugins.iquota.exceptions import KerberosError, MissingQuotaError
+from coldfront.plugins.iquota.exceptions import IquotaApiError, IquotaError, KerberosError, MissingQuotaError
+
+logger = logging.getLogger(__name__)
+
+# requests session shared by all lookups in the process so connections to the
+# iquota API are kept alive between page loads
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session(pool_size):
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            _session.mount("https://", adapter)
+        return _session
 
 
 class Iquota:
@@ -19,8 +41,11 @@ class Iquota:
         self.IQUOTA_API_PORT = import_from_settings("IQUOTA_API_PORT")
         self.IQUOTA_CA_CERT = import_from_settings("IQUOTA_CA_CERT")
         self.IQUOTA_KEYTAB = import_from_settings("IQUOTA_KEYTAB")
+        self.IQUOTA_CACHE_TIMEOUT = import_from_settings("IQUOTA_CACHE_TIMEOUT", 600)
+        self.IQUOTA_MAX_WORKERS = import_from_settings("IQUOTA_MAX_WORKERS", 8)
         self.username = username
         self.groups = groups
+        self.session = get_session(self.IQUOTA_MAX_WORKERS)
 
     def gssclient_token(self):
         os.environ["KRB5_CLIENT_KTNAME"] = self.IQUOTA_KEYTAB
@@ -34,6 +59,21 @@ class Iquota:
         except kerberos.GSSError:
             raise KerberosError("error initializing GSS client")
 
+    def _get(self, url):
+        """Returns the decoded JSON response of an iquota API request. Each
+        request negotiates its own token, a Negotiate token can only be used
+        once by servers with replay detection."""
+        token = self.gssclient_token()
+        try:
+            r = self.session.get(url, headers={"Authorization": "Negotiate " + token}, verify=self.IQUOTA_CA_CERT)
+            r.raise_for_status()
+            return r.json()
+        except (requests.RequestException, ValueError) as e:
+            raise IquotaApiError("iquota API request {} failed: {}".format(url, e))
+
+    def _cache_key(self, kind, name):
+        return "iquota:{}:{}".format(kind, name)
+
     def _humanize_user_quota(self, path, user_used, user_limit):
         user_quota = {
             "path": path,
@@ -45,17 +85,12 @@ class Iquota:
 
         return user_quota
 
-    def get_user_quota(self):
-        token = self.gssclient_token()
-
-        headers = {"Authorization": "Negotiate " + token}
+    def _fetch_user_quota(self):
         url = "https://{}:{}/quota?user={}".format(self.IQUOTA_API_HOST, self.IQUOTA_API_PORT, self.username)
 
-        r = requests.get(url, headers=headers, verify=self.IQUOTA_CA_CERT)
-
         try:
-            usage = r.json()[0]
-        except KeyError:
+            usage = self._get(url)[0]
+        except (KeyError, IndexError):
             raise MissingQuotaError("Missing user quota for username: %s" % (self.username))
         else:
             user_used = usage["used"]
@@ -72,18 +107,15 @@ class Iquota:
 
         return group_quota
 
-    def _get_group_quota(self, group):
-        token = self.gssclient_token()
-
-        headers = {"Authorization": "Negotiate " + token}
-
+    def _fetch_group_quota(self, group):
         url = "https://{}:{}/quota?group={}".format(self.IQUOTA_API_HOST, self.IQUOTA_API_PORT, group)
 
-        r = requests.get(url, headers=headers, verify=self.IQUOTA_CA_CERT)
-
         try:
-            usage = r.json()
+            usage = self._get(url)
             usage[0]
+        except IquotaError as e:
+            logger.error("Failed fetching iquota group quota for %s: %s", group, e.message)
+            return []
         except Exception:
             return []
 
@@ -99,14 +131,55 @@ class Iquota:
 
         return quotas
 
-    def get_group_quotas(self):
+    def _cached(self, kind, name, fetch, refresh=False):
+        """Returns the quota from the cache, fetching and caching it if it is
+        missing or refresh is True. Cached values are stored with the time they
+        were fetched. Failed and empty fetches are not cached so they are
+        retried on the next lookup."""
+        key = self._cache_key(kind, name)
+        entry = None if refresh else cache.get(key)
+        if entry is None:
+            logger.debug("Fetching iquota %s quota for %s", kind, name)
+            entry = {"fetched": time.time(), "quota": fetch()}
+            if self.IQUOTA_CACHE_TIMEOUT and entry["quota"]:
+                cache.set(key, entry, self.IQUOTA_CACHE_TIMEOUT)
+        return entry
+
+    def _cached_concurrently(self, lookups, refresh=False):
+        """Runs _cached for each (kind, name, fetch) lookup in a thread pool,
+        returning the cache entries in the same order"""
+        if not lookups:
+            return []
+
+        with ThreadPoolExecutor(max_workers=max(1, min(self.IQUOTA_MAX_WORKERS, len(lookups)))) as executor:
+            futures = [executor.submit(self._cached, kind, name, fetch, refresh) for kind, name, fetch in lookups]
+            return [future.result() for future in futures]
+
+    def _group_lookups(self):
+        return [("group", group, lambda group=group: self._fetch_group_quota(group)) for group in self.groups or []]
+
+    def _merge_group_quotas(self, group_entries):
         if not self.groups:
             return None
 
         group_quotas = {}
-        for group in self.groups:
-            group_quota = self._get_group_quota(group)
-            for g in group_quota:
+        for entry in group_entries:
+            for g in entry["quota"]:
                 group_quotas[g["path"]] = g
-
         return group_quotas
+
+    def get_quotas(self, refresh=False):
+        """Returns the user quota, group quotas and the time the oldest of them
+        was fetched. Anything not cached, or everything if refresh is True, is
+        fetched from the iquota API concurrently using one token."""
+        entries = self._cached_concurrently(
+            [("user", self.username, self._fetch_user_quota)] + self._group_lookups(), refresh
+        )
+        fetched = min(entry["fetched"] for entry in entries)
+        return entries[0]["quota"], self._merge_group_quotas(entries[1:]), fetched
+
+    def get_user_quota(self):
+        return self._cached("user", self.username, self._fetch_user_quota)["quota"]
+
+    def get_group_quotas(self):
+        return self._merge_group_quotas(self._cached_concurrently(self._group_lookups()))
@@ -2,11 +2,23 @@
 #
 # SPDX-License-Identifier: AGPL-3.0-or-later
 
+import logging
+import time
+from datetime import datetime, timezone
+
 from django.http import HttpResponse
 from django.shortcuts import render
+from django_q.tasks import async_task
 
+from coldfront.core.utils.common import import_from_settings
+from coldfront.plugins.iquota.exceptions import IquotaError
 from coldfront.plugins.iquota.utils import Iquota
 
+logger = logging.getLogger(__name__)
+
+IQUOTA_BACKGROUND_REFRESH = import_from_settings("IQUOTA_BACKGROUND_REFRESH", False)
+IQUOTA_CACHE_TIMEOUT = import_from_settings("IQUOTA_CACHE_TIMEOUT", 600)
+
 
 def get_isilon_quota(request):
     if not request.user.is_authenticated:
@@ -14,12 +26,24 @@ def get_isilon_quota(request):
 
     username = request.user.username
     groups = [group.name for group in request.user.groups.all()]
+    refresh = request.POST.get("refresh") == "true"
 
     iquota = Iquota(username, groups)
+    try:
+        user_quota, group_quotas, fetched = iquota.get_quotas(refresh=refresh)
+    except IquotaError as e:
+        logger.error("Failed fetching iquota quotas for %s: %s", username, e.message)
+        return HttpResponse("Quota information is unavailable, please try again later.", status=503)
+
+    # Serve cached quotas and refresh them in the background once they are
+    # halfway to expiring so the next request does not wait on the iquota API
+    if IQUOTA_BACKGROUND_REFRESH and not refresh and time.time() - fetched > IQUOTA_CACHE_TIMEOUT / 2:
+        async_task("coldfront.plugins.iquota.tasks.refresh_quotas", username, groups)
 
     context = {
-        "user_quota": iquota.get_user_quota(),
-        "group_quotas": iquota.get_group_quotas(),
+        "user_quota": user_quota,
+        "group_quotas": group_quotas,
+        "fetched": datetime.fromtimestamp(fetched, tz=timezone.utc),
     }
 
     return render(request, "iquota/iquota.html", context)
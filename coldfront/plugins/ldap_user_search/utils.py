@@ -2,18 +2,75 @@
 #
 # SPDX-License-Identifier: AGPL-3.0-or-later
 
-import json
 import logging
 import ssl
+import threading
 
 import ldap.filter
 from ldap3 import AUTO_BIND_TLS_BEFORE_BIND, SASL, Connection, Server, Tls, get_config_parameter, set_config_parameter
+from ldap3.core.exceptions import LDAPCommunicationError
+from ldap3.utils.conv import format_json
 
 from coldfront.core.user.utils import UserSearch
 from coldfront.core.utils.common import import_from_settings
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_ATTRIBUTE_MAP = {
+    "username": "uid",
+    "last_name": "sn",
+    "first_name": "givenName",
+    "email": "mail",
+}
+
+# Servers are shared by all instances in the process, connections are shared
+# by all instances in the same thread as ldap3 sync connections are not thread
+# safe. Both are keyed by the connection settings.
+_servers = {}
+_servers_lock = threading.Lock()
+_connections = threading.local()
+
+
+def exclude_attributes_from_check(attribute_map=None):
+    """Add the mapped LDAP attributes to ldap3's ATTRIBUTES_EXCLUDED_FROM_CHECK
+    config. This is global to ldap3 so only attributes not already present are
+    added."""
+    if attribute_map is None:
+        attribute_map = import_from_settings("LDAP_USER_SEARCH_ATTRIBUTE_MAP", DEFAULT_ATTRIBUTE_MAP)
+
+    attrs = list(get_config_parameter("ATTRIBUTES_EXCLUDED_FROM_CHECK"))
+    missing = [attr for attr in attribute_map.values() if attr not in attrs]
+    if missing:
+        set_config_parameter("ATTRIBUTES_EXCLUDED_FROM_CHECK", attrs + missing)
+
+
+# Set once at startup rather than on every search
+exclude_attributes_from_check()
+
+
+def normalize_entry_value(value):
+    """Convert an ldap3 attribute value to the JSON type mapping callbacks got
+    when entries were read with entry_to_json, e.g. bytes and datetimes become
+    str"""
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [normalize_entry_value(v) for v in value]
+    if isinstance(value, dict):
+        return {k: normalize_entry_value(v) for k, v in value.items()}
+    return format_json(value)
+
+
+def entry_to_dict(entry):
+    """Returns a dict mapping each attribute of an ldap3 entry to the list of
+    its values, normalized as entry_to_json did without the JSON round trip"""
+    entry_dict = {}
+    for attr, values in entry.entry_attributes_as_dict.items():
+        if not isinstance(values, (list, tuple)):
+            values = [values]
+        entry_dict[attr] = normalize_entry_value(values)
+    return entry_dict
+
 
 class LDAPUserSearch(UserSearch):
     search_source = "LDAP"
@@ -34,17 +91,28 @@ class LDAPUserSearch(UserSearch):
         self.LDAP_CACERT_FILE = import_from_settings("LDAP_USER_SEARCH_CACERT_FILE", None)
         self.LDAP_CERT_VALIDATE_MODE = import_from_settings("LDAP_USER_SEARCH_CERT_VALIDATE_MODE", None)
         self.USERNAME_ONLY_ATTR = import_from_settings("LDAP_USER_SEARCH_USERNAME_ONLY_ATTR", "username")
-        self.ATTRIBUTE_MAP = import_from_settings(
-            "LDAP_USER_SEARCH_ATTRIBUTE_MAP",
-            {
-                "username": "uid",
-                "last_name": "sn",
-                "first_name": "givenName",
-                "email": "mail",
-            },
-        )
+        self.ATTRIBUTE_MAP = import_from_settings("LDAP_USER_SEARCH_ATTRIBUTE_MAP", DEFAULT_ATTRIBUTE_MAP)
         self.MAPPING_CALLBACK = import_from_settings("LDAP_USER_SEARCH_MAPPING_CALLBACK", self.parse_ldap_entry)
+        self.USERNAMES_CHUNK_SIZE = import_from_settings("LDAP_USER_SEARCH_USERNAMES_CHUNK_SIZE", 100)
 
+        self.connection_key = (
+            self.LDAP_SERVER_URI,
+            self.LDAP_BIND_DN,
+            self.LDAP_BIND_PASSWORD,
+            self.LDAP_CONNECT_TIMEOUT,
+            self.LDAP_USE_SSL,
+            self.LDAP_USE_TLS,
+            self.LDAP_SASL_MECHANISM,
+            self.LDAP_SASL_CREDENTIALS,
+            self.LDAP_PRIV_KEY_FILE,
+            self.LDAP_CERT_FILE,
+            self.LDAP_CACERT_FILE,
+            self.LDAP_CERT_VALIDATE_MODE,
+        )
+        self.server = self.get_server()
+        self.conn = self.get_connection()
+
+    def create_server(self):
         tls = None
         if self.LDAP_USE_TLS:
             ldap_cert_validate_mode = ssl.CERT_NONE
@@ -60,9 +128,18 @@ class LDAPUserSearch(UserSearch):
                 validate=ldap_cert_validate_mode,
             )
 
-        self.server = Server(
+        return Server(
             self.LDAP_SERVER_URI, use_ssl=self.LDAP_USE_SSL, connect_timeout=self.LDAP_CONNECT_TIMEOUT, tls=tls
         )
+
+    def get_server(self):
+        """Returns the server shared by all instances with the same settings"""
+        with _servers_lock:
+            if self.connection_key not in _servers:
+                _servers[self.connection_key] = self.create_server()
+            return _servers[self.connection_key]
+
+    def create_connection(self):
         auto_bind = True
         if self.LDAP_USE_TLS:
             auto_bind = AUTO_BIND_TLS_BEFORE_BIND
@@ -71,7 +148,27 @@ class LDAPUserSearch(UserSearch):
             conn_params["sasl_mechanism"] = self.LDAP_SASL_MECHANISM
             conn_params["sasl_credentials"] = self.LDAP_SASL_CREDENTIALS
             conn_params["authentication"] = SASL
-        self.conn = Connection(self.server, self.LDAP_BIND_DN, self.LDAP_BIND_PASSWORD, **conn_params)
+        return Connection(self.server, self.LDAP_BIND_DN, self.LDAP_BIND_PASSWORD, **conn_params)
+
+    def get_connection(self, reconnect=False):
+        """Returns the bound connection shared by all instances in this thread,
+        binding a new one if there is none or it has been closed"""
+        if not hasattr(_connections, "by_key"):
+            _connections.by_key = {}
+
+        conn = _connections.by_key.get(self.connection_key)
+        if conn is not None and (reconnect or conn.closed):
+            try:
+                conn.unbind()
+            except Exception as e:
+                logger.debug("Failed to unbind stale LDAP connection: %s", e)
+            conn = None
+
+        if conn is None:
+            conn = self.create_connection()
+            _connections.by_key[self.connection_key] = conn
+
+        return conn
 
     @staticmethod
     def parse_ldap_entry(attribute_map, entry_dict):
@@ -83,9 +180,6 @@ class LDAPUserSearch(UserSearch):
     def search_a_user(self, user_search_string=None, search_by="all_fields"):
         size_limit = 50
         ldap_attrs = list(self.ATTRIBUTE_MAP.values())
-        attrs = get_config_parameter("ATTRIBUTES_EXCLUDED_FROM_CHECK")
-        attrs.extend(ldap_attrs)
-        set_config_parameter("ATTRIBUTES_EXCLUDED_FROM_CHECK", attrs)
         if user_search_string and search_by == "all_fields":
             filter = ldap.filter.filter_format(
                 f"(|({ldap_attrs[0]}=*%s*)({ldap_attrs[1]}=*%s*)({ldap_attrs[2]}=*%s*)({ldap_attrs[3]}=*%s*))",
@@ -101,6 +195,28 @@ class LDAPUserSearch(UserSearch):
         else:
             filter = "(objectclass=person)"
 
+        users = self.run_search(filter, size_limit)
+        logger.info("LDAP user search for %s found %s results", user_search_string, len(users))
+        return users
+
+    def search_usernames(self, usernames):
+        """Look up many usernames with one OR filter per chunk of
+        LDAP_USER_SEARCH_USERNAMES_CHUNK_SIZE usernames"""
+        attr = self.ATTRIBUTE_MAP[self.USERNAME_ONLY_ATTR]
+        users = []
+        for i in range(0, len(usernames), self.USERNAMES_CHUNK_SIZE):
+            chunk = usernames[i : i + self.USERNAMES_CHUNK_SIZE]
+            filter = "(|{})".format(
+                "".join(ldap.filter.filter_format(f"({attr}=%s)", [username]) for username in chunk)
+            )
+            users.extend(self.run_search(filter, len(chunk)))
+
+        users.sort(key=lambda user: user.get("username") or "")
+        logger.info("LDAP user search for %s usernames found %s results", len(usernames), len(users))
+        return users
+
+    def run_search(self, filter, size_limit):
+        ldap_attrs = list(self.ATTRIBUTE_MAP.values())
         searchParameters = {
             "search_base": self.LDAP_USER_SEARCH_BASE,
             "search_filter": filter,
@@ -108,13 +224,19 @@ class LDAPUserSearch(UserSearch):
             "size_limit": size_limit,
         }
         logger.debug(f"search params: {searchParameters}")
-        self.conn.search(**searchParameters)
+        try:
+            self.conn.search(**searchParameters)
+        except LDAPCommunicationError as e:
+            # shared connection was dropped by the server, rebind and retry once
+            logger.info("LDAP connection lost, reconnecting: %s", e)
+            self.conn = self.get_connection(reconnect=True)
+            self.conn.search(**searchParameters)
+
         users = []
         for idx, entry in enumerate(self.conn.entries, 1):
-            entry_dict = json.loads(entry.entry_to_json()).get("attributes")
+            entry_dict = entry_to_dict(entry)
             logger.debug(f"Entry dict: {entry_dict}")
             user_dict = self.MAPPING_CALLBACK(self.ATTRIBUTE_MAP, entry_dict)
             user_dict["source"] = self.search_source
             users.append(user_dict)
-        logger.info("LDAP user search for %s found %s results", user_search_string, len(users))
         return users
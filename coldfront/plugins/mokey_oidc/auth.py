@@ -2,9 +2,11 @@
 #
 # SPDX-License-Identifier: AGPL-3.0-or-later
 
+import hashlib
 import logging
 
 from django.contrib.auth.models import Group
+from django.core.cache import cache
 from mozilla_django_oidc.auth import OIDCAuthenticationBackend
 
 from coldfront.core.utils.common import import_from_settings
@@ -14,19 +16,45 @@ logger = logging.getLogger(__name__)
 PI_GROUP = import_from_settings("MOKEY_OIDC_PI_GROUP", "pi")
 ALLOWED_GROUPS = import_from_settings("MOKEY_OIDC_ALLOWED_GROUPS", [])
 DENY_GROUPS = import_from_settings("MOKEY_OIDC_DENY_GROUPS", [])
+GROUP_SYNC_CACHE_TIMEOUT = import_from_settings("MOKEY_OIDC_GROUP_SYNC_CACHE_TIMEOUT", 3600)
 
 
 class OIDCMokeyAuthenticationBackend(OIDCAuthenticationBackend):
+    def _groups_cache_key(self, user):
+        return "mokey_oidc_groups:{}".format(user.pk)
+
+    def _groups_hash(self, groups):
+        return hashlib.sha256("\n".join(sorted(set(groups))).encode("utf-8")).hexdigest()
+
+    def _groups_unchanged(self, user, groups):
+        """Returns True if the groups claim matches the one synced at the last
+        login, in which case there is nothing to sync"""
+        if not GROUP_SYNC_CACHE_TIMEOUT or user.pk is None:
+            return False
+        return cache.get(self._groups_cache_key(user)) == self._groups_hash(groups)
+
+    def _groups_synced(self, user, groups):
+        if GROUP_SYNC_CACHE_TIMEOUT:
+            cache.set(self._groups_cache_key(user), self._groups_hash(groups), GROUP_SYNC_CACHE_TIMEOUT)
+
     def _sync_groups(self, user, groups):
-        is_pi = False
-        user.groups.clear()
-        for group_name in groups:
-            group, created = Group.objects.get_or_create(name=group_name)
-            user.groups.add(group)
-            if group_name == PI_GROUP:
-                is_pi = True
+        group_names = set(groups)
 
-        user.userprofile.is_pi = is_pi
+        groups_by_name = {group.name: group for group in Group.objects.filter(name__in=group_names)}
+        missing_names = group_names - groups_by_name.keys()
+        if missing_names:
+            # another login may create the same groups concurrently
+            Group.objects.bulk_create([Group(name=name) for name in missing_names], ignore_conflicts=True)
+            groups_by_name.update({group.name: group for group in Group.objects.filter(name__in=missing_names)})
+
+        group_pks = {group.pk for group in groups_by_name.values()}
+        current_group_pks = set(user.groups.values_list("pk", flat=True))
+        if current_group_pks - group_pks:
+            user.groups.remove(*(current_group_pks - group_pks))
+        if group_pks - current_group_pks:
+            user.groups.add(*(group_pks - current_group_pks))
+
+        user.userprofile.is_pi = PI_GROUP in group_names
 
     def _parse_groups_from_claims(self, claims):
         groups = claims.get("groups", []) or []
@@ -58,6 +86,7 @@ class OIDCMokeyAuthenticationBackend(OIDCAuthenticationBackend):
         self._sync_groups(user, groups)
 
         user.save()
+        self._groups_synced(user, groups)
 
         return user
 
@@ -76,9 +105,13 @@ class OIDCMokeyAuthenticationBackend(OIDCAuthenticationBackend):
             )
 
         groups = self._parse_groups_from_claims(claims)
-        self._sync_groups(user, groups)
+        groups_unchanged = self._groups_unchanged(user, groups)
+        if not groups_unchanged:
+            self._sync_groups(user, groups)
 
         user.save()
+        if not groups_unchanged:
+            self._groups_synced(user, groups)
 
         return user
 
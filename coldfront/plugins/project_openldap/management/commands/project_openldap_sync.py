@@ -5,8 +5,13 @@
 """Coldfront project_openldap plugin - django management command -  project_openldap_sync.py"""
 
 import logging
+import math
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 
 from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
 
 from coldfront.core.project.models import (
     Project,
@@ -38,7 +43,10 @@ from coldfront.plugins.project_openldap.utils import (
     ldapsearch_check_project_dn,
     ldapsearch_get_description,
     ldapsearch_get_posixgroup_memberuids,
+    ldapsearch_get_posixgroups,
     move_dn_in_openldap,
+    normalize_dn,
+    openldap_session,
     remove_members_from_openldap_posixgroup,
     update_posixgroup_description_in_openldap,
 )
@@ -69,6 +77,43 @@ PROJECTUSER_STATUS_CHOICE_ACTIVE = ProjectUserStatusChoice.objects.get(name="Act
 # where DNs are passed to functions it is often to self.stdout.write before an action
 
 
+class ProjectOutputCapture:
+    """Wraps the command's stdout so that writes and summary counters can be captured per thread,
+    allowing projects checked by parallel workers to be written out in project order"""
+
+    def __init__(self, stdout):
+        self.stdout = stdout
+        self.local = threading.local()
+
+    def start(self):
+        self.local.buffer = []
+        self.local.counter = Counter()
+
+    def stop(self):
+        buffer, counter = self.local.buffer, self.local.counter
+        self.local.buffer = None
+        self.local.counter = None
+        return buffer, counter
+
+    def write(self, msg="", *args, **kwargs):
+        buffer = getattr(self.local, "buffer", None)
+        if buffer is None:
+            return self.stdout.write(msg, *args, **kwargs)
+        buffer.append((msg, args, kwargs))
+
+    def replay(self, buffer):
+        for msg, args, kwargs in buffer:
+            self.stdout.write(msg, *args, **kwargs)
+
+    def count(self, key, value=1):
+        counter = getattr(self.local, "counter", None)
+        if counter is not None:
+            counter[key] += value
+
+    def __getattr__(self, name):
+        return getattr(self.stdout, name)
+
+
 # --------------------------------------------------------------------------------------------------------
 class Command(BaseCommand):
     help = "Sync projects and memberUids in OpenLDAP (from Coldfront)"
@@ -110,6 +155,19 @@ class Command(BaseCommand):
             help="Skip projects with New or Active status in Coldfront",
             action="store_true",
         )
+        parser.add_argument(
+            "-b",
+            "--prefetch",
+            help="With --all, fetch every OpenLDAP posixGroup and Coldfront membership up front and compare in memory",
+            action="store_true",
+        )
+        parser.add_argument(
+            "-w",
+            "--workers",
+            help="With --all, number of parallel workers each with their own OpenLDAP connection (default: 1)",
+            type=int,
+            default=1,
+        )
 
     def local_get_project_by_code(self, project_group):
         try:
@@ -119,6 +177,7 @@ class Command(BaseCommand):
             return None
 
     def handle_missing_project_in_openldap_new_active(self, project, sync=False):
+        self.stdout.count("missing in OpenLDAP")
         # if sync, can write
         if sync:
             # simply add the project using tasks.py function
@@ -130,6 +189,7 @@ class Command(BaseCommand):
             )
 
     def handle_missing_project_in_openldap_archive(self, project, project_dn, sync=False, write_to_archive=False):
+        self.stdout.count("missing in OpenLDAP")
         # setup vars before anything else
         try:
             # create ou vars
@@ -248,7 +308,7 @@ class Command(BaseCommand):
             PROJECT_STATUS_CHOICE_ACTIVE,
         ]:
             # fetch current description from project_dn
-            fetched_description = ldapsearch_get_description(project_dn)
+            fetched_description = self.local_get_description(project_dn)
             if new_description == fetched_description:
                 self.stdout.write("Description is up-to-date.")
             if new_description != fetched_description:
@@ -263,7 +323,7 @@ class Command(BaseCommand):
 
         if project.status_id in [PROJECT_STATUS_CHOICE_ARCHIVED]:
             # fetch current description from archive DN
-            fetched_description = ldapsearch_get_description(archive_dn)
+            fetched_description = self.local_get_description(archive_dn)
             if new_description == fetched_description:
                 self.stdout.write("Description is up-to-date.")
             if new_description != fetched_description:
@@ -281,8 +341,50 @@ class Command(BaseCommand):
                     update_posixgroup_description_in_openldap(archive_dn, new_description, write=True)
                     self.stdout.write(f"{new_description}")
 
+    def local_prefetch_all(self, projects):
+        """Fetch every posixGroup in the project (and archive) OU and all active Coldfront memberships up front"""
+        posixgroups = ldapsearch_get_posixgroups(PROJECT_OPENLDAP_OU)
+        if posixgroups is None:
+            self.stdout.write(f"ERROR: could not prefetch posixGroups from {PROJECT_OPENLDAP_OU} - HALTING")
+            raise CommandError
+
+        if PROJECT_OPENLDAP_ARCHIVE_OU:
+            archived_posixgroups = ldapsearch_get_posixgroups(PROJECT_OPENLDAP_ARCHIVE_OU)
+            if archived_posixgroups is None:
+                self.stdout.write(f"ERROR: could not prefetch posixGroups from {PROJECT_OPENLDAP_ARCHIVE_OU} - HALTING")
+                raise CommandError
+            posixgroups.update(archived_posixgroups)
+
+        members = {}
+        queryset = ProjectUser.objects.filter(
+            project__in=projects, status_id=PROJECTUSER_STATUS_CHOICE_ACTIVE
+        ).values_list("project_id", "user__username")
+        for project_pk, username in queryset:
+            if username not in PROJECT_OPENLDAP_EXCLUDE_USERS:
+                members.setdefault(project_pk, []).append(username)
+
+        self.prefetched = {
+            "posixgroups": posixgroups,
+            "members": {project_pk: tuple(usernames) for project_pk, usernames in members.items()},
+        }
+        logger.info("Prefetched %s OpenLDAP posixGroups", len(posixgroups))
+
+    def local_check_project_dn(self, dn):
+        if self.prefetched is None:
+            return ldapsearch_check_project_dn(dn)
+        return normalize_dn(dn) in self.prefetched["posixgroups"]
+
+    def local_get_description(self, dn):
+        if self.prefetched is None:
+            return ldapsearch_get_description(dn)
+        posixgroup = self.prefetched["posixgroups"].get(normalize_dn(dn))
+        return posixgroup["description"] if posixgroup else None
+
     # get active users from the coldfront django project
     def local_get_cf_django_members(self, project_pk):
+        if self.prefetched is not None:
+            return self.prefetched["members"].get(project_pk, ())
+
         queryset = ProjectUser.objects.filter(project_id=project_pk, status_id=PROJECTUSER_STATUS_CHOICE_ACTIVE)
         usernames = [
             user.user.username for user in queryset if user.user.username not in PROJECT_OPENLDAP_EXCLUDE_USERS
@@ -290,6 +392,10 @@ class Command(BaseCommand):
         return tuple(usernames)
 
     def local_get_openldap_members(self, dn):
+        if self.prefetched is not None:
+            posixgroup = self.prefetched["posixgroups"].get(normalize_dn(dn))
+            return posixgroup["memberUids"] if posixgroup else None
+
         entries = ldapsearch_get_posixgroup_memberuids(dn)
 
         if entries is None:
@@ -300,6 +406,22 @@ class Command(BaseCommand):
             members.extend(entry.memberUid.values)
         return tuple(members)
 
+    def local_write_member_change_result(self, action, result, sync=False):
+        if result is None:
+            self.stdout.write(f"SYNC {sync} - {action} members FAILED - could not connect to OpenLDAP")
+            self.stdout.count("member changes failed")
+            return
+        self.stdout.count(f"members {action.lower()}", len(result["succeeded"]))
+        self.stdout.count("member changes failed", len(result["failed"]))
+        if len(result["succeeded"]) > 0:
+            self.stdout.write(f"SYNC {sync} - {action} members {tuple(result['succeeded'])}")
+        if len(result["skipped"]) > 0:
+            self.stdout.write(
+                f"SYNC {sync} - Unchanged members (already present or missing) {tuple(result['skipped'])}"
+            )
+        if len(result["failed"]) > 0:
+            self.stdout.write(f"SYNC {sync} - FAILED {action} members {tuple(result['failed'])}")
+
     def sync_members(
         self,
         project,
@@ -349,8 +471,8 @@ class Command(BaseCommand):
             if sync:
                 if ldapsearch_project_result:
                     try:
-                        remove_members_from_openldap_posixgroup(member_change_dn, missing_in_cf, write=True)
-                        self.stdout.write(f"SYNC {sync} - Removed members {missing_in_cf}")
+                        result = remove_members_from_openldap_posixgroup(member_change_dn, missing_in_cf, write=True)
+                        self.local_write_member_change_result("Removed", result, sync)
                     except Exception as e:
                         self.stdout.write(
                             f"Exception Removing members {missing_in_cf} in OpenLDAP DN {member_change_dn}: {e}"
@@ -362,8 +484,10 @@ class Command(BaseCommand):
                         )
                     elif write_to_archive:
                         try:
-                            remove_members_from_openldap_posixgroup(member_change_dn, missing_in_cf, write=True)
-                            self.stdout.write(f"SYNC {sync} - Removed members {missing_in_cf}")
+                            result = remove_members_from_openldap_posixgroup(
+                                member_change_dn, missing_in_cf, write=True
+                            )
+                            self.local_write_member_change_result("Removed", result, sync)
                         except Exception as e:
                             self.stdout.write(
                                 f"Exception Removing members {missing_in_cf} in OpenLDAP DN {member_change_dn}: {e}"
@@ -378,8 +502,8 @@ class Command(BaseCommand):
             if sync:
                 if ldapsearch_project_result:
                     try:
-                        add_members_to_openldap_posixgroup(member_change_dn, missing_in_openldap, write=True)
-                        self.stdout.write(f"SYNC {sync} - Added members {missing_in_openldap}")
+                        result = add_members_to_openldap_posixgroup(member_change_dn, missing_in_openldap, write=True)
+                        self.local_write_member_change_result("Added", result, sync)
                     except Exception as e:
                         self.stdout.write(
                             f"Exception Adding members {missing_in_openldap} in OpenLDAP DN {member_change_dn}: {e}"
@@ -391,8 +515,10 @@ class Command(BaseCommand):
                         )
                     elif write_to_archive:
                         try:
-                            add_members_to_openldap_posixgroup(member_change_dn, missing_in_openldap, write=True)
-                            self.stdout.write(f"SYNC {sync} - Added members {missing_in_openldap}")
+                            result = add_members_to_openldap_posixgroup(
+                                member_change_dn, missing_in_openldap, write=True
+                            )
+                            self.local_write_member_change_result("Added", result, sync)
                         except Exception as e:
                             self.stdout.write(
                                 f"Exception Adding members {missing_in_openldap} in OpenLDAP DN {member_change_dn}: {e}"
@@ -407,14 +533,17 @@ class Command(BaseCommand):
         update_description=False,
         skip_archived=False,
         skip_newactive=False,
+        project=None,
     ):
         # 1) do some setup and checks
-        project = self.local_get_project_by_code(project_group)
+        if project is None:
+            project = self.local_get_project_by_code(project_group)
         if not project:
             return
 
         # skip archived projects if option supplied
         if skip_archived and project.status_id in [PROJECT_STATUS_CHOICE_ARCHIVED]:
+            self.stdout.count("skipped")
             self.stdout.write("--------------------")
             self.stdout.write(
                 f"Requested skip_archived, not processing archived project status for Project {project.project_code}"
@@ -427,6 +556,7 @@ class Command(BaseCommand):
             PROJECT_STATUS_CHOICE_NEW,
             PROJECT_STATUS_CHOICE_ACTIVE,
         ]:
+            self.stdout.count("skipped")
             self.stdout.write("--------------------")
             self.stdout.write(
                 f"Requested skip_newactive, not processing new or active project status for Project {project.project_code}"
@@ -449,11 +579,11 @@ class Command(BaseCommand):
         self.stdout.write("")
 
         # does project exist in project OU
-        ldapsearch_project_result = ldapsearch_check_project_dn(project_dn)
+        ldapsearch_project_result = self.local_check_project_dn(project_dn)
         self.stdout.write(f"search project OU result: {ldapsearch_project_result}")
         # does project exist in archive OU
         if PROJECT_OPENLDAP_ARCHIVE_OU:
-            ldapsearch_project_result_archive = ldapsearch_check_project_dn(project_archive_dn)
+            ldapsearch_project_result_archive = self.local_check_project_dn(project_archive_dn)
             self.stdout.write(f"search project archive OU result: {ldapsearch_project_result_archive}")
         else:
             self.stdout.write("search project archive OU result: N/A - PROJECT_OPENLDAP_ARCHIVE_OU is not set")
@@ -584,37 +714,116 @@ class Command(BaseCommand):
         update_description=False,
         skip_archived=False,
         skip_newactive=False,
+        prefetch=False,
+        workers=1,
     ):
-        projects = Project.objects.filter(
-            status_id__in=[
-                PROJECT_STATUS_CHOICE_NEW,
-                PROJECT_STATUS_CHOICE_ACTIVE,
-                PROJECT_STATUS_CHOICE_ARCHIVED,
-            ]
-        ).order_by("id")
+        projects = (
+            Project.objects.filter(
+                status_id__in=[
+                    PROJECT_STATUS_CHOICE_NEW,
+                    PROJECT_STATUS_CHOICE_ACTIVE,
+                    PROJECT_STATUS_CHOICE_ARCHIVED,
+                ]
+            )
+            .select_related("pi")
+            .order_by("id")
+        )
 
         if len(projects) == 0:
             self.stdout.write("No projects found by loop_all_projects - EXITING")
             return
 
-        for project in projects:
+        if prefetch:
+            self.local_prefetch_all(projects)
+
+        check_args = (sync, write_to_archive, update_description, skip_archived, skip_newactive, prefetch)
+        summary = Counter()
+
+        if workers <= 1:
+            for project in projects:
+                self.replay_captured_project(self.local_check_captured_project(project, *check_args), summary)
+        else:
+            # contiguous partitions, one per worker, so output can be written in project order
+            projects = list(projects)
+            partition_size = math.ceil(len(projects) / workers)
+            partitions = [projects[i : i + partition_size] for i in range(0, len(projects), partition_size)]
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(self.local_check_partition, partition, check_args) for partition in partitions
+                ]
+                for future in futures:
+                    for captured in future.result():
+                        self.replay_captured_project(captured, summary)
+
+        self.stdout.write("--------------------")
+        self.stdout.write(
+            f"SUMMARY: projects processed: {summary['processed']}, skipped: {summary['skipped']}, "
+            f"missing in OpenLDAP: {summary['missing in OpenLDAP']}, members added: {summary['members added']}, "
+            f"members removed: {summary['members removed']}, member changes failed: {summary['member changes failed']}"
+        )
+
+        return True
+
+    def replay_captured_project(self, captured, summary):
+        """Write out a project's captured output and add its counters to summary, raising the
+        exception the project's check failed with, if any, once its output is written"""
+        buffer, counter, error = captured
+        self.stdout.replay(buffer)
+        summary.update(counter)
+        if error is not None:
+            raise error
+
+    def local_check_partition(self, partition, check_args):
+        """Check a partition of projects in a worker thread, with its own OpenLDAP connection.
+        Stops at the first project that fails, which is the last one returned."""
+        results = []
+        try:
+            with openldap_session():
+                for project in partition:
+                    results.append(self.local_check_captured_project(project, *check_args))
+                    if results[-1][2] is not None:
+                        break
+        finally:
+            connections.close_all()
+        return results
+
+    def local_check_captured_project(
+        self,
+        project,
+        sync=False,
+        write_to_archive=False,
+        update_description=False,
+        skip_archived=False,
+        skip_newactive=False,
+        prefetch=False,
+    ):
+        """Check a single project, capturing its output and counters. Returns the captured output,
+        the counters and the exception the check failed with or None, so a failure is written out
+        in project order along with the output captured before it."""
+        self.stdout.start()
+        try:
+            self.stdout.count("processed")
             if hasattr(project, "project_code") and project.project_code:
-                project_code = project.project_code
                 self.sync_check_project(
-                    project_code,
+                    project.project_code,
                     sync,
                     write_to_archive,
                     update_description,
                     skip_archived,
                     skip_newactive,
+                    project=project if prefetch else None,
                 )
             else:
                 # won't continue to process so self.stdout.write seperator here
+                self.stdout.count("skipped")
                 self.stdout.write("--------------------")
                 self.stdout.write(f"Project with pk in Coldfront django {project.pk} - has no project_code")
                 self.stdout.write("NOT PROCESSING!")
+        except Exception as e:
+            self.stdout.write(f"FAILED checking project with pk in Coldfront django {project.pk}: {e}")
+            return (*self.stdout.stop(), e)
 
-        return True
+        return (*self.stdout.stop(), None)
 
     # --------------------------------
 
@@ -656,29 +865,42 @@ class Command(BaseCommand):
             logger.info("Filtering output by project-group: %s", options["projectgroup"])
             self.filter_group = options["projectgroup"]
 
+        self.stdout = ProjectOutputCapture(self.stdout)
+
+        self.workers = max(1, options["workers"])
+
+        self.prefetched = None
+        self.prefetch = False
+        if options["prefetch"]:
+            self.prefetch = True
+
         self.all = False
         if options["all"]:
             self.all = True
             logger.warning("Syncing ALL OpenLDAP groups with ColdFront")
 
-        if self.filter_group:
-            self.sync_check_project(
-                self.filter_group,
-                self.sync,
-                self.write_archive,
-                self.update_description,
-                self.skip_archived,
-                self.skip_newactive,
-            )
+        # share a single OpenLDAP connection across all projects checked
+        with openldap_session():
+            if self.filter_group:
+                self.sync_check_project(
+                    self.filter_group,
+                    self.sync,
+                    self.write_archive,
+                    self.update_description,
+                    self.skip_archived,
+                    self.skip_newactive,
+                )
 
-        if self.all:
-            self.loop_all_projects(
-                self.sync,
-                self.write_archive,
-                self.update_description,
-                self.skip_archived,
-                self.skip_newactive,
-            )
+            if self.all:
+                self.loop_all_projects(
+                    self.sync,
+                    self.write_archive,
+                    self.update_description,
+                    self.skip_archived,
+                    self.skip_newactive,
+                    self.prefetch,
+                    self.workers,
+                )
 
         if not self.filter_group and not self.all:
             self.stdout.write("")
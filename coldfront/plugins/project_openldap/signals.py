@@ -7,7 +7,6 @@
 import logging
 
 from django.dispatch import receiver
-from django_q.tasks import async_task
 
 from coldfront.core.project.signals import (
     project_activate_user,
@@ -23,6 +22,7 @@ from coldfront.core.project.views import (
     ProjectRemoveUsersView,
     ProjectUpdateView,
 )
+from coldfront.core.utils.tasks import dispatch_task
 
 logger = logging.getLogger(__name__)
 
@@ -31,32 +31,32 @@ logger = logging.getLogger(__name__)
 @receiver(project_new, sender=ProjectCreateView)
 def send_project_new_signal(sender, **kwargs):
     project_obj = kwargs.get("project_obj")
-    async_task("coldfront.plugins.project_openldap.tasks.add_project", project_obj)
+    dispatch_task("coldfront.plugins.project_openldap.tasks.add_project", project_obj.pk, priority="high")
 
 
 # Archive a project
 @receiver(project_archive, sender=ProjectArchiveProjectView)
 def send_project_archive_signal(sender, **kwargs):
     project_obj = kwargs.get("project_obj")
-    async_task("coldfront.plugins.project_openldap.tasks.remove_project", project_obj)
+    dispatch_task("coldfront.plugins.project_openldap.tasks.remove_project", project_obj.pk)
 
 
 # Update a project (title)
 @receiver(project_update, sender=ProjectUpdateView)
 def send_project_update_signal(sender, **kwargs):
     project_obj = kwargs.get("project_obj")
-    async_task("coldfront.plugins.project_openldap.tasks.update_project", project_obj)
+    dispatch_task("coldfront.plugins.project_openldap.tasks.update_project", project_obj.pk, priority="low")
 
 
 # Add project user
 @receiver(project_activate_user, sender=ProjectAddUsersView)
 def send_project_activate_user_signal(sender, **kwargs):
     project_user_pk = kwargs.get("project_user_pk")
-    async_task("coldfront.plugins.project_openldap.tasks.add_user_project", project_user_pk)
+    dispatch_task("coldfront.plugins.project_openldap.tasks.add_user_project", project_user_pk, priority="high")
 
 
 # Remove project user
 @receiver(project_remove_user, sender=ProjectRemoveUsersView)
 def send_project_remove_user_signal(sender, **kwargs):
     project_user_pk = kwargs.get("project_user_pk")
-    async_task("coldfront.plugins.project_openldap.tasks.remove_user_project", project_user_pk)
+    dispatch_task("coldfront.plugins.project_openldap.tasks.remove_user_project", project_user_pk, priority="high")
@@ -6,8 +6,9 @@
 
 import logging
 
-from coldfront.core.project.models import ProjectUser
+from coldfront.core.project.models import Project, ProjectUser
 from coldfront.core.utils.common import import_from_settings
+from coldfront.core.utils.tasks import load_task_object
 from coldfront.plugins.project_openldap.utils import (
     add_members_to_openldap_posixgroup,
     add_per_project_ou_to_openldap,
@@ -19,6 +20,7 @@ from coldfront.plugins.project_openldap.utils import (
     construct_project_ou_description,
     construct_project_posixgroup_description,
     move_dn_in_openldap,
+    openldap_session,
     remove_dn_from_openldap,
     remove_members_from_openldap_posixgroup,
     update_posixgroup_description_in_openldap,
@@ -39,8 +41,10 @@ PROJECT_OPENLDAP_REMOVE_PROJECT = import_from_settings(
 PROJECT_OPENLDAP_ARCHIVE_OU = import_from_settings("PROJECT_OPENLDAP_ARCHIVE_OU")
 
 
-def add_project(project_obj):
+@openldap_session()
+def add_project(project_pk):
     """Method to add project to OpenLDAP - uses signals for project creation"""
+    project_obj = load_task_object(Project, project_pk)
 
     # if project_code not enabled or None or empty, print appropriate message and bail out to avoid adding it to OpenLDAP
     if not hasattr(project_obj, "project_code"):
@@ -84,8 +88,10 @@ def add_project(project_obj):
 
 
 # Coldfront archive project action
-def remove_project(project_obj):
+@openldap_session()
+def remove_project(project_pk):
     """Method to remove project from OpenLDAP OR place in archive - uses signals for Coldfront project archive action"""
+    project_obj = load_task_object(Project, project_pk)
 
     ou_dn = construct_ou_dn_str(project_obj)
 
@@ -105,8 +111,10 @@ def remove_project(project_obj):
         move_dn_in_openldap(ou_dn, relative_dn, PROJECT_OPENLDAP_ARCHIVE_OU)
 
 
-def update_project(project_obj):
+@openldap_session()
+def update_project(project_pk):
     """Method to update project [title] in OpenLDAP - uses signals for project update"""
+    project_obj = load_task_object(Project, project_pk)
     dn = construct_dn_str(project_obj)
     logger.info(" ATTEMPTING PROJECT UPDATE IN TASKS.PY ")
     openldap_description = construct_project_posixgroup_description(project_obj)
@@ -116,6 +124,7 @@ def update_project(project_obj):
     update_posixgroup_description_in_openldap(dn, openldap_description)
 
 
+@openldap_session()
 def add_user_project(project_user_pk):
     """Method to add a user to OpenLDAP project - uses signals"""
 
@@ -132,6 +141,7 @@ def add_user_project(project_user_pk):
     add_members_to_openldap_posixgroup(dn, list_memberuids)
 
 
+@openldap_session()
 def remove_user_project(project_user_pk):
     """Method to remove a user from OpenLDAP project - uses signals"""
 
@@ -6,8 +6,13 @@
 
 import logging
 import textwrap
+import threading
+import time
+from contextlib import contextmanager
 
 from ldap3 import MODIFY_ADD, MODIFY_DELETE, MODIFY_REPLACE, Connection, Server, Tls
+from ldap3.core.exceptions import LDAPException
+from ldap3.utils.dn import safe_dn
 
 from coldfront.core.utils.common import import_from_settings
 
@@ -27,9 +32,14 @@ PROJECT_OPENLDAP_ARCHIVE_OU = import_from_settings("PROJECT_OPENLDAP_ARCHIVE_OU"
 
 PROJECT_OPENLDAP_DESCRIPTION_TITLE_LENGTH = import_from_settings("PROJECT_OPENLDAP_DESCRIPTION_TITLE_LENGTH")
 
+PROJECT_OPENLDAP_HEALTH_CHECK_INTERVAL = import_from_settings("PROJECT_OPENLDAP_HEALTH_CHECK_INTERVAL", 60)
+
 # provide a sensible default locally to stop the openldap description being too long
 MAX_OPENLDAP_DESCRIPTION_LENGTH = 250
 
+# maximum number of memberUid values sent in a single modify operation
+MAX_OPENLDAP_MEMBERUID_MODIFY_VALUES = 1000
+
 # Note: SASL not provided currently
 
 tls = None
@@ -60,10 +70,165 @@ def openldap_connection(server_opt, bind_user, bind_password):
         return None
 
 
+# Sessions are per thread, so each thread (e.g. a sync worker) holds its own connection
+_session_local = threading.local()
+
+
+class OpenLDAPSession:
+    """A bound OpenLDAP connection shared by every helper in this module while
+    an openldap_session() is open. The connection is health checked before
+    reuse and rebound if the server dropped it."""
+
+    def __init__(
+        self, server_opt, bind_user, bind_password, health_check_interval=PROJECT_OPENLDAP_HEALTH_CHECK_INTERVAL
+    ):
+        self.server = server_opt
+        self.bind_user = bind_user
+        self.bind_password = bind_password
+        self.health_check_interval = health_check_interval
+        self.conn = None
+        self.last_used = 0
+        self.binds = 0
+
+    def is_healthy(self):
+        """Check the connection is still usable, issuing a WhoAmI if it has been idle"""
+        if self.conn.closed or not self.conn.bound:
+            return False
+
+        if time.monotonic() - self.last_used < self.health_check_interval:
+            return True
+
+        try:
+            self.conn.extend.standard.who_am_i()
+        except LDAPException as e:
+            logger.info("OpenLDAP connection health check failed: %s", e)
+            return False
+
+        return not self.conn.closed
+
+    def connection(self):
+        """Return the shared connection, binding or rebinding as required"""
+        if self.conn is not None and not self.is_healthy():
+            logger.info("Rebinding OpenLDAP connection")
+            self.close()
+
+        if self.conn is None:
+            self.conn = openldap_connection(self.server, self.bind_user, self.bind_password)
+            if self.conn:
+                self.binds += 1
+
+        self.last_used = time.monotonic()
+        return self.conn
+
+    def owns(self, conn):
+        return conn is not None and conn is self.conn
+
+    def close(self):
+        if self.conn is None:
+            return
+
+        try:
+            self.conn.unbind()
+        except LDAPException as exc_log:
+            logger.info(exc_log)
+        finally:
+            self.conn = None
+
+
+@contextmanager
+def openldap_session():
+    """Share one OpenLDAP connection across all helpers called within the
+    block in the current thread. Nested sessions reuse the outer session. Can
+    also be used as a decorator."""
+    session = getattr(_session_local, "session", None)
+    if session is not None:
+        yield session
+        return
+
+    session = OpenLDAPSession(server, PROJECT_OPENLDAP_BIND_USER, PROJECT_OPENLDAP_BIND_PASSWORD)
+    _session_local.session = session
+    try:
+        yield session
+    finally:
+        _session_local.session = None
+        session.close()
+        logger.info("OpenLDAP session closed after %s bind(s)", session.binds)
+
+
+def get_openldap_connection():
+    """Return the current session's connection, or a new connection if no session is open"""
+    session = getattr(_session_local, "session", None)
+    if session is not None:
+        return session.connection()
+
+    return openldap_connection(server, PROJECT_OPENLDAP_BIND_USER, PROJECT_OPENLDAP_BIND_PASSWORD)
+
+
+def release_openldap_connection(conn):
+    """Unbind a connection returned by get_openldap_connection unless it belongs to the open session"""
+    session = getattr(_session_local, "session", None)
+    if session is not None and session.owns(conn):
+        return
+
+    conn.unbind()
+
+
+def modify_posixgroup_memberuids(conn, dn, operation, list_memberuids, chunk_size=MAX_OPENLDAP_MEMBERUID_MODIFY_VALUES):
+    """Add or delete memberUids in a posixGroup using one multi-value modify per chunk of values.
+
+    If a modify is rejected, e.g. because some values are already present
+    (add) or missing (delete), the current memberUids are fetched and only the
+    values that need changing are sent again. Returns a dict with lists of the
+    "succeeded", "skipped" (already present/missing) and "failed" memberUids.
+    """
+    result = {"succeeded": [], "skipped": [], "failed": []}
+    # remove duplicates, keep order
+    member_uids = list(dict.fromkeys(list_memberuids))
+
+    for i in range(0, len(member_uids), chunk_size):
+        chunk = member_uids[i : i + chunk_size]
+        try:
+            if conn.modify(dn, {"memberUid": [(operation, chunk)]}):
+                result["succeeded"].extend(chunk)
+                continue
+
+            # typically some values were already present (attributeOrValueExists) or missing
+            # (noSuchAttribute), retry once with only the values that need changing
+            logger.info("Modify of memberUids in %s was rejected: %s", dn, conn.result.get("description"))
+            conn.search(dn, "(objectclass=posixGroup)", attributes=["memberUid"])
+            current_memberuids = set()
+            for entry in conn.entries:
+                current_memberuids.update(entry.memberUid.values)
+
+            if operation == MODIFY_ADD:
+                pending = [uid for uid in chunk if uid not in current_memberuids]
+            else:
+                pending = [uid for uid in chunk if uid in current_memberuids]
+            result["skipped"].extend([uid for uid in chunk if uid not in pending])
+
+            if not pending:
+                continue
+
+            if conn.modify(dn, {"memberUid": [(operation, pending)]}):
+                result["succeeded"].extend(pending)
+            else:
+                logger.error("Failed to modify memberUids of %s: %s", dn, conn.result.get("description"))
+                result["failed"].extend(pending)
+        except Exception as exc_log:
+            logger.error("Failed to modify memberUids of %s: %s", dn, exc_log)
+            result["failed"].extend(chunk)
+
+    if result["skipped"]:
+        logger.info("memberUids unchanged in %s (already present or missing): %s", dn, result["skipped"])
+    if result["failed"]:
+        logger.warning("memberUids failed to change in %s: %s", dn, result["failed"])
+
+    return result
+
+
 def add_members_to_openldap_posixgroup(dn, list_memberuids, write=True):
-    """Add members to a posixgroup in OpenLDAP"""
-    member_uid = tuple(list_memberuids)
-    conn = openldap_connection(server, PROJECT_OPENLDAP_BIND_USER, PROJECT_OPENLDAP_BIND_PASSWORD)
+    """Add members to a posixgroup in OpenLDAP, returns a dict of succeeded, skipped and failed memberUids"""
+    conn = get_openldap_connection()
 
     if not conn:
         return
@@ -72,19 +237,14 @@ def add_members_to_openldap_posixgroup(dn, list_memberuids, write=True):
         return None
 
     try:
-        for user in member_uid:
-            add_username = user
-            conn.modify(dn, {"memberUid": [(MODIFY_ADD, [add_username])]})
-    except Exception as exc_log:
-        logger.info(exc_log)
+        return modify_posixgroup_memberuids(conn, dn, MODIFY_ADD, list_memberuids)
     finally:
-        conn.unbind()
+        release_openldap_connection(conn)
 
 
 def remove_members_from_openldap_posixgroup(dn, list_memberuids, write=True):
-    """Remove members from a posixgroup in OpenLDAP"""
-    member_uids_tuple = tuple(list_memberuids)
-    conn = openldap_connection(server, PROJECT_OPENLDAP_BIND_USER, PROJECT_OPENLDAP_BIND_PASSWORD)
+    """Remove members from a posixgroup in OpenLDAP, returns a dict of succeeded, skipped and failed memberUids"""
+    conn = get_openldap_connection()
 
     if not conn:
         return
@@ -93,18 +253,14 @@ def remove_members_from_openldap_posixgroup(dn, list_memberuids, write=True):
         return None
 
     try:
-        for user in member_uids_tuple:
-            remove_username = user
-            conn.modify(dn, {"memberUid": [(MODIFY_DELETE, [remove_username])]})
-    except Exception as exc_log:
-        logger.info(exc_log)
+        return modify_posixgroup_memberuids(conn, dn, MODIFY_DELETE, list_memberuids)
     finally:
-        conn.unbind()
+        release_openldap_connection(conn)
 
 
 def add_per_project_ou_to_openldap(project_obj, dn, openldap_ou_description, write=True):
     """Add a per project OU to OpenLDAP - write an OU for a project"""
-    conn = openldap_connection(server, PROJECT_OPENLDAP_BIND_USER, PROJECT_OPENLDAP_BIND_PASSWORD)
+    conn = get_openldap_connection()
 
     if not conn:
         return
@@ -128,12 +284,12 @@ def add_per_project_ou_to_openldap(project_obj, dn, openldap_ou_description, wri
         logger.error(f"OU description - {openldap_ou_description}")
         logger.error(exc_log)
     finally:
-        conn.unbind()
+        release_openldap_connection(conn)
 
 
 def add_posixgroup_to_openldap(dn, openldap_description, gid_int, write=True):
     """Add a posixGroup to OpenLDAP"""
-    conn = openldap_connection(server, PROJECT_OPENLDAP_BIND_USER, PROJECT_OPENLDAP_BIND_PASSWORD)
+    conn = get_openldap_connection()
 
     if not conn:
         return
@@ -154,13 +310,13 @@ def add_posixgroup_to_openldap(dn, openldap_description, gid_int, write=True):
         logger.error(f"posixGroup description - {openldap_description} gidNumber - {gid_int}")
         logger.error(exc_log)
     finally:
-        conn.unbind()
+        release_openldap_connection(conn)
 
 
 # Remove a DN - e.g. DELETE a project OU or posixgroup in OpenLDAP
 def remove_dn_from_openldap(dn, write=True):
     """Remove a DN from OpenLDAP"""
-    conn = openldap_connection(server, PROJECT_OPENLDAP_BIND_USER, PROJECT_OPENLDAP_BIND_PASSWORD)
+    conn = get_openldap_connection()
 
     if not conn:
         return
@@ -173,13 +329,13 @@ def remove_dn_from_openldap(dn, write=True):
     except Exception as exc_log:
         logger.info(exc_log)
     finally:
-        conn.unbind()
+        release_openldap_connection(conn)
 
 
 # Update the project title in OpenLDAP
 def update_posixgroup_description_in_openldap(dn, openldap_description, write=True):
     """Update the description of a posixGroup in OpenLDAP"""
-    conn = openldap_connection(server, PROJECT_OPENLDAP_BIND_USER, PROJECT_OPENLDAP_BIND_PASSWORD)
+    conn = get_openldap_connection()
 
     if not conn:
         return
@@ -192,13 +348,13 @@ def update_posixgroup_description_in_openldap(dn, openldap_description, write=Tr
     except Exception as exc_log:
         logger.info(exc_log)
     finally:
-        conn.unbind()
+        release_openldap_connection(conn)
 
 
 # MOVE the project to an archive OU - defined as env var
 def move_dn_in_openldap(current_dn, relative_dn, destination_ou, write=True):
     """Move a DN to another OU in OpenLDAP"""
-    conn = openldap_connection(server, PROJECT_OPENLDAP_BIND_USER, PROJECT_OPENLDAP_BIND_PASSWORD)
+    conn = get_openldap_connection()
 
     if not conn:
         return
@@ -211,12 +367,12 @@ def move_dn_in_openldap(current_dn, relative_dn, destination_ou, write=True):
     except Exception as exc_log:
         logger.info(exc_log)
     finally:
-        conn.unbind()
+        release_openldap_connection(conn)
 
 
 def ldapsearch_check_project_dn(dn):
     """Check a distinguished name exists and represents a project (posixGroup)"""
-    conn = openldap_connection(server, PROJECT_OPENLDAP_BIND_USER, PROJECT_OPENLDAP_BIND_PASSWORD)
+    conn = get_openldap_connection()
 
     if not conn:
         return
@@ -228,13 +384,13 @@ def ldapsearch_check_project_dn(dn):
         logger.info(exc_log)
         return None
     finally:
-        conn.unbind()
+        release_openldap_connection(conn)
 
 
 # check bind user can see the Project OU or Archive OU - is also used in system setup check script
 def ldapsearch_check_ou(OU):
     """Test that ldapsearch can see an OU"""
-    conn = openldap_connection(server, PROJECT_OPENLDAP_BIND_USER, PROJECT_OPENLDAP_BIND_PASSWORD)
+    conn = get_openldap_connection()
 
     if not conn:
         return
@@ -246,12 +402,12 @@ def ldapsearch_check_ou(OU):
         logger.info(exc_log)
         return None
     finally:
-        conn.unbind()
+        release_openldap_connection(conn)
 
 
 def ldapsearch_get_posixgroup_memberuids(dn):
     """Get memberUids from a posixGroup"""
-    conn = openldap_connection(server, PROJECT_OPENLDAP_BIND_USER, PROJECT_OPENLDAP_BIND_PASSWORD)
+    conn = get_openldap_connection()
 
     if not conn:
         return
@@ -264,12 +420,12 @@ def ldapsearch_get_posixgroup_memberuids(dn):
         logger.info(exc_log)
         return None
     finally:
-        conn.unbind()
+        release_openldap_connection(conn)
 
 
 def ldapsearch_get_description(dn):
     """Get description from an openldap entry"""
-    conn = openldap_connection(server, PROJECT_OPENLDAP_BIND_USER, PROJECT_OPENLDAP_BIND_PASSWORD)
+    conn = get_openldap_connection()
 
     if not conn:
         return
@@ -284,7 +440,56 @@ def ldapsearch_get_description(dn):
         logger.info(exc_log)
         return None
     finally:
-        conn.unbind()
+        release_openldap_connection(conn)
+
+
+def normalize_dn(dn):
+    """Normalize a DN so DNs constructed locally can be matched against DNs returned by OpenLDAP"""
+    return safe_dn(dn).lower()
+
+
+def ldapsearch_get_posixgroups(OU, paged_size=1000):
+    """Get every posixGroup under an OU with one paged subtree search.
+    Returns a dict of normalized DN -> {"dn", "description", "memberUids"}"""
+    conn = get_openldap_connection()
+
+    if not conn:
+        return
+
+    try:
+        entries = conn.extend.standard.paged_search(
+            OU,
+            "(objectclass=posixGroup)",
+            attributes=["description", "memberUid"],
+            paged_size=paged_size,
+            generator=True,
+        )
+
+        posixgroups = {}
+        for entry in entries:
+            if entry.get("type") != "searchResEntry":
+                continue
+
+            attributes = entry.get("attributes", {})
+            description = attributes.get("description")
+            if isinstance(description, list):
+                description = description[0] if description else None
+            member_uids = attributes.get("memberUid") or []
+            if not isinstance(member_uids, list):
+                member_uids = [member_uids]
+
+            posixgroups[normalize_dn(entry["dn"])] = {
+                "dn": entry["dn"],
+                "description": description,
+                "memberUids": tuple(member_uids),
+            }
+
+        return posixgroups
+    except Exception as exc_log:
+        logger.info(exc_log)
+        return None
+    finally:
+        release_openldap_connection(conn)
 
 
 """